@@ -0,0 +1,23 @@
+#! /usr/bin/env bash
+# Same as no_mig_batch_size_block_cv.sh, but runs all the points in one process with the model kept resident.
+# Re-run the script to resume an interrupted sweep, the finished points are skipped.
+GRID_FILE='no_mig_batch_size_block_sweep.json'
+
+BASE_DIR=$(realpath $0 | xargs dirname)
+PYTHON_EXECUTION_ROOT="${BASE_DIR}/../../../mig_perf/profiler"
+DCGM_EXPORTER_METRICS_PATH="${PYTHON_EXECUTION_ROOT}/client/dcp-metrics-included.csv:/etc/dcgm-exporter/customized.csv"
+cd "${PYTHON_EXECUTION_ROOT}"
+export PYTHONPATH="${PYTHON_EXECUTION_ROOT}"
+
+echo 'Start DCGM'
+docker run -d --rm --gpus all --net mig_perf -p 9400:9400  \
+  -v "${DCGM_EXPORTER_METRICS_PATH}:/etc/dcgm-exporter/customized.csv" \
+  --name dcgm_exporter --cap-add SYS_ADMIN   nvcr.io/nvidia/k8s/dcgm-exporter:2.4.7-2.6.11-ubuntu20.04 \
+  -c 500 -f /etc/dcgm-exporter/customized.csv -d f
+sleep 3
+docker ps
+
+python -m bench.sweep "${BASE_DIR}/${GRID_FILE}"
+
+echo 'Stop DCGM'
+docker stop dcgm_exporter
@@ -0,0 +1,57 @@
+#! /usr/bin/env bash
+# Data-parallel training across several small MIG instances against a single larger instance, on the same global
+# batch size. Each layout is a comma separated list of the GPU instance profiles created, one rank per instance.
+GPU_ID=0
+MODEL_NAME='resnet50'
+NUM_TRAIN_BATCHES=500
+GLOBAL_BATCH_SIZE=128
+MIG_LAYOUTS=('1g.10gb' '1g.10gb,1g.10gb' '1g.10gb,1g.10gb,1g.10gb,1g.10gb' '2g.20gb' '2g.20gb,2g.20gb'
+  '3g.40gb' '3g.40gb,3g.40gb' '7g.80gb')
+
+BASE_DIR=$(realpath $0 | xargs dirname)
+EXP_SAVE_DIR="${BASE_DIR}/ddp"
+PYTHON_EXECUTION_ROOT="${BASE_DIR}/../../../mig_perf/profiler"
+DCGM_EXPORTER_METRICS_PATH="${PYTHON_EXECUTION_ROOT}/client/dcp-metrics-included.csv:/etc/dcgm-exporter/customized.csv"
+cd "${PYTHON_EXECUTION_ROOT}"
+export PYTHONPATH="${PYTHON_EXECUTION_ROOT}"
+
+echo 'Enable MIG'
+sudo nvidia-smi -i "${GPU_ID}" -mig 1
+for MIG_LAYOUT in "${MIG_LAYOUTS[@]}"; do
+  NUM_RANKS=$(echo "${MIG_LAYOUT}" | tr ',' '\n' | wc -l)
+  echo '=========================================================='
+  echo " * MIG LAYOUT = ${MIG_LAYOUT}, ${NUM_RANKS} ranks"
+  echo '=========================================================='
+  echo 'Create MIG instances'
+  sudo nvidia-smi mig -i "${GPU_ID}" -cgi "${MIG_LAYOUT}" -C
+
+  echo 'Start DCGM'
+  docker run -d --rm --gpus all --net mig_perf -p 9400:9400  \
+    -v "${DCGM_EXPORTER_METRICS_PATH}:/etc/dcgm-exporter/customized.csv" \
+    --name dcgm_exporter --cap-add SYS_ADMIN nvcr.io/nvidia/k8s/dcgm-exporter:2.4.7-2.6.11-ubuntu20.04 \
+    -c 500 -f /etc/dcgm-exporter/customized.csv -d f
+  sleep 3
+  docker ps
+
+  echo 'Start profiling client 0'
+  # shellcheck disable=SC2046
+  python train/train_cv.py -b "${GLOBAL_BATCH_SIZE}" -m "${MODEL_NAME}" -n "${NUM_TRAIN_BATCHES}" \
+    -i "${GPU_ID}" -mi 0 -dbn "${EXP_SAVE_DIR}/${MIG_LAYOUT//,/_}" \
+    --ddp --procs "${NUM_RANKS}" --ddp-mig-device-ids $(seq 0 $((NUM_RANKS - 1)))
+  echo 'Finish!'
+
+  echo 'Stop DCGM'
+  docker stop dcgm_exporter
+
+  echo 'Destroy MIG instances'
+  sudo nvidia-smi mig -i "${GPU_ID}" -dci
+  sudo nvidia-smi mig -i "${GPU_ID}" -dgi
+
+  sleep 10
+done
+echo 'Disable MIG'
+sudo nvidia-smi -i "${GPU_ID}" -mig 0
+echo 'Reset GPU'
+sudo nvidia-smi -i "${GPU_ID}" -r
+
+python -m bench.ddp_report "${EXP_SAVE_DIR}" --baseline-profile 7g.80gb -o "${EXP_SAVE_DIR}/ddp_scaling.csv"
@@ -0,0 +1,67 @@
+#! /usr/bin/env bash
+# Fill the holes of the batch size comparison on the small MIG profiles: each large effective batch size is also run
+# as accumulated micro-batches of MICRO_BATCH_SIZE, with and without activation checkpointing.
+GPU_ID=0
+MODEL_NAME='resnet50'
+NUM_TRAIN_BATCHES=500
+MIG_PROFILES=('1g.10gb' '2g.20gb' '3g.40gb' '4g.40gb' '7g.80gb')
+EFFECTIVE_BATCH_SIZES=(256 512)
+MICRO_BATCH_SIZE=64
+
+BASE_DIR=$(realpath $0 | xargs dirname)
+EXP_SAVE_DIR="${BASE_DIR}/train_grad_accum"
+PYTHON_EXECUTION_ROOT="${BASE_DIR}/../../../mig_perf/profiler"
+DCGM_EXPORTER_METRICS_PATH="${PYTHON_EXECUTION_ROOT}/client/dcp-metrics-included.csv:/etc/dcgm-exporter/customized.csv"
+cd "${PYTHON_EXECUTION_ROOT}"
+export PYTHONPATH="${PYTHON_EXECUTION_ROOT}"
+
+echo 'Enable MIG'
+sudo nvidia-smi -i "${GPU_ID}" -mig 1
+# Try different MIG profiles
+for MIG_PROFILE in "${MIG_PROFILES[@]}"; do
+  echo '=========================================================='
+  echo " * MIG PROFILE = ${MIG_PROFILE}"
+  echo '=========================================================='
+  echo 'Create MIG instances'
+  sudo nvidia-smi mig -i 0 -cgi "${MIG_PROFILE}" -C
+
+  echo 'Start DCGM'
+  docker run -d --rm --gpus all --net mig_perf -p 9400:9400  \
+    -v "${DCGM_EXPORTER_METRICS_PATH}:/etc/dcgm-exporter/customized.csv" \
+    --name dcgm_exporter --cap-add SYS_ADMIN nvcr.io/nvidia/k8s/dcgm-exporter:2.4.7-2.6.11-ubuntu20.04 \
+    -c 500 -f /etc/dcgm-exporter/customized.csv -d f
+  sleep 3
+  docker ps
+
+  for BATCH_SIZE in "${EFFECTIVE_BATCH_SIZES[@]}"; do
+    GRAD_ACCUM_STEPS=$((BATCH_SIZE / MICRO_BATCH_SIZE))
+    # the full batch may run out of memory on the small profiles
+    for TRAIN_MODE in "-b ${BATCH_SIZE}" "-b ${MICRO_BATCH_SIZE} --grad-accum-steps ${GRAD_ACCUM_STEPS}" \
+      "-b ${BATCH_SIZE} --activation-checkpointing" \
+      "-b ${MICRO_BATCH_SIZE} --grad-accum-steps ${GRAD_ACCUM_STEPS} --activation-checkpointing"; do
+      echo "Effective batch size ${BATCH_SIZE}: ${TRAIN_MODE}"
+      echo 'Start profiling client 0'
+      # shellcheck disable=SC2086
+      python train/train_cv.py -m "${MODEL_NAME}" -n "${NUM_TRAIN_BATCHES}" \
+        -i "${GPU_ID}" -mi 0 -dbn "${EXP_SAVE_DIR}/${MIG_PROFILE}" ${TRAIN_MODE}
+
+      echo 'Finish!'
+      sleep 10
+    done
+  done
+
+  echo 'Stop DCGM'
+  docker stop dcgm_exporter
+
+  echo 'Destroy MIG instances'
+  sudo nvidia-smi mig -i "${GPU_ID}" -dci
+  sudo nvidia-smi mig -i "${GPU_ID}" -dgi
+
+  sleep 10
+done
+echo 'Disable MIG'
+sudo nvidia-smi -i "${GPU_ID}" -mig 0
+echo 'Reset GPU'
+sudo nvidia-smi -i "${GPU_ID}" -r
+
+python -m bench.train_modes_report "${EXP_SAVE_DIR}" -o "${EXP_SAVE_DIR}/train_grad_accum.csv"
@@ -0,0 +1,66 @@
+#! /usr/bin/env bash
+# Step time and memory of the training optimizations on each MIG profile, compared by bench.train_modes_report.
+GPU_ID=0
+MODEL_NAME='resnet50'
+NUM_TRAIN_BATCHES=500
+BATCH_SIZE=64
+MIG_PROFILES=('1g.10gb' '2g.20gb' '3g.40gb' '4g.40gb' '7g.80gb')
+TRAIN_MODES=('' '--amp fp16' '--amp bf16' '--channels-last' '--amp fp16 --channels-last' '--set-to-none'
+  '--optimizer-impl foreach')
+
+BASE_DIR=$(realpath $0 | xargs dirname)
+EXP_SAVE_DIR="${BASE_DIR}/train_modes"
+PYTHON_EXECUTION_ROOT="${BASE_DIR}/../../../mig_perf/profiler"
+DCGM_EXPORTER_METRICS_PATH="${PYTHON_EXECUTION_ROOT}/client/dcp-metrics-included.csv:/etc/dcgm-exporter/customized.csv"
+cd "${PYTHON_EXECUTION_ROOT}"
+export PYTHONPATH="${PYTHON_EXECUTION_ROOT}"
+# the fused SGD needs PyTorch 2.0 or later
+if python -c "import inspect, sys, torch; sys.exit('fused' not in inspect.signature(torch.optim.SGD).parameters)"; then
+  TRAIN_MODES+=('--optimizer-impl fused')
+fi
+
+echo 'Enable MIG'
+sudo nvidia-smi -i "${GPU_ID}" -mig 1
+# Try different MIG profiles
+for MIG_PROFILE in "${MIG_PROFILES[@]}"; do
+  echo '=========================================================='
+  echo " * MIG PROFILE = ${MIG_PROFILE}"
+  echo '=========================================================='
+  echo 'Create MIG instances'
+  sudo nvidia-smi mig -i 0 -cgi "${MIG_PROFILE}" -C
+
+  echo 'Start DCGM'
+  docker run -d --rm --gpus all --net mig_perf -p 9400:9400  \
+    -v "${DCGM_EXPORTER_METRICS_PATH}:/etc/dcgm-exporter/customized.csv" \
+    --name dcgm_exporter --cap-add SYS_ADMIN nvcr.io/nvidia/k8s/dcgm-exporter:2.4.7-2.6.11-ubuntu20.04 \
+    -c 500 -f /etc/dcgm-exporter/customized.csv -d f
+  sleep 3
+  docker ps
+
+  # iterate through the training modes
+  for TRAIN_MODE in "${TRAIN_MODES[@]}"; do
+    echo "Training modes: ${TRAIN_MODE:-default}"
+    echo 'Start profiling client 0'
+    # shellcheck disable=SC2086
+    python train/train_cv.py -b "${BATCH_SIZE}" -m "${MODEL_NAME}" -n "${NUM_TRAIN_BATCHES}" \
+      -i "${GPU_ID}" -mi 0 -dbn "${EXP_SAVE_DIR}/${MIG_PROFILE}" ${TRAIN_MODE}
+
+    echo 'Finish!'
+    sleep 10
+  done
+
+  echo 'Stop DCGM'
+  docker stop dcgm_exporter
+
+  echo 'Destroy MIG instances'
+  sudo nvidia-smi mig -i "${GPU_ID}" -dci
+  sudo nvidia-smi mig -i "${GPU_ID}" -dgi
+
+  sleep 10
+done
+echo 'Disable MIG'
+sudo nvidia-smi -i "${GPU_ID}" -mig 0
+echo 'Reset GPU'
+sudo nvidia-smi -i "${GPU_ID}" -r
+
+python -m bench.train_modes_report "${EXP_SAVE_DIR}" -o "${EXP_SAVE_DIR}/train_modes.csv"
@@ -0,0 +1,68 @@
+#! /usr/bin/env bash
+# Search the max sustainable QPS under a latency SLO for each model x MIG profile,
+# instead of sweeping a fixed list of arrival rates.
+GPU_ID=0
+MODEL_NAMES=('resnet18' 'resnet50' 'resnet101')
+MIG_PROFILES=('1g.6gb' '2g.12gb' '4g.24gb')
+SLO='p99<0.1'
+PROBE_TIME=10
+batch_size=1
+
+BASE_DIR=$(realpath $0 | xargs dirname)
+EXP_SAVE_DIR="${BASE_DIR}/capacity_search"
+PYTHON_EXECUTION_ROOT="${BASE_DIR}/../../../mig_perf/profiler"
+DCGM_EXPORTER_METRICS_PATH="${PYTHON_EXECUTION_ROOT}/client/dcp-metrics-included.csv:/etc/dcgm-exporter/customized.csv"
+cd "${PYTHON_EXECUTION_ROOT}"
+export PYTHONPATH="${PYTHON_EXECUTION_ROOT}"
+
+echo 'Enable MIG'
+sudo nvidia-smi -i "${GPU_ID}" -mig 1
+
+for MIG_PROFILE in "${MIG_PROFILES[@]}"; do
+  echo '=========================================================='
+  echo " * MIG PROFILE = ${MIG_PROFILE}"
+  echo '=========================================================='
+  echo 'Create MIG instances'
+  sudo nvidia-smi mig -i "${GPU_ID}" -cgi "${MIG_PROFILE}" -C
+  sleep 5
+  GPU_INSTANCE_UUID=$(nvidia-smi -L | grep -m 1 -oP 'MIG-[0-9a-f\-]+')
+  GPU_INSTANCE_ID=$(nvidia-smi -i "${GPU_ID}" | grep -m 1 -oP "\|\s+${GPU_ID}\s+\K\d+(?=\s+\d+\s+0\s+\|)")
+
+  echo 'Start DCGM'
+  docker run -d --rm --gpus all --net mig_perf -p 9400:9400  \
+    -v "${DCGM_EXPORTER_METRICS_PATH}:/etc/dcgm-exporter/customized.csv" \
+    --name dcgm_exporter --cap-add SYS_ADMIN nvcr.io/nvidia/k8s/dcgm-exporter:2.4.7-2.6.11-ubuntu20.04 \
+    -c 500 -f /etc/dcgm-exporter/customized.csv -d f
+  sleep 3
+  docker ps
+
+  for MODEL_NAME in "${MODEL_NAMES[@]}"; do
+    echo "Model ${MODEL_NAME}"
+    echo 'Start server0'
+    MAX_BATCH_SIZE="${batch_size}" MAX_WAIT_TIME=10 MODEL_NAME="${MODEL_NAME}" TASK="image_classification" \
+      DEVICE_ID="${GPU_INSTANCE_UUID}" python server/app.py > /dev/null 2>&1 &
+    SERVER0_PID=$!
+    sleep 5
+
+    echo 'Start capacity search'
+    python client/capacity_search.py -m "${MODEL_NAME}" -b "${batch_size}" -P --slo "${SLO}" \
+      --probe-time "${PROBE_TIME}" -i "${GPU_ID}" -gi "${GPU_INSTANCE_ID}" -dbn "${EXP_SAVE_DIR}/${MIG_PROFILE}"
+
+    echo 'Cleaning up...'
+    kill $SERVER0_PID
+    sleep 10
+  done
+
+  echo 'Stop DCGM'
+  docker stop dcgm_exporter
+
+  echo 'Destroy MIG instances'
+  sudo nvidia-smi mig -i "${GPU_ID}" -dci
+  sudo nvidia-smi mig -i "${GPU_ID}" -dgi
+  sleep 10
+done
+
+echo 'Disable MIG'
+sudo nvidia-smi -i "${GPU_ID}" -mig 0
+echo 'Reset GPU'
+sudo nvidia-smi -i "${GPU_ID}" -r
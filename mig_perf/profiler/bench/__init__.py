@@ -0,0 +1,5 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark engine shared by the inference and training harnesses, with pluggable workloads.
+"""
@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Run a benchmark workload by name.
+
+Examples:
+    python -m bench cv_infer -b 1 -m resnet50 -n 1000
+    python -m bench nlp_train -b 32 -m bert-base-cased -n 500 --seq_len 64
+"""
+import sys
+
+from bench.engine import main
+from bench.workloads import WORKLOADS
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in WORKLOADS:
+        print(f'Usage: python -m bench {{{",".join(WORKLOADS)}}} [args...]')
+        exit(2)
+    main(WORKLOADS[sys.argv.pop(1)])
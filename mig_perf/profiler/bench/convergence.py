@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Convergence-based warm-up and adaptive stopping of the benchmark engine.
+
+Warm-up ends once the coefficient of variation (std / mean) of the latencies in a rolling window drops below
+`--warm-up-cv`. Measurement stops once the confidence intervals of both the mean and the p99 latency are within
+`--target-ci` of their estimates, bounded by `--min-steps` and the step number of the workload.
+"""
+import math
+from collections import deque
+
+from utils.histogram import LatencyHistogram
+
+
+class WarmUpMonitor(object):
+    """Detect a stabilized latency by the coefficient of variation over a rolling window.
+
+    Args:
+        window (int): Number of latest steps in the rolling window.
+        threshold (float): Warm-up is converged once the coefficient of variation is below this value.
+    """
+
+    def __init__(self, window: int = 20, threshold: float = 0.05):
+        self.window = window
+        self.threshold = threshold
+        self.latencies = deque(maxlen=window)
+        self.cv = math.nan
+
+    def add(self, latency: float):
+        """Add the latency of a warm-up step, and return True if the latency has stabilized."""
+        self.latencies.append(latency)
+        if len(self.latencies) < self.window:
+            return False
+        mean = sum(self.latencies) / self.window
+        std = math.sqrt(sum((x - mean) ** 2 for x in self.latencies) / self.window)
+        self.cv = std / mean if mean > 0 else math.inf
+        return self.cv < self.threshold
+
+
+class StoppingRule(object):
+    """Stop measuring once the confidence intervals of the mean and p99 latency are tight enough.
+
+    Args:
+        target (float): Max relative half width of the confidence intervals, e.g. 0.05 for +-5%.
+        confidence (float): Confidence level of the intervals. Default to 0.95.
+        min_steps (int): Never stop before this many timed steps. Default to 50.
+        check_every (int): Check the intervals every this many timed steps. Default to 10.
+    """
+
+    def __init__(self, target: float, confidence: float = 0.95, min_steps: int = 50, check_every: int = 10):
+        self.target = target
+        self.confidence = confidence
+        self.min_steps = min_steps
+        self.check_every = check_every
+
+    def relative_widths(self, hist: LatencyHistogram):
+        """Relative half widths of the confidence intervals of the mean and the p99."""
+        hist = hist.snapshot()
+        mean_lo, mean_hi = hist.mean_ci(self.confidence)
+        p99_lo, p99_hi = hist.percentile_ci(99, self.confidence)
+        return {
+            'mean': (mean_hi - mean_lo) / 2 / hist.mean if hist.mean > 0 else math.inf,
+            'p99': (p99_hi - p99_lo) / 2 / hist.percentile(99) if hist.count else math.inf,
+        }
+
+    def should_stop(self, hist: LatencyHistogram):
+        if hist.count < self.min_steps or hist.count % self.check_every != 0:
+            return False
+        return all(width <= self.target for width in self.relative_widths(hist).values())
+
+
+def add_convergence_arguments(parser):
+    """Register the warm-up and stopping arguments on an `argparse.ArgumentParser`."""
+    parser.add_argument('--warm-up-steps', type=int, default=100,
+                        help='Number of warm up steps, or the max number of them with --warm-up-cv. Default to 100.')
+    parser.add_argument('--warm-up-cv', type=float, default=None,
+                        help='End warm-up once the coefficient of variation of the latencies in the rolling window '
+                             'is below this value, e.g. 0.05. Default to run all the --warm-up-steps.')
+    parser.add_argument('--warm-up-window', type=int, default=20,
+                        help='Rolling window of the warm-up convergence check in steps. Default to 20.')
+    parser.add_argument('--target-ci', type=float, default=None,
+                        help='Stop measuring once the confidence intervals of the mean and p99 latency are within '
+                             'this relative half width, e.g. 0.05. The step number (-n) is the upper bound. '
+                             'Default to run all the steps.')
+    parser.add_argument('--ci-confidence', type=float, default=0.95,
+                        help='Confidence level of the intervals. Default to 0.95.')
+    parser.add_argument('--min-steps', type=int, default=50,
+                        help='Min number of timed steps per worker before --target-ci can stop. Default to 50.')
+    return parser
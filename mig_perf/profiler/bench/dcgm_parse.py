@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark the parsing and the storage of the dcgm-exporter scrapes on a synthetic exposition.
+
+The exposition has the fields of `client/dcp-metrics-included.csv` for each MIG instance of each GPU, labelled as
+dcgm-exporter does. It is parsed by the generic `prometheus_client` parser, the previous implementation, and by
+`client.monitor.DCGMTextParser` with all the fields, and with the fields filtered to `--fields` of a single instance.
+The storage compares a list of per-scrape dicts, consolidated after a `deepcopy` into the result format, against a
+`ColumnarMetricStore` converted into the same format. Both store the same scrape, parsed once beforehand with the
+filtered fields, so that only the storage and the conversion are timed.
+
+Examples:
+    python -m bench.dcgm_parse
+    python -m bench.dcgm_parse --gpus 8 --instances 7 --scrapes 600 --fields DCGM_FI_PROF_GR_ENGINE_ACTIVE
+"""
+import argparse
+import csv
+import random
+import timeit
+from collections import defaultdict
+from copy import deepcopy
+from pathlib import Path
+
+from prometheus_client.parser import text_string_to_metric_families
+
+from client.monitor import ColumnarMetricStore, DCGMTextParser, gpu_metrics_arrays_to_dict
+from utils.misc import consolidate_list_of_dict, print_table
+
+FIELDS_CSV = Path(__file__).parent.parent / 'client' / 'dcp-metrics-included.csv'
+DEFAULT_FIELDS = ('DCGM_FI_PROF_GR_ENGINE_ACTIVE', 'DCGM_FI_DEV_FB_USED', 'DCGM_FI_DEV_POWER_USAGE')
+TABLE_COLUMNS = ('case', 'ms_per_scrape', 'speedup')
+
+
+def load_fields(path=FIELDS_CSV):
+    """(name, type, help) of the DCGM fields exported by the dcgm-exporter configuration."""
+    fields = list()
+    with open(path) as f:
+        for row in csv.reader(f):
+            if row and row[0].strip() and not row[0].startswith('#'):
+                fields.append(tuple(cell.strip() for cell in row[:3]))
+    return fields
+
+
+def make_exposition(num_gpus, num_instances, fields, seed=0):
+    """A scrape of dcgm-exporter on `num_gpus` GPUs of `num_instances` MIG instances each."""
+    rng = random.Random(seed)
+    lines = list()
+    for name, metric_type, help_text in fields:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for gpu_id in range(num_gpus):
+            for gpu_instance_id in range(num_instances):
+                labels = (
+                    f'gpu="{gpu_id}",UUID="GPU-{gpu_id:08x}-4b3e-e4ad-650a-4c5a3692b72f",device="nvidia{gpu_id}",'
+                    f'modelName="NVIDIA A100-SXM4-80GB",GPU_I_PROFILE="1g.10gb",GPU_I_ID="{gpu_instance_id}",'
+                    f'Hostname="2e140b568f0c"'
+                )
+                value = rng.randint(0, 10 ** 6) if metric_type == 'counter' else round(rng.uniform(0, 100), 6)
+                lines.append(f'{name}{{{labels}}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def generic_parse(text):
+    """The previous parser by `prometheus_client`, in the format of `client.monitor.dcgm_gpu_metric_parser`."""
+    gpu_metrics_dict = defaultdict(dict)
+    for family in text_string_to_metric_families(text):
+        for sample in family.samples:
+            labels = sample.labels
+            gpu_instance_id = int(labels['GPU_I_ID']) if labels.get('GPU_I_ID', None) else None
+            metrics = gpu_metrics_dict[int(labels['gpu']), gpu_instance_id]
+            if not metrics:
+                metrics['labels'] = labels
+            metrics[sample.name] = sample.value
+    return gpu_metrics_dict
+
+
+def check_equal(text):
+    """Check the parsers extracting the same values."""
+    expected = generic_parse(text)
+    parser = DCGMTextParser()
+    values = parser.parse(text)
+    assert set(values) == set(expected), 'Different GPU instances parsed'
+    for key, metrics in expected.items():
+        assert parser.labels[key] == metrics.pop('labels'), f'Different labels of {key}'
+        assert values[key] == metrics, f'Different values of {key}'
+
+
+def time_per_call(fn, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parsing and storage time of the dcgm-exporter scrapes')
+    parser.add_argument('--gpus', type=int, default=8, help='Number of GPUs. Default to 8.')
+    parser.add_argument('--instances', type=int, default=7, help='Number of MIG instances per GPU. Default to 7.')
+    parser.add_argument('--fields', type=str, nargs='+', default=DEFAULT_FIELDS,
+                        help=f'Fields of the filtered parser. Default to {" ".join(DEFAULT_FIELDS)}.')
+    parser.add_argument('--scrapes', type=int, default=600,
+                        help='Number of scrapes stored, e.g. 1 minute at 100 ms. Default to 600.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of repeats, the fastest kept. Default to 5.')
+    args = parser.parse_args()
+
+    text = make_exposition(args.gpus, args.instances, load_fields())
+    check_equal(text)
+    instance = (0, 0)
+    print(f'Exposition of {args.gpus} GPUs x {args.instances} instances: {len(text.splitlines())} lines, '
+          f'{len(text) / 1024:.1f} KiB')
+
+    # the fast parsers are reused across the scrapes as by the collector, with the label strings already parsed
+    parse_cases = {
+        'generic parser': generic_parse,
+        'fast parser, all fields': DCGMTextParser().parse,
+        'fast parser, all fields of 1 instance': DCGMTextParser(instances=[instance]).parse,
+        f'fast parser, {len(args.fields)} fields of 1 instance':
+            DCGMTextParser(fields=args.fields, instances=[instance]).parse,
+    }
+    rows = list()
+    for case, parse in parse_cases.items():
+        parse(text)
+        rows.append({'case': case, 'seconds': time_per_call(lambda: parse(text), args.repeat)})
+
+    # store the same parsed scrape and convert the scrapes to the result format
+    fast_parser = DCGMTextParser(fields=args.fields, instances=[instance])
+    values = fast_parser.parse(text)
+    labels = fast_parser.labels
+
+    def store_list():
+        samples = list()
+        for i in range(args.scrapes):
+            sample = {key: {'labels': labels[key], **metrics} for key, metrics in values.items()}
+            sample['time'] = float(i)
+            samples.append(sample)
+        return consolidate_list_of_dict(deepcopy(samples), depth=2)
+
+    def store_columnar():
+        store = ColumnarMetricStore()
+        for i in range(args.scrapes):
+            store.append(float(i), values)
+        return gpu_metrics_arrays_to_dict(*store.to_arrays(), labels)
+
+    for case, fn in {'list of dicts + deepcopy': store_list, 'columnar store': store_columnar}.items():
+        seconds = time_per_call(fn, max(args.repeat // 2, 1))
+        rows.append({'case': f'{case}, {args.scrapes} scrapes', 'seconds': seconds / args.scrapes})
+
+    for i, row in enumerate(rows):
+        # speedup over the generic parser, or over the list of dicts
+        baseline = rows[0 if i < len(parse_cases) else len(parse_cases)]['seconds']
+        row.update({'ms_per_scrape': row['seconds'] * 1e3, 'speedup': baseline / row['seconds']})
+    print_table(rows, columns=TABLE_COLUMNS)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Data-parallel training of the training workloads with `DistributedDataParallel`, one rank per `--procs` process.
+
+`--bs` is the global batch size, split evenly among the ranks, so that a run on N ranks is compared with a single
+rank on the same global batch. With `--ddp-mig-device-ids`, each rank runs on its own MIG device of GPU `-i`, and
+with `--ddp-gpu-ids` on its own full GPU. Otherwise, all the ranks share the device of the run.
+
+The `auto` backend is NCCL across full GPUs and gloo otherwise. Gloo is used across MIG devices and on CPU.
+
+The all-reduce of each gradient bucket is timed by a DDP communication hook, with CUDA events on CUDA and with the
+host clock on CPU. The bucket durations of a step are summed into the `allreduce_time` phase. This phase overlaps
+the backward phase instead of following it.
+
+Each rank reads its own share of the training data, with `os.cpu_count() / --procs` loader workers. The GPU metrics
+are collected on the devices of all the ranks.
+
+Examples:
+    python train/train_cv.py -m resnet50 -b 128 -n 500 --ddp --procs 2 -i 0 --ddp-mig-device-ids 0 1
+    python train/train_cv.py -m resnet18 -b 64 -n 50 --device cpu --ddp --procs 4
+"""
+import os
+import time
+
+import torch
+import torch.distributed as dist
+from torch.distributed.algorithms.ddp_comm_hooks import default_hooks
+from torch.nn.parallel import DistributedDataParallel
+
+from utils.misc import get_gpu_device_uuid, get_ids_from_mig_device_id
+
+DDP_BACKENDS = ('auto', 'gloo', 'nccl')
+
+
+def get_ddp_config(args):
+    """Validate the DDP arguments and resolve the backend and the device of each rank."""
+    world_size = args.procs
+    if args.bs % world_size != 0:
+        raise ValueError(f'The global batch size {args.bs} is not divisible by the {world_size} ranks')
+    if args.target_ci or args.early_stop:
+        raise ValueError('--target-ci and --early-stop may stop the ranks at different steps, not supported by DDP')
+    if args.ddp_mig_device_ids and args.ddp_gpu_ids:
+        raise ValueError('Only one of --ddp-mig-device-ids and --ddp-gpu-ids can be given')
+    rank_device_ids = args.ddp_mig_device_ids or args.ddp_gpu_ids
+    device_uuids, metric_instances = None, None
+    if rank_device_ids:
+        if args.device != 'cuda':
+            raise ValueError('--ddp-mig-device-ids and --ddp-gpu-ids require --device cuda')
+        if len(rank_device_ids) != world_size:
+            raise ValueError(f'{len(rank_device_ids)} devices given for {world_size} ranks')
+        if args.ddp_mig_device_ids:
+            device_uuids = [get_gpu_device_uuid(args.gpu_id, mig_device_id) for mig_device_id in rank_device_ids]
+            metric_instances = [
+                (args.gpu_id, get_ids_from_mig_device_id(args.gpu_id, mig_device_id)[0])
+                for mig_device_id in rank_device_ids
+            ]
+        else:
+            device_uuids = [get_gpu_device_uuid(gpu_id) for gpu_id in rank_device_ids]
+            metric_instances = [(gpu_id, None) for gpu_id in rank_device_ids]
+        assert None not in device_uuids, f'Cannot find the device UUIDs of {rank_device_ids}'
+    backend = args.ddp_backend
+    if backend == 'auto':
+        backend = 'nccl' if args.ddp_gpu_ids else 'gloo'
+    if backend == 'nccl' and args.device != 'cuda':
+        raise ValueError('The NCCL backend requires --device cuda')
+    return {
+        'world_size': world_size, 'backend': backend, 'global_batch_size': args.bs,
+        'per_rank_batch_size': args.bs // world_size, 'mig_device_ids': args.ddp_mig_device_ids,
+        'gpu_ids': args.ddp_gpu_ids, 'device_uuids': device_uuids, 'metric_instances': metric_instances,
+        'port': args.ddp_port,
+    }
+
+
+def init_ddp_process(config, rank):
+    """Join the process group of the ranks. Must be called before CUDA is initialized in the process, as it masks
+    the CUDA devices other than the one of the rank."""
+    if config['device_uuids'] is not None:
+        os.environ['CUDA_DEVICE_ORDER'] = 'PCI_BUS_ID'
+        os.environ['CUDA_VISIBLE_DEVICES'] = config['device_uuids'][rank]
+    if dist.is_initialized():
+        # e.g., the next point of a sweep in the same process
+        return
+    os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+    os.environ['MASTER_PORT'] = str(config['port'])
+    dist.init_process_group(config['backend'], rank=rank, world_size=config['world_size'])
+
+
+class AllReduceTimer(object):
+    """A DDP communication hook all-reducing the gradient buckets as the default hook, and timing each bucket.
+
+    Args:
+        device (utils.device.Device): The device of the gradients.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.intervals = list()
+
+    def clock(self):
+        if self.device.is_cuda:
+            event = torch.cuda.Event(enable_timing=True)
+            event.record()
+            return event
+        return time.perf_counter()
+
+    def hook(self, process_group, bucket):
+        start = self.clock()
+
+        def done(fut):
+            # the current stream of the callback waits for the all-reduce on CUDA
+            self.intervals.append((start, self.clock()))
+            return fut.value()
+
+        return default_hooks.allreduce_hook(process_group, bucket).then(done)
+
+    def take(self):
+        """Return a callable resolving the total all-reduce time in seconds of the buckets since the last call,
+        once the step is complete."""
+        intervals, self.intervals = self.intervals, list()
+        if self.device.is_cuda:
+            return lambda: sum(start.elapsed_time(end) for start, end in intervals) * 1e-3
+        return lambda: sum(end - start for start, end in intervals)
+
+
+def wrap_ddp(model, device):
+    """Wrap the model on the device in `DistributedDataParallel` with a timed all-reduce. Return the wrapped
+    model and its `AllReduceTimer`."""
+    # the buffers are not broadcast at each forward, so that the no-grad warm-up steps need no collective
+    ddp_model = DistributedDataParallel(
+        model, device_ids=[torch.cuda.current_device()] if device.is_cuda else None, broadcast_buffers=False,
+    )
+    timer = AllReduceTimer(device)
+    ddp_model.register_comm_hook(None, timer.hook)
+    return ddp_model, timer
+
+
+def add_ddp_arguments(parser):
+    """Register the DDP related arguments on an `argparse.ArgumentParser`."""
+    parser.add_argument('--ddp', action='store_true',
+                        help='Train with DistributedDataParallel on --procs ranks, splitting --bs among them.')
+    parser.add_argument('--ddp-backend', type=str, default='auto', choices=DDP_BACKENDS,
+                        help='Process group backend. Default to auto, NCCL across full GPUs and gloo otherwise.')
+    parser.add_argument('--ddp-mig-device-ids', type=int, nargs='+', default=None,
+                        help='MIG device ID of GPU -i of each rank.')
+    parser.add_argument('--ddp-gpu-ids', type=int, nargs='+', default=None, help='Full GPU ID of each rank.')
+    parser.add_argument('--ddp-port', type=int, default=29500,
+                        help='Port of the rendezvous of the ranks. Default to 29500.')
+    return parser
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Scaling of the data-parallel training results of `bench.ddp` across the ranks.
+
+The results of the same model, global batch size, sequence length and data source are grouped. Each DDP result
+on N ranks is compared with the single rank result on the same GPU instance profile: the speedup of the
+throughput, and the scaling efficiency, the speedup divided by N. With `--baseline-profile`, the results are also
+compared with the single rank result on that profile, e.g. N ranks on 1g.10gb instances against one 7g.80gb
+instance.
+
+Examples:
+    python train/train_cv.py -m resnet50 -n 500 -b 128 -i 0 -mi 0 -dbn results/ddp --ddp
+    python train/train_cv.py -m resnet50 -n 500 -b 128 -i 0 -mi 0 -dbn results/ddp --ddp --procs 2 \
+        --ddp-mig-device-ids 0 1
+    python -m bench.ddp_report results/ddp --baseline-profile 7g.80gb
+"""
+import argparse
+
+from utils.misc import (
+    STEP_LATENCY_METRIC, add_report_arguments, gpu_instance_profile, latest_results, load_results, report_rows,
+)
+
+GROUP_FIELDS = ('model_name', 'batch_size', 'sequence_length', 'data_source')
+TABLE_COLUMNS = ('gpu_instance_profile', 'model_name', 'batch_size', 'sequence_length', 'world_size', 'backend',
+                 'max_rank_step_latency', 'allreduce_share', 'qps', 'speedup', 'scaling_efficiency',
+                 'speedup_vs_baseline')
+
+
+def world_size(result):
+    """Number of data-parallel ranks, None for the multi-process results without DDP."""
+    if result.get('ddp') is not None:
+        return result['ddp']['world_size']
+    return 1 if result['procs'] == 1 else None
+
+
+def compare(results, statistic='mean', baseline_profile=None):
+    """Compare each result with the single rank results of its group."""
+    # keep the latest result of a profile and world size
+    groups = latest_results(
+        [result for result in results if world_size(result) is not None],
+        group_key=lambda result: tuple(result.get(name) for name in GROUP_FIELDS),
+        key=lambda result: (gpu_instance_profile(result), world_size(result)),
+    )
+    rows = list()
+    for group_key, group in groups.items():
+        baseline = group.get((baseline_profile, 1)) if baseline_profile else None
+        for (profile, size), result in sorted(group.items(), key=lambda item: (str(item[0][0]), item[0][1])):
+            single = group.get((profile, 1))
+            step = result[f'{STEP_LATENCY_METRIC}_{statistic}']
+            allreduce = result.get(f'allreduce_time_{statistic}')
+            speedup = result['qps'] / single['qps'] if single is not None else None
+            row = dict(zip(GROUP_FIELDS, group_key))
+            row.update({
+                'gpu_instance_profile': profile, 'world_size': size,
+                'backend': result['ddp']['backend'] if result.get('ddp') else None,
+                'step_latency': step,
+                'max_rank_step_latency': max(w[f'{STEP_LATENCY_METRIC}_{statistic}'] for w in result['workers']),
+                'min_rank_step_latency': min(w[f'{STEP_LATENCY_METRIC}_{statistic}'] for w in result['workers']),
+                'allreduce_time': allreduce, 'allreduce_share': allreduce / step if allreduce is not None else None,
+                'qps': result['qps'], 'speedup': speedup,
+                'scaling_efficiency': speedup / size if speedup is not None else None,
+                'speedup_vs_baseline': result['qps'] / baseline['qps'] if baseline is not None else None,
+            })
+            rows.append(row)
+    return rows
+
+
+def main():
+    parser = add_report_arguments(argparse.ArgumentParser(description='Scaling of the data-parallel training results'))
+    parser.add_argument('--baseline-profile', type=str, default=None,
+                        help='Also compare with the single rank results on this GPU instance profile.')
+    args = parser.parse_args()
+
+    rows = compare(
+        load_results(args.results, required_fields=('data_source', f'{STEP_LATENCY_METRIC}_mean')),
+        statistic=args.statistic, baseline_profile=args.baseline_profile,
+    )
+    report_rows(rows, TABLE_COLUMNS, output=args.output, empty_message='No training result found')
+
+
+if __name__ == '__main__':
+    main()
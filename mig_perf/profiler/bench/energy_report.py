@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Rank the GPU (instance) layouts of a workload by the energy efficiency of their results, computed by
+`utils.energy` over the measurement window.
+
+The results of the same workload (training or inference, model, batch size, sequence length and task) are grouped,
+keeping the latest result of each GPU model, MIG profile and number of processes. The layouts of a group are ranked
+by the samples per joule, and compared with the most efficient one. On a MIG-enabled GPU, the energy is the share of
+the GPU energy estimated for the instances of the run by their graphics engine activity, reported by `energy_scope`
+as e.g. `instance (gract-share estimate, 14%)`. Without the activity of all the instances, e.g. from NVML, it is
+that of the whole GPU, including its idle sibling instances, e.g. `gpu/7 instances`.
+
+Examples:
+    python -m bench cv_infer -m resnet50 -b 32 -n 1000 -i 0 -mi 0 -dbn results/energy
+    python -m bench.energy_report results/energy -o energy.csv
+"""
+import argparse
+
+from utils.misc import add_report_arguments, gpu_instance_profile, latest_results, load_results, report_rows
+
+GROUP_FIELDS = ('mode', 'model_name', 'batch_size', 'sequence_length', 'task')
+TABLE_COLUMNS = ('gpu_instance_profile', 'mode', 'model_name', 'batch_size', 'sequence_length', 'procs', 'qps',
+                 'avg_power_w', 'j_per_sample', 'samples_per_j', 'relative_efficiency', 'energy_scope',
+                 'energy_method')
+
+
+def mode(result):
+    return 'train' if 'train_modes' in result else 'infer'
+
+
+def energy(result):
+    """(energy in J, average power in W, J per sample, samples per J) of a result, the estimate of its MIG
+    instances if any, else of its GPUs."""
+    prefix = 'instance_' if 'instance_samples_per_j' in result else ''
+    return tuple(result[prefix + name] for name in ('energy_j', 'avg_power_w', 'j_per_sample', 'samples_per_j'))
+
+
+def energy_scope(result):
+    """What the energy is measured on, e.g. `instance (gract-share estimate, 14%)` for the estimated share of the
+    MIG instances of the run, or `gpu/7 instances` for the whole GPU of 7 MIG instances."""
+    if 'instance_samples_per_j' in result:
+        return f'instance ({result["instance_energy_method"]}, {result["energy_share"]:.0%})'
+    num_gpus = result.get('energy_gpus', 1)
+    scope = 'gpu' if num_gpus == 1 else f'{num_gpus} gpus'
+    mig = result['config']['mig']
+    if mig.get('enabled'):
+        scope += f'/{len(mig.get("gpu_instance_profiles") or [None])} instances'
+    return scope
+
+
+def compare(results):
+    """Rank the layouts of each workload by the samples per joule."""
+    groups = latest_results(
+        results, group_key=lambda result: tuple(dict(result, mode=mode(result)).get(name) for name in GROUP_FIELDS),
+        key=lambda result: (result['gpu_model_name'], gpu_instance_profile(result), result.get('procs', 1)),
+    )
+    rows = list()
+    for group_key, group in groups.items():
+        best = max(energy(result)[3] for result in group.values())
+        ranked = sorted(group.items(), key=lambda item: -energy(item[1])[3])
+        for rank, ((gpu_model_name, profile, procs), result) in enumerate(ranked, 1):
+            energy_j, avg_power_w, j_per_sample, samples_per_j = energy(result)
+            row = dict(zip(GROUP_FIELDS, group_key))
+            row.update({
+                'gpu_model_name': gpu_model_name, 'gpu_instance_profile': profile, 'procs': procs, 'rank': rank,
+                'qps': result['qps'], 'avg_power_w': avg_power_w, 'energy_j': energy_j,
+                'j_per_sample': j_per_sample, 'samples_per_j': samples_per_j,
+                'relative_efficiency': samples_per_j / best, 'energy_scope': energy_scope(result),
+                'energy_method': result['energy_method'], 'energy_coverage': result['energy_coverage'],
+            })
+            rows.append(row)
+    return rows
+
+
+def main():
+    parser = add_report_arguments(
+        argparse.ArgumentParser(description='Energy efficiency of the GPU (instance) layouts'), statistic=False,
+    )
+    args = parser.parse_args()
+
+    rows = compare(load_results(args.results, required_fields=('samples_per_j',)))
+    if not report_rows(rows, TABLE_COLUMNS, output=args.output, empty_message='No result with the energy found'):
+        return
+    if any(row['energy_scope'].startswith('instance') for row in rows):
+        print('Note: the energy of a MIG instance is estimated from its share of the graphics engine activity of '
+              'its GPU, which meters the energy of the whole GPU only.')
+    if any('/' in row['energy_scope'] for row in rows):
+        print('Note: a MIG layout without the activity of all the instances of its GPU is charged the energy of the '
+              'whole GPU, including the idle sibling instances.')
+
+
+if __name__ == '__main__':
+    main()
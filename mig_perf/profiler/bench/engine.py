@@ -0,0 +1,746 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark engine owning the warm-up, timing, metric collection and result writing of every harness.
+
+A harness is a `Workload` plugin supplying the inputs and a step function, for example:
+    >>> class MyWorkload(Workload):
+    ...     name = 'my_workload'
+    ...     def iter_inputs(self, worker_id):
+    ...         return itertools.repeat(self.inputs, self.num_steps)
+    ...     def step(self, inputs, timer):
+    ...         self.model(inputs)
+    ...         return len(inputs)
+    >>> main(MyWorkload)
+"""
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from queue import Empty
+from threading import BrokenBarrierError, Lock
+from typing import Iterable, List
+
+import torch
+from tqdm import tqdm
+
+from bench.convergence import StoppingRule, WarmUpMonitor, add_convergence_arguments
+from bench.module_profile import ModuleStats, add_module_profile_arguments, get_module_profiler
+from bench.timing import NullStepTimer, StepTimer, add_timing_arguments, get_step_timer_cls
+from client.monitor import add_dcgm_arguments, build_metric_collector
+from utils.device import (
+    Device, PeakMemoryMonitor, add_device_arguments, get_cpu_static_profile, mask_cuda_devices, setup_device_args,
+)
+from utils.energy import instance_energy, summarize_energy
+from utils.histogram import LatencyHistogram
+from utils.live_metrics import LiveReporter, add_live_report_arguments
+from utils.prefetcher import PrefetchStats
+from utils.timeline import Timeline, add_timeline_arguments, summarize_timeline
+
+
+class Workload(object):
+    """Base class of a benchmark workload plugin.
+
+    Args:
+        args (argparse.Namespace): Parsed arguments, including the ones added by `add_arguments`.
+        device (Device): The device to run the workload on.
+        rank (int): Rank of the process in the `--procs` mode. Default to 0.
+    """
+    name: str = None
+    description: str = None
+    # the first metric is the end-to-end step latency, the others are phases marked by `StepTimer`
+    timing_metric_names = ('latency',)
+    completed_key = 'num_completed_batches'
+    # count the time spent in fetching the next input (e.g., data loading) into the step latency
+    time_input_fetching = False
+
+    def __init__(self, args, device: Device, rank: int = 0):
+        self.args = args
+        self.device = device
+        self.rank = rank
+
+    @staticmethod
+    def add_arguments(parser: argparse.ArgumentParser):
+        """Register the workload specific arguments."""
+        pass
+
+    @property
+    def num_steps(self):
+        """Number of steps each worker runs, 0 for exhausting `iter_inputs`."""
+        return 0
+
+    @property
+    def num_workers(self):
+        """Number of workers running the steps concurrently."""
+        return 1
+
+    def setup(self):
+        """Load the model and data, called once in each process running the workload."""
+        pass
+
+    def prepare(self):
+        """Called before each benchmark run, e.g., to rebuild the model and optimizer."""
+        pass
+
+    def warm_up_inputs(self) -> Iterable:
+        return self.iter_inputs(0)
+
+    def warm_up_step(self, inputs, timer: StepTimer):
+        self.step(inputs, timer)
+
+    def iter_inputs(self, worker_id: int) -> Iterable:
+        raise NotImplementedError
+
+    def step(self, inputs, timer: StepTimer) -> int:
+        """Run one step on the inputs and return the number of processed samples."""
+        raise NotImplementedError
+
+    def profiled_module(self):
+        """The model whose modules the step time is attributed to by `--module-profile`, None if not supported."""
+        return None
+
+    def metric_instances(self):
+        """(gpu_id, gpu_instance_id) of the GPU (instances) used by the workload besides the device of the run,
+        whose metrics are collected too. None if only the device of the run is used."""
+        return None
+
+    def prefetch_stats(self, worker_id: int):
+        """The `PrefetchStats` of the inputs of a worker after its steps, None if the inputs are not prefetched."""
+        return None
+
+    def result_fields(self) -> dict:
+        """Workload specific fields of the result."""
+        return dict()
+
+    def file_name_parts(self, result: dict) -> List[str]:
+        """Parts of the result file name following the GPU and model names."""
+        return [f'bs{result["batch_size"]}']
+
+
+def get_parser(workload_cls):
+    parser = argparse.ArgumentParser(description=workload_cls.description)
+    parser.add_argument('-m', '--model', type=str, required=True,
+                        help='Name of the used models. For example, resnet18 or bert-base-cased.')
+    workload_cls.add_arguments(parser)
+    parser.add_argument('--procs', type=int, default=1,
+                        help='Number of processes to run the workload, each with its own model copy. '
+                             'Default to 1, running all the workers as threads of a single process.')
+    # GPU related arguments
+    parser.add_argument(
+        '-i', '--gpu-id', type=int, default=0,
+        help='GPU ID. Default to 0. This is only for record purpose.'
+    )
+    parser.add_argument(
+        '-mi', '--mig-device-id', type=int, default=None,
+        help='MIG device ID. Specified when MIG is enabled.'
+    )
+    # experiment settings
+    parser.add_argument('-dbn', '--database_name', type=str, default='test',
+                        help='The database name you record data to. Default to test.')
+    parser.add_argument('--report-suffix', type=str, default='',
+                        help='The suffix of the record saving file name')
+    parser.add_argument('--save-raw-latency', action='store_true',
+                        help='Dump every raw timing sample into the result file.')
+    parser.add_argument('--dry-run', action='store_true', help='Dry running the experiment without save result.')
+    add_device_arguments(parser)
+    add_convergence_arguments(parser)
+    add_timing_arguments(parser)
+    add_module_profile_arguments(parser)
+    add_live_report_arguments(parser)
+    add_dcgm_arguments(parser)
+    add_timeline_arguments(parser)
+    return parser
+
+
+def get_args(workload_cls, argv=None):
+    args = get_parser(workload_cls).parse_args(argv)
+    return setup_device_args(args)
+
+
+class BenchmarkEngine(object):
+    """Run a workload once per point of the intra-op thread sweep, then report and save the results.
+
+    The workload runs on `num_workers` threads of this process, or with `--procs N`, on N processes each
+    holding its own copy of the model. Every worker keeps private histograms, which are merged at the end.
+
+    Args:
+        workload (Workload): The workload to benchmark.
+        rank (int): Rank of the process in the `--procs` mode. Default to 0.
+    """
+
+    def __init__(self, workload: Workload, rank: int = 0):
+        self.workload = workload
+        self.args = workload.args
+        self.device = workload.device
+        self.rank = rank
+        self.step_timer_cls = get_step_timer_cls(self.args.timer, self.device)
+        self.stopping_rule = StoppingRule(
+            self.args.target_ci, confidence=self.args.ci_confidence, min_steps=self.args.min_steps,
+        ) if self.args.target_ci else None
+
+        self.start_time = 0
+        self.finish_time = 0
+        self.num_samples = 0
+        self.peak_memory = 0
+        self.worker_threads = None
+        self._lock = Lock()
+        self.timing_metric_hist_dict = dict()
+        self.worker_results = list()
+        self.timeline = self.new_timeline()
+        self.instrumentation = dict()
+        self.workload_result_fields = None
+        self.warm_up_result = dict()
+        self.module_profiler = None
+        self.module_stats = None
+        self.result_files = list()
+        self.live_reporter = None
+        self.live_result = dict()
+        self.dcgm_metrics_collector = None
+
+    def new_timeline(self):
+        """An empty timeline aggregating the steps per `--timeline-window`."""
+        return Timeline(self.args.timeline_window, keep_events=self.args.save_raw_latency)
+
+    def reset(self):
+        self.timing_metric_hist_dict = {
+            metric_name: LatencyHistogram(keep_samples=self.args.save_raw_latency)
+            for metric_name in self.workload.timing_metric_names
+        }
+        self.worker_results = list()
+        self.timeline = self.new_timeline()
+        self.live_reporter = LiveReporter.from_args(self.args)
+        # only the first process prints the live metrics
+        self.live_reporter.verbose = self.live_reporter.verbose and self.rank == 0
+        self.live_result = dict()
+        self.instrumentation = dict()
+        self.workload_result_fields = None
+        self.num_samples = 0
+        self.peak_memory = 0
+
+    def setup_module_profiler(self):
+        """Create the module profiler on the model of this run, after `Workload.prepare`."""
+        self.module_profiler = get_module_profiler(
+            self.args.module_profile, self.workload.profiled_module(), self.device,
+            every=self.args.module_profile_every,
+        )
+        self.module_stats = self.module_profiler.stats if self.module_profiler is not None else None
+
+    def warm_up(self):
+        """Warm up for `--warm-up-steps` steps, or until the latency stabilizes with `--warm-up-cv`."""
+        args = self.args
+        monitor = WarmUpMonitor(args.warm_up_window, args.warm_up_cv) if args.warm_up_cv else None
+        num_warm_up_steps, converged = 0, False
+        for inputs in itertools.islice(self.workload.warm_up_inputs(), args.warm_up_steps):
+            if monitor is None:
+                self.workload.warm_up_step(inputs, NullStepTimer(self.device))
+            else:
+                timer = self.step_timer_cls(self.device)
+                self.workload.warm_up_step(inputs, timer)
+                timer.finish()
+                converged = monitor.add(timer.result()[0])
+            num_warm_up_steps += 1
+            if converged:
+                break
+        self.device.synchronize()
+        self.warm_up_result = {'num_warm_up_steps': num_warm_up_steps}
+        if monitor is not None:
+            self.warm_up_result.update({'warm_up_converged': converged, 'warm_up_cv': monitor.cv})
+            print(f'Warm up {"converged" if converged else "did not converge"} after {num_warm_up_steps} steps, '
+                  f'CV: {monitor.cv:.4f}')
+
+    def worker(self, worker_id):
+        latency_metric = self.workload.timing_metric_names[0]
+        num_steps = self.workload.num_steps
+        sync_every = self.args.sync_every
+        # private buffers, so that the workers do not contend on the same histograms
+        hist_dict = {
+            metric_name: LatencyHistogram(keep_samples=self.args.save_raw_latency)
+            for metric_name in self.workload.timing_metric_names
+        }
+        num_completed, num_samples = 0, 0
+        timeline = self.new_timeline()
+        stop_reason = 'max_steps'
+        converged = False
+        # steps whose timing is not resolved yet, as CUDA events complete asynchronously
+        pending_steps = deque()
+
+        def record_step(timer, step_num_samples, profiled, completion_time):
+            nonlocal converged
+            # the module profiler slows down the profiled step
+            if not timer.valid or profiled:
+                self.live_reporter.record(None, num_samples=step_num_samples)
+                timeline.record(completion_time, None, num_samples=step_num_samples)
+                return
+            latency, phases = timer.result()
+            timeline.record(completion_time, latency, num_samples=step_num_samples)
+            hist_dict[latency_metric].record(latency)
+            for metric_name, value in phases.items():
+                hist_dict[metric_name].record(value)
+            self.live_reporter.record(latency, num_samples=step_num_samples)
+            if self.stopping_rule is not None and not converged:
+                converged = self.stopping_rule.should_stop(hist_dict[latency_metric])
+
+        # concurrent workers synchronize on their own streams instead of waiting for each other's kernels
+        stream = self.device.new_stream() if self.workload.num_workers > 1 else None
+        inputs_iter = tqdm(
+            self.workload.iter_inputs(worker_id), total=num_steps or None, disable=self.rank != 0,
+        )
+        with self.device.stream(stream):
+            step_end = self.step_timer_cls.clock(self.device, stream)
+            for step, inputs in enumerate(inputs_iter):
+                if num_steps and step >= num_steps:
+                    break
+                if self.live_reporter.should_stop:
+                    stop_reason = 'early_stop'
+                    break
+                if converged:
+                    stop_reason = 'converged'
+                    break
+                timer = self.step_timer_cls(
+                    self.device, start=step_end if self.workload.time_input_fetching else None, stream=stream,
+                    synchronize=step % sync_every == 0,
+                )
+                profiled = (
+                    self.module_profiler is not None and self.module_profiler.should_sample(step)
+                    and self.module_profiler.start()
+                )
+                step_num_samples = self.workload.step(inputs, timer)
+                step_end = timer.finish()
+                if profiled:
+                    self.module_profiler.stop(stream)
+                    step_end = self.step_timer_cls.clock(self.device, stream)
+                # the host time of the step end, the completion time of a synchronized step
+                pending_steps.append((timer, step_num_samples, profiled, time.time()))
+                while pending_steps and pending_steps[0][0].ready():
+                    record_step(*pending_steps.popleft())
+                num_completed += 1
+                num_samples += step_num_samples
+            self.device.synchronize(stream)
+            while pending_steps:
+                record_step(*pending_steps.popleft())
+
+        worker_result = {
+            'rank': self.rank, 'worker_id': worker_id, 'num_samples': num_samples,
+            self.workload.completed_key: num_completed, 'stop_reason': stop_reason,
+        }
+        worker_result.update(hist_dict[latency_metric].summary(latency_metric))
+        prefetch_stats = self.workload.prefetch_stats(worker_id)
+        if prefetch_stats is not None:
+            worker_result['prefetch'] = prefetch_stats.to_dict()
+        with self._lock:
+            for metric_name, hist in hist_dict.items():
+                self.timing_metric_hist_dict[metric_name].merge(hist)
+            self.num_samples += num_samples
+            self.worker_results.append(worker_result)
+            self.timeline.merge(timeline)
+
+    def uninstrumented_worker(self, worker_id, num_steps):
+        """Run the steps without any timing or synchronization but at the end, and return the number of samples."""
+        num_samples = 0
+        stream = self.device.new_stream() if self.workload.num_workers > 1 else None
+        with self.device.stream(stream):
+            for inputs in itertools.islice(self.workload.iter_inputs(worker_id), num_steps):
+                num_samples += self.workload.step(inputs, NullStepTimer(self.device))
+            self.device.synchronize(stream)
+        return num_samples
+
+    def check_overhead(self):
+        """Measure the throughput without instrumentation, to be compared with the instrumented one."""
+        num_steps, num_workers = self.args.overhead_check_steps, self.workload.num_workers
+        print(f'Running {num_steps} uninstrumented steps...')
+        start = time.perf_counter_ns()
+        with ThreadPoolExecutor(num_workers) as executor:
+            futures = [executor.submit(self.uninstrumented_worker, i, num_steps) for i in range(num_workers)]
+        num_samples = sum(future.result() for future in futures)
+        self.instrumentation['uninstrumented_qps'] = num_samples / ((time.perf_counter_ns() - start) * 1e-9)
+
+    def run_workers(self):
+        """Run the timed workers concurrently on threads of this process."""
+        num_workers = self.workload.num_workers
+        memory_monitor = PeakMemoryMonitor(self.device, interval=0.05)
+        memory_monitor.start()
+        self.live_reporter.start()
+        self.start_time = time.time()
+        try:
+            with ThreadPoolExecutor(num_workers) as executor:
+                futures = [executor.submit(self.worker, i) for i in range(num_workers)]
+            for future in futures:
+                future.result()
+            self.finish_time = time.time()
+        finally:
+            self.peak_memory = memory_monitor.stop()
+            self.live_reporter.stop()
+        self.live_result = self.live_reporter.result()
+
+    def partial_result(self):
+        """Serializable result of a process in the `--procs` mode, to be merged by the main process."""
+        return {
+            'histograms': {
+                metric_name: hist.to_dict(include_samples=self.args.save_raw_latency)
+                for metric_name, hist in self.timing_metric_hist_dict.items()
+            },
+            'num_samples': self.num_samples, 'peak_memory': self.peak_memory, 'start_time': self.start_time,
+            'finish_time': self.finish_time,
+            'workers': self.worker_results, 'timeline': self.timeline.to_dict(), 'live': self.live_result,
+            'instrumentation': self.instrumentation, 'warm_up': self.warm_up_result,
+            # e.g. the precision report, only known to the processes loading the model
+            'result_fields': self.workload.result_fields(),
+            'module_profile': self.module_stats.to_dict() if self.module_stats is not None else None,
+        }
+
+    def merge_partial_results(self, partial_results):
+        for partial_result in partial_results:
+            for metric_name, hist_dict in partial_result['histograms'].items():
+                self.timing_metric_hist_dict[metric_name].merge(
+                    LatencyHistogram.from_dict(hist_dict, keep_samples=self.args.save_raw_latency)
+                )
+            self.num_samples += partial_result['num_samples']
+            # the processes hold their own copies of the model
+            self.peak_memory += partial_result['peak_memory']
+            self.worker_results.extend(partial_result['workers'])
+            self.timeline.merge(Timeline.from_dict(partial_result['timeline']))
+        self.workload_result_fields = partial_results[0]['result_fields']
+        self.warm_up_result = {
+            'num_warm_up_steps': max(p['warm_up']['num_warm_up_steps'] for p in partial_results),
+        }
+        if 'warm_up_converged' in partial_results[0]['warm_up']:
+            self.warm_up_result['warm_up_converged'] = all(p['warm_up']['warm_up_converged'] for p in partial_results)
+            self.warm_up_result['warm_up_cv'] = max(p['warm_up']['warm_up_cv'] for p in partial_results)
+        uninstrumented_qps = [p['instrumentation'].get('uninstrumented_qps') for p in partial_results]
+        if all(qps is not None for qps in uninstrumented_qps):
+            self.instrumentation['uninstrumented_qps'] = sum(uninstrumented_qps)
+        if partial_results[0]['module_profile'] is not None:
+            self.module_stats = ModuleStats.from_dict(partial_results[0]['module_profile'])
+            for partial_result in partial_results[1:]:
+                self.module_stats.merge(ModuleStats.from_dict(partial_result['module_profile']))
+        self.start_time = min(partial_result['start_time'] for partial_result in partial_results)
+        self.finish_time = max(partial_result['finish_time'] for partial_result in partial_results)
+        stop_reasons = [p['live']['early_stop_reason'] for p in partial_results if p['live']['early_stopped']]
+        self.live_result = {
+            'early_stopped': len(stop_reasons) > 0,
+            'early_stop_reason': stop_reasons[0] if stop_reasons else None,
+            'early_stop_rules': partial_results[0]['live']['early_stop_rules'],
+        }
+
+    def metric_instances(self):
+        """(gpu_id, gpu_instance_id) of the device of the run, followed by the other GPU (instances) of the
+        workload."""
+        instances = [(self.args.gpu_id, self.args.gpu_instance_id)]
+        for instance in self.workload.metric_instances() or ():
+            if tuple(instance) not in instances:
+                instances.append(tuple(instance))
+        return instances
+
+    def build_dcgm_metrics_collector(self):
+        """A collector of the GPU metrics of the devices of the run, None on CPU unless the NVML is faked."""
+        if not self.device.is_cuda and self.args.monitor != 'fake-nvml':
+            return None
+        instances = self.metric_instances()
+        # all the instances of a MIG-enabled GPU, whose activity apportions its energy among them
+        mig_gpus = {(gpu_id, None) for gpu_id, gpu_instance_id in instances if gpu_instance_id is not None}
+        return build_metric_collector(self.args, instances=instances + sorted(mig_gpus))
+
+    def stop_dcgm_metrics_collector(self):
+        """Stop the sampling thread of the GPU metric collector if it runs."""
+        if self.dcgm_metrics_collector is not None and self.dcgm_metrics_collector.is_running:
+            self.dcgm_metrics_collector.stop()
+
+    def run_once(self):
+        """Benchmark the workload once on threads of this process and return the result."""
+        self.reset()
+        self.dcgm_metrics_collector = self.build_dcgm_metrics_collector()
+        num_threads = torch.get_num_threads()
+
+        try:
+            self.workload.prepare()
+            self.setup_module_profiler()
+            print('Warming up...')
+            self.warm_up()
+            if self.args.overhead_check_steps:
+                self.check_overhead()
+            print('Testing...')
+            if not self.device.is_cuda and self.workload.num_workers > 1:
+                # split the CPU thread budget among the workers
+                self.worker_threads = max(num_threads // self.workload.num_workers, 1)
+                torch.set_num_threads(self.worker_threads)
+            if self.dcgm_metrics_collector is not None:
+                self.dcgm_metrics_collector.start()
+            self.run_workers()
+            torch.set_num_threads(num_threads)
+            print('Finish')
+            return self.process_result()
+        finally:
+            # also when a worker fails, e.g. in a sweep moving on to its next point
+            torch.set_num_threads(num_threads)
+            self.stop_dcgm_metrics_collector()
+
+    def run_once_procs(self):
+        """Benchmark the workload once on `--procs` processes and return the merged result."""
+        args = self.args
+        self.reset()
+        self.dcgm_metrics_collector = self.build_dcgm_metrics_collector()
+        if not self.device.is_cuda:
+            # split the CPU thread budget among the workers of all the processes
+            self.worker_threads = max(torch.get_num_threads() // (args.procs * self.workload.num_workers), 1)
+
+        # spawn, as CUDA cannot be re-initialized in a forked process
+        ctx = mp.get_context('spawn')
+        barrier = ctx.Barrier(args.procs)
+        queue = ctx.Queue()
+        processes = [
+            ctx.Process(
+                target=run_process, args=(type(self.workload), args, rank, self.worker_threads, barrier, queue),
+            )
+            for rank in range(args.procs)
+        ]
+        print(f'Starting {args.procs} processes...')
+        for p in processes:
+            p.start()
+
+        partial_results, errors = list(), list()
+        try:
+            while len(partial_results) + len(errors) < args.procs:
+                try:
+                    message, rank, payload = queue.get(timeout=1)
+                except Empty:
+                    if not any(p.is_alive() for p in processes):
+                        errors.append('Benchmark processes exited without reporting a result')
+                        break
+                    continue
+                if message == 'ready':
+                    # all the processes finished warming up
+                    print('Testing...')
+                    if self.dcgm_metrics_collector is not None:
+                        self.dcgm_metrics_collector.start()
+                elif message == 'result':
+                    partial_results.append(payload)
+                else:
+                    errors.append(f'Process {rank} failed:\n{payload}')
+            for p in processes:
+                p.join()
+            if errors:
+                raise RuntimeError('\n'.join(errors))
+            print('Finish')
+
+            self.merge_partial_results(partial_results)
+            return self.process_result()
+        finally:
+            self.stop_dcgm_metrics_collector()
+
+    def process_result(self):
+        args = self.args
+        completed_key = self.workload.completed_key
+        qps = self.num_samples / (self.finish_time - self.start_time)
+        result = {
+            'test_time': datetime.now().strftime('%Y-%m-%d_%H-%M-%S'), 'start_time': self.start_time,
+            'finish_time': self.finish_time, 'batch_size': args.bs, 'model_name': args.model, 'task': args.task,
+            'qps': qps,
+            completed_key: sum(worker_result[completed_key] for worker_result in self.worker_results),
+            'procs': args.procs, 'peak_memory_mb': self.peak_memory / 2 ** 20,
+        }
+        result.update(
+            self.workload_result_fields if self.workload_result_fields is not None else self.workload.result_fields()
+        )
+        result.update(self.warm_up_result)
+        for metric_name, hist in self.timing_metric_hist_dict.items():
+            result.update(hist.summary(metric_name))
+        latency_metric = self.workload.timing_metric_names[0]
+        latency_hist = self.timing_metric_hist_dict[latency_metric]
+        result[f'{latency_metric}_mean_ci'] = latency_hist.mean_ci(args.ci_confidence)
+        result[f'{latency_metric}_p99_ci'] = latency_hist.percentile_ci(99, args.ci_confidence)
+        result['converged'] = len(self.worker_results) > 0 and all(
+            worker_result['stop_reason'] == 'converged' for worker_result in self.worker_results
+        )
+        result.update(self.live_result)
+        # how much the timing itself changes the throughput
+        result['instrumentation'] = {
+            'timer': self.step_timer_cls.name, 'sync_every': args.sync_every,
+            'num_timed_steps': self.timing_metric_hist_dict[self.workload.timing_metric_names[0]].count,
+        }
+        if 'uninstrumented_qps' in self.instrumentation:
+            uninstrumented_qps = self.instrumentation['uninstrumented_qps']
+            result['instrumentation'].update({
+                'uninstrumented_qps': uninstrumented_qps, 'overhead': 1 - qps / uninstrumented_qps,
+            })
+        if self.module_stats is not None:
+            result['module_profile'] = self.module_stats.summary(top=args.module_profile_top)
+        prefetch_stats = [w['prefetch'] for w in self.worker_results if 'prefetch' in w]
+        if prefetch_stats:
+            stats = PrefetchStats.from_dict(prefetch_stats[0])
+            for d in prefetch_stats[1:]:
+                stats.merge(PrefetchStats.from_dict(d))
+            result['input_prefetch'] = stats.summary()
+        result['workers'] = sorted(self.worker_results, key=lambda w: (w['rank'], w['worker_id']))
+        result['histograms'] = {
+            metric_name: hist.to_dict() for metric_name, hist in self.timing_metric_hist_dict.items()
+        }
+        if args.save_raw_latency:
+            result.update({metric_name: hist.samples for metric_name, hist in self.timing_metric_hist_dict.items()})
+        result['device'] = args.device
+        result['intra_op_threads'] = torch.get_num_threads()
+        result['worker_intra_op_threads'] = self.worker_threads
+        result.update(self.device_result())
+        # the energy of each GPU used by the run, counted once for the MIG instances sharing a GPU
+        gpu_metrics = {args.gpu_id: result['metrics']}
+        for instance in result.get('instance_metrics', ()):
+            gpu_metrics.setdefault(instance['gpu_id'], instance['metrics'])
+        result.update(summarize_energy(
+            result['metrics'].get('time', ()), list(gpu_metrics.values()), self.start_time, self.finish_time,
+            num_samples=self.num_samples, num_steps=result[completed_key],
+        ) or dict())
+        if result['config']['mig']['enabled']:
+            # the estimated share of the MIG instances of the run, next to the energy of their whole GPUs
+            result.update(instance_energy(
+                result['metrics']['time'], self.dcgm_metrics_collector.gpu_metrics_dict, self.metric_instances(),
+                self.start_time, self.finish_time, num_samples=self.num_samples, num_steps=result[completed_key],
+            ) or dict())
+        if args.timeline_window:
+            result['timeline'] = summarize_timeline(
+                self.timeline, result['metrics'].get('time', ()), result['metrics'], self.start_time,
+                self.finish_time, spike_factor=args.spike_factor,
+            )
+            if args.save_raw_latency:
+                result['timeline']['events'] = self.timeline.events_to_dict()
+        return result
+
+    def device_result(self):
+        """GPU metrics and the device configuration of the result."""
+        args = self.args
+        if self.dcgm_metrics_collector is None:
+            # no GPU metrics on CPU, record the host CPU instead
+            return {
+                'metrics': dict(), 'gpu_model_name': 'cpu',
+                'config': {
+                    'client_args': vars(args), 'cpu_static_profile': get_cpu_static_profile(),
+                    'mig': {'enabled': False},
+                },
+            }
+
+        gpu_metrics_dict = self.dcgm_metrics_collector.gpu_metrics_dict
+        # gpu_label_example = {
+        #     'gpu': '0', 'UUID': 'GPU-bd8c3d28-4b3e-e4ad-650a-4c5a3692b72f', 'device': 'nvidia0',
+        #     'modelName': 'NVIDIA A30', 'Hostname': '2e140b568f0c',
+        #     'GPU_I_PROFILE': '4g.24gb', 'GPU_I_ID': '0',
+        # }
+        # the labels are recorded once in the config, not as a series next to the numeric metrics
+        metrics = {k: v for k, v in gpu_metrics_dict[args.gpu_id, args.gpu_instance_id].items() if k != 'labels'}
+        metrics['time'] = gpu_metrics_dict['time']
+        gpu_labels: dict = gpu_metrics_dict[args.gpu_id, args.gpu_instance_id]['labels'][0]
+
+        # export config
+        config = {
+            'client_args': vars(args),
+            'gpu_static_profile': gpu_labels,
+            'mig': {
+                'enabled': gpu_labels.get('GPU_I_ID', None) is not None,
+                'gpu_instance_id': gpu_labels.get('GPU_I_ID', None),
+                'gpu_instance_profile': gpu_labels.get('GPU_I_PROFILE', None),
+            },
+        }
+        # if MIG is enabled, also obtain sibling GPU instance profile
+        if config['mig']['enabled']:
+            gpu_instance_profiles = list()
+            for k, v in gpu_metrics_dict.items():
+                if k[0] == args.gpu_id:
+                    gpu_instance_profiles.append(v['labels'][0]['GPU_I_PROFILE'])
+            config['mig']['gpu_instance_profiles'] = gpu_instance_profiles
+        device_result = {
+            'metrics': metrics, 'gpu_model_name': gpu_labels['modelName'], 'config': config,
+            'metrics_collector': self.dcgm_metrics_collector.overhead(),
+        }
+        # e.g., the devices of the other DDP ranks, sharing the sample times of `metrics`
+        instances = self.metric_instances()[1:]
+        if instances:
+            device_result['instance_metrics'] = [
+                {
+                    'gpu_id': gpu_id, 'gpu_instance_id': gpu_instance_id,
+                    'gpu_instance_profile': gpu_metrics_dict[gpu_id, gpu_instance_id]['labels'][0].get(
+                        'GPU_I_PROFILE', None),
+                    'metrics': {
+                        k: v for k, v in gpu_metrics_dict[gpu_id, gpu_instance_id].items() if k != 'labels'
+                    },
+                }
+                for gpu_id, gpu_instance_id in instances if (gpu_id, gpu_instance_id) in gpu_metrics_dict
+            ]
+        return device_result
+
+    def save_result(self, result, intra_op_threads=None):
+        args = self.args
+        save_json_file_name = Path(args.database_name) / (
+                '_'.join(
+                    [result['gpu_model_name'].replace(' ', '-'), result['model_name']]
+                    + self.workload.file_name_parts(result)
+                    + ([f'p{result["procs"]}'] if result['procs'] > 1 else [])
+                    # CPU intra-op thread sweep
+                    + ([f'th{intra_op_threads}'] if intra_op_threads else [])
+                ) + (f'_{args.report_suffix}' if args.report_suffix else '') + '.json'
+        )
+        save_json_file_name.parent.mkdir(exist_ok=True, parents=True)
+        with open(save_json_file_name, 'w') as f:
+            json.dump(result, f)
+            print(f'result saved successfully as {save_json_file_name}')
+        return save_json_file_name
+
+    def run(self):
+        """Run the benchmark at each point of the intra-op thread sweep, and save the results."""
+        results = list()
+        if self.args.procs == 1:
+            self.workload.setup()
+        for intra_op_threads in self.args.intra_op_threads:
+            if intra_op_threads is not None:
+                torch.set_num_threads(intra_op_threads)
+                print(f'intra-op threads: {intra_op_threads}')
+            result = self.run_once() if self.args.procs == 1 else self.run_once_procs()
+            results.append(result)
+            # save the experiment records to the database and print to the console.
+            if self.args.dry_run:
+                print('Dry running, result will not dumped')
+                continue
+            self.result_files.append(self.save_result(result, intra_op_threads))
+        return results
+
+
+def run_process(workload_cls, args, rank, worker_threads, barrier, queue):
+    """Entry of a benchmark process in the `--procs` mode. The processes start timing together after all of
+    them have warmed up, and report their partial results to the main process through `queue`."""
+    try:
+        if worker_threads is not None:
+            torch.set_num_threads(worker_threads)
+        workload = workload_cls(args, Device(args.device), rank=rank)
+        workload.setup()
+        engine = BenchmarkEngine(workload, rank=rank)
+        engine.reset()
+        workload.prepare()
+        engine.setup_module_profiler()
+        engine.warm_up()
+        if args.overhead_check_steps:
+            barrier.wait()
+            engine.check_overhead()
+        barrier.wait()
+        if rank == 0:
+            queue.put(('ready', rank, None))
+        engine.run_workers()
+        queue.put(('result', rank, engine.partial_result()))
+    except BrokenBarrierError:
+        queue.put(('error', rank, 'Aborted as another process failed'))
+    except Exception:
+        barrier.abort()
+        queue.put(('error', rank, traceback.format_exc()))
+
+
+def main(workload_cls):
+    args = get_args(workload_cls)
+    # Mask out other cuda devices
+    mask_cuda_devices(args)
+    device = Device(args.device)
+
+    print('Testing on:')
+    print(f'workload: {workload_cls.name};', f'model name: {args.model};', f'device: {args.device}')
+    workload = workload_cls(args, device)
+    return BenchmarkEngine(workload).run()
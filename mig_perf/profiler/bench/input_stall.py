@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare the training results on the real and the synthetic data, to quantify the input pipeline stall.
+
+The results of the same configuration (GPU / MIG profile, model, batch size, sequence length, processes and
+threads) are paired. The stall is the fraction of the real step latency not spent in the synthetic step, i.e.
+the time the device waits for the input pipeline.
+
+Examples:
+    python train/train_cv.py -m resnet50 -n 500 -b 64 -dbn results/train
+    python train/train_cv.py -m resnet50 -n 500 -b 64 -dbn results/train --data synthetic
+    python -m bench.input_stall results/train
+"""
+import argparse
+import json
+
+from utils.misc import (
+    STEP_LATENCY_METRIC, TRAIN_CONFIG_FIELDS, add_report_arguments, latest_results, load_results, report_rows,
+    train_config_key,
+)
+
+TABLE_COLUMNS = ('gpu_instance_profile', 'model_name', 'batch_size', 'sequence_length', 'real_step_latency',
+                 'synthetic_step_latency', 'real_data_process_time', 'stall', 'qps_ratio')
+
+
+def train_modes_key(result):
+    return json.dumps(dict(result.get('train_modes') or dict(), prefetch=result.get('prefetch', 0)), sort_keys=True)
+
+
+def compare(results, statistic='mean'):
+    """Pair the real and synthetic results of each configuration, and return a row per pair."""
+    # keep the latest result of a configuration, pairing only the results of the same training modes
+    pairs = latest_results(
+        results, group_key=lambda result: (train_config_key(result), train_modes_key(result)),
+        key=lambda result: result['data_source'],
+    )
+    rows = list()
+    for (key, modes), pair in pairs.items():
+        if 'real' not in pair or 'synthetic' not in pair:
+            continue
+        real, synthetic = pair['real'], pair['synthetic']
+        real_step = real[f'{STEP_LATENCY_METRIC}_{statistic}']
+        synthetic_step = synthetic[f'{STEP_LATENCY_METRIC}_{statistic}']
+        row = dict(zip(TRAIN_CONFIG_FIELDS, key))
+        row.update({
+            'train_modes': modes, 'real_step_latency': real_step, 'synthetic_step_latency': synthetic_step,
+            'real_data_process_time': real.get(f'data_process_time_{statistic}'),
+            'synthetic_data_process_time': synthetic.get(f'data_process_time_{statistic}'),
+            'stall': max(real_step - synthetic_step, 0.) / real_step if real_step else 0.,
+            'real_qps': real['qps'], 'synthetic_qps': synthetic['qps'],
+            'qps_ratio': synthetic['qps'] / real['qps'] if real['qps'] else None,
+        })
+        rows.append(row)
+    rows.sort(key=lambda r: [str(r[name]) for name in TRAIN_CONFIG_FIELDS])
+    return rows
+
+
+def main():
+    parser = add_report_arguments(argparse.ArgumentParser(description='Input pipeline stall of the training results'))
+    args = parser.parse_args()
+
+    rows = compare(
+        load_results(args.results, required_fields=('data_source', f'{STEP_LATENCY_METRIC}_mean')),
+        statistic=args.statistic,
+    )
+    report_rows(rows, TABLE_COLUMNS, output=args.output,
+                empty_message='No pair of real and synthetic data results found')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Find the max batch size (or sequence length) of a workload fitting in the device memory.
+
+The searched value grows exponentially from `--start` until a probe runs out of memory, then the max value is
+bisected between the last fitting value and the first failing one. A probe runs `--probe-steps` steps of the
+workload at the value, catching the OOM error and recording the peak memory. On CUDA, the peak is read from the
+caching allocator. On CPU, each probe runs in a fresh process whose peak resident memory is sampled, and a probe
+exceeding `--memory-cap-mb` counts as out of memory, so that the search can be tested without a GPU. A fresh process
+keeps the memory retained by the allocator after an earlier, larger probe from counting against a smaller one.
+
+With `--grid-out`, a sweep grid of the batch sizes up to the found max is written for `python -m bench.sweep`.
+
+Examples:
+    python -m bench.max_batch cv_infer -m resnet50 -i 0 -mi 0 -n 1000 --grid-out grid.json
+    python -m bench.max_batch nlp_infer -m bert-base-cased -n 1000 --seq-lens 64 128 256 --device cpu \
+        --memory-cap-mb 4096
+"""
+import argparse
+import gc
+import itertools
+import json
+import multiprocessing as mp
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import torch
+
+from bench.engine import get_args as get_workload_args
+from bench.timing import NullStepTimer
+from bench.workloads import MODEL_CACHE, WORKLOADS
+from utils.device import Device, PeakMemoryMonitor, mask_cuda_devices
+
+SEARCH_DIMS = ('bs', 'seq_len')
+# option strings of the searched values in the workload parsers
+SEARCH_OPTIONS = {'bs': '--bs', 'seq_len': '--seq_len'}
+
+
+class MemoryBudgetExceeded(MemoryError):
+    """The probe exceeded `--memory-cap-mb`."""
+
+
+def is_oom_error(e: BaseException):
+    if isinstance(e, MemoryError):
+        return True
+    oom_error_cls = getattr(torch.cuda, 'OutOfMemoryError', None)
+    if oom_error_cls is not None and isinstance(e, oom_error_cls):
+        return True
+    return isinstance(e, RuntimeError) and 'out of memory' in str(e)
+
+
+def probe(workload_cls, argv, device, probe_steps, memory_cap):
+    """Run `probe_steps` steps of the workload with arguments `argv`. Return (fits, peak memory in MB, error)."""
+    monitor = PeakMemoryMonitor(device)
+    workload, error = None, None
+    monitor.start()
+    try:
+        workload = workload_cls(get_workload_args(workload_cls, argv), device)
+        workload.setup()
+        workload.prepare()
+        for inputs in itertools.islice(workload.iter_inputs(0), probe_steps):
+            workload.step(inputs, NullStepTimer(device))
+            device.synchronize()
+            if memory_cap and monitor.peak > memory_cap:
+                raise MemoryBudgetExceeded(f'Peak memory exceeds the cap of {memory_cap / 2 ** 20:.0f} MB')
+    except Exception as e:
+        if not is_oom_error(e):
+            raise
+        error = f'{type(e).__name__}: {str(e).splitlines()[0] if str(e) else ""}'
+    peak = monitor.stop()
+    workload = None
+    # release the memory of the failed probe, which may be referenced by the traceback
+    gc.collect()
+    if device.is_cuda:
+        torch.cuda.empty_cache()
+    if error is None and memory_cap and peak > memory_cap:
+        error = f'MemoryBudgetExceeded: Peak memory exceeds the cap of {memory_cap / 2 ** 20:.0f} MB'
+    return error is None, peak / 2 ** 20, error
+
+
+def probe_in_process(workload_cls, argv, device, probe_steps, memory_cap):
+    """`probe` in a fresh process, so that its resident memory does not include the memory freed by the earlier
+    probes but kept by the allocator. A probe process killed by the system counts as out of memory."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context('spawn')) as executor:
+        try:
+            return executor.submit(probe, workload_cls, argv, device, probe_steps, memory_cap).result()
+        except BrokenProcessPool as e:
+            return False, float('nan'), f'{type(e).__name__}: {e}'
+
+
+def search(fits, start: int, max_value: int, multiple_of: int = 1):
+    """Find the max value in [start, max_value] for which `fits(value)` holds, assuming it is monotonic. Grow
+    the value exponentially until it does not fit, then bisect. Return None if even `start` does not fit."""
+    good, value = None, start
+    while fits(value):
+        good = value
+        if value >= max_value:
+            return value
+        value = min(value * 2, max_value)
+    if good is None:
+        return None
+    # bisect on the multiples of `multiple_of` strictly between the fitting and the failing values
+    lo, hi = -(-(good + 1) // multiple_of), (value - 1) // multiple_of
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        if fits(mid * multiple_of):
+            good, lo = mid * multiple_of, mid + 1
+        else:
+            hi = mid - 1
+    return good
+
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Find the max batch size of a workload under a memory budget. Arguments not listed here are '
+                    'passed to the workload.'
+    )
+    parser.add_argument('workload', type=str, choices=list(WORKLOADS), help='The workload name.')
+    parser.add_argument('--search', type=str, default='bs', choices=SEARCH_DIMS,
+                        help='The searched argument. Default to bs.')
+    parser.add_argument('--seq-lens', type=int, nargs='+', default=None,
+                        help='NLP only. Search the max batch size at each of the sequence lengths.')
+    parser.add_argument('--start', type=int, default=1, help='Start value of the search. Default to 1.')
+    parser.add_argument('--max-value', type=int, default=4096, help='Max value of the search. Default to 4096.')
+    parser.add_argument('--multiple-of', type=int, default=1,
+                        help='Only try the multiples of this number when bisecting. Default to 1.')
+    parser.add_argument('--probe-steps', type=int, default=3,
+                        help='Number of steps run at each probed value. Default to 3.')
+    parser.add_argument('--memory-cap-mb', type=float, default=None,
+                        help='Memory budget in MB. A probe with a higher peak memory counts as out of memory. '
+                             'Required on CPU, optional on CUDA to keep a headroom.')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Path to save the search result.')
+    parser.add_argument('--grid-out', type=str, default=None,
+                        help='Path to write a `bench.sweep` grid of the batch sizes up to the found max.')
+    args, workload_argv = parser.parse_known_args(argv)
+    return args, workload_argv
+
+
+def main(argv=None):
+    args, workload_argv = get_args(argv)
+    workload_cls = WORKLOADS[args.workload]
+    # parse the fixed workload arguments once, with placeholders of the searched and step number arguments
+    base_args = get_workload_args(workload_cls, workload_argv + ['--bs', '1', '-n', str(args.probe_steps)])
+    device = Device(base_args.device)
+    if not device.is_cuda and args.memory_cap_mb is None:
+        print('A memory cap (--memory-cap-mb) is required on CPU', file=sys.stderr)
+        exit(2)
+    if args.seq_lens and not hasattr(base_args, 'seq_len'):
+        print(f'--seq-lens is not supported by {args.workload}', file=sys.stderr)
+        exit(2)
+    mask_cuda_devices(base_args)
+    # keep the inference model resident across the probes, on CUDA where they run in this process
+    MODEL_CACHE.capacity = 1
+    memory_cap = args.memory_cap_mb * 2 ** 20 if args.memory_cap_mb else None
+
+    fixed_list = [{'seq_len': seq_len} for seq_len in args.seq_lens] if args.seq_lens else [dict()]
+    results = list()
+    for fixed in fixed_list:
+        probes = dict()
+
+        def fits(value):
+            point = dict(fixed, **{args.search: value})
+            point_argv = list(itertools.chain.from_iterable(
+                (SEARCH_OPTIONS[k], str(v)) for k, v in point.items()
+            ))
+            ok, peak_memory, error = (probe if device.is_cuda else probe_in_process)(
+                workload_cls, workload_argv + ['--bs', '1'] + point_argv + ['-n', str(args.probe_steps)],
+                device, args.probe_steps, memory_cap,
+            )
+            print(f'{point}: {"fits" if ok else "OOM"}, peak memory {peak_memory:.1f} MB')
+            probes[value] = {'value': value, 'fits': ok, 'peak_memory_mb': peak_memory, 'error': error}
+            return ok
+
+        max_value = search(fits, args.start, args.max_value, args.multiple_of)
+        result = dict(fixed)
+        result.update({
+            'search': args.search, f'max_{args.search}': max_value,
+            'peak_memory_mb': probes[max_value]['peak_memory_mb'] if max_value is not None else None,
+            'probes': sorted(probes.values(), key=lambda p: p['value']),
+        })
+        print(f'{fixed or args.workload}: max {args.search} = {max_value}')
+        results.append(result)
+
+    output = {
+        'workload': args.workload, 'model_name': base_args.model, 'device': base_args.device,
+        'device_uuid': base_args.device_uuid, 'memory_cap_mb': args.memory_cap_mb, 'results': results,
+    }
+    if args.output:
+        Path(args.output).parent.mkdir(exist_ok=True, parents=True)
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+        print(f'Search result saved as {args.output}')
+    if args.grid_out:
+        grid_config = to_sweep_grid(args.workload, workload_argv, base_args.model, args.search, results)
+        Path(args.grid_out).parent.mkdir(exist_ok=True, parents=True)
+        with open(args.grid_out, 'w') as f:
+            json.dump(grid_config, f, indent=2)
+        print(f'Sweep grid saved as {args.grid_out}')
+    return output
+
+
+def to_sweep_grid(workload_name, workload_argv, model_name, search_dim, results):
+    """A `bench.sweep` grid of the powers of two up to the found max values, and the max values themselves."""
+    grids = list()
+    for result in results:
+        max_value = result[f'max_{search_dim}']
+        if max_value is None:
+            continue
+        values = sorted({2 ** i for i in range(max_value.bit_length()) if 2 ** i <= max_value} | {max_value})
+        grid = {'model': [model_name], search_dim: values}
+        if 'seq_len' in result and search_dim != 'seq_len':
+            grid['seq_len'] = [result['seq_len']]
+        grids.append(grid)
+    # the model is part of the grid
+    args = list(workload_argv)
+    for option in ('-m', '--model'):
+        while option in args:
+            i = args.index(option)
+            del args[i:i + 2]
+    return {'workload': workload_name, 'args': args, 'grid': grids[0] if len(grids) == 1 else grids}
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Per-module latency attribution of the benchmark steps.
+
+Only every `--module-profile-every`-th measured step is profiled, and the profiled steps are left out of the
+latency statistics. Two modes are supported:
+    - `hooks` attaches forward hooks to every module for the sampled step only, timing each module call with
+      CUDA events or `perf_counter_ns`. It is cheap, but covers the forward pass only.
+    - `torch` runs the sampled step under `torch.profiler` with `record_shapes`. Each module call is annotated
+      by a `record_function` range, and a backward node (e.g. `AddmmBackward0`, run under the
+      `autograd::engine::evaluate_function` range) is attributed to the module running its forward operator
+      through the (forward thread, autograd sequence number) they share, so the backward pass of training is
+      covered too.
+
+The result holds the mean time per profiled step of each module type and of the top named modules. `self` is
+the time spent in a module excluding its child modules, so the `self` times of all modules add up to the step.
+
+Examples:
+    # check the backward attribution of the `torch` mode on a training step of resnet18
+    python -m bench.module_profile
+"""
+import time
+from collections import defaultdict
+from threading import Lock, get_ident
+
+import torch
+
+from utils.device import Device
+
+MODULE_PROFILE_MODES = ('off', 'hooks', 'torch')
+RANGE_PREFIX = 'module::'
+ROOT_NAME = '<root>'
+
+
+class ModuleStats(object):
+    """Accumulated time of the named modules over the profiled steps, in seconds.
+
+    Args:
+        mode (str): The profiling mode.
+        every (int): The sampling interval in steps.
+        module_types (dict): Type name of each named module.
+    """
+
+    def __init__(self, mode: str = None, every: int = 1, module_types: dict = None):
+        self.mode = mode
+        self.every = every
+        self.module_types = module_types or dict()
+        self.num_steps = 0
+        self.calls = defaultdict(int)
+        self.forward_self = defaultdict(float)
+        self.backward_self = defaultdict(float)
+        self.input_shapes = dict()
+
+    def merge(self, other: 'ModuleStats'):
+        self.num_steps += other.num_steps
+        for name, value in other.calls.items():
+            self.calls[name] += value
+        for name, value in other.forward_self.items():
+            self.forward_self[name] += value
+        for name, value in other.backward_self.items():
+            self.backward_self[name] += value
+        for name, shapes in other.input_shapes.items():
+            self.input_shapes.setdefault(name, shapes)
+        self.module_types.update(other.module_types)
+
+    def to_dict(self):
+        return {
+            'mode': self.mode, 'every': self.every, 'module_types': self.module_types, 'num_steps': self.num_steps,
+            'calls': dict(self.calls), 'forward_self': dict(self.forward_self),
+            'backward_self': dict(self.backward_self), 'input_shapes': self.input_shapes,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        stats = cls(mode=d['mode'], every=d['every'], module_types=d['module_types'])
+        stats.num_steps = d['num_steps']
+        stats.calls.update(d['calls'])
+        stats.forward_self.update(d['forward_self'])
+        stats.backward_self.update(d['backward_self'])
+        stats.input_shapes.update(d['input_shapes'])
+        return stats
+
+    def summary(self, top: int = 20):
+        """Compact per-type and per-name tables of the mean time per profiled step."""
+        module_types = self.module_types
+        num_steps = max(self.num_steps, 1)
+        names = set(self.forward_self) | set(self.backward_self)
+        step_time = sum(self.forward_self.values()) + sum(self.backward_self.values())
+
+        def total(n):
+            # time of a module including its children
+            prefix = '' if n == ROOT_NAME else n + '.'
+            return sum(
+                self.forward_self[m] + self.backward_self[m]
+                for m in names if m == n or m.startswith(prefix)
+            )
+
+        by_type = defaultdict(lambda: {'calls': 0, 'forward_self': 0., 'backward_self': 0.})
+        for name in names:
+            row = by_type[module_types.get(name, '<unknown>')]
+            row['calls'] += self.calls[name]
+            row['forward_self'] += self.forward_self[name]
+            row['backward_self'] += self.backward_self[name]
+        type_table = [
+            {
+                'type': module_type, 'calls': row['calls'] / num_steps,
+                'forward_self': row['forward_self'] / num_steps, 'backward_self': row['backward_self'] / num_steps,
+                'share': (row['forward_self'] + row['backward_self']) / step_time if step_time else 0.,
+            }
+            for module_type, row in by_type.items()
+        ]
+        name_table = [
+            {
+                'name': name, 'type': module_types.get(name, '<unknown>'), 'calls': self.calls[name] / num_steps,
+                'forward_self': self.forward_self[name] / num_steps,
+                'backward_self': self.backward_self[name] / num_steps,
+                'total': total(name) / num_steps,
+                'share': (self.forward_self[name] + self.backward_self[name]) / step_time if step_time else 0.,
+                'input_shapes': self.input_shapes.get(name),
+            }
+            for name in names
+        ]
+        type_table.sort(key=lambda row: row['share'], reverse=True)
+        name_table.sort(key=lambda row: row['share'], reverse=True)
+        return {
+            'mode': self.mode, 'every': self.every, 'num_profiled_steps': self.num_steps,
+            'profiled_step_time': step_time / num_steps,
+            'by_type': type_table, 'by_name': name_table[:top],
+        }
+
+
+def _input_shapes(inputs):
+    return [list(x.shape) for x in inputs if isinstance(x, torch.Tensor)]
+
+
+class ModuleProfiler(object):
+    """Base class of the sampling module profilers. Only one step is profiled at a time, the concurrent
+    workers skip profiling while another worker's step is being profiled.
+
+    Args:
+        model (torch.nn.Module): The model to attribute the step time to.
+        device (Device): The device the model runs on.
+        every (int): Profile every this many measured steps of a worker.
+    """
+    mode: str = None
+
+    def __init__(self, model: torch.nn.Module, device: Device, every: int = 10):
+        self.model = model
+        self.device = device
+        self.every = every
+        self.module_names = {module: name or ROOT_NAME for name, module in model.named_modules()}
+        self.stats = ModuleStats(
+            mode=self.mode, every=every,
+            module_types={name: type(module).__name__ for module, name in self.module_names.items()},
+        )
+        self._lock = Lock()
+
+    def should_sample(self, step: int):
+        return step % self.every == 0
+
+    def start(self):
+        """Start profiling a step of the calling thread. Return False if another step is being profiled."""
+        return self._lock.acquire(blocking=False)
+
+    def stop(self, stream=None):
+        """Stop profiling the step and add its module times to the statistics."""
+        self._lock.release()
+
+
+class HookModuleProfiler(ModuleProfiler):
+    """Time the forward call of every module by hooks attached only during the profiled step."""
+    mode = 'hooks'
+
+    def __init__(self, model, device, every=10):
+        super().__init__(model, device, every=every)
+        self._handles = list()
+        self._thread = None
+        # stack of [name, start marker, child records], and the finished records (name, start, end, children)
+        self._stack = list()
+        self._records = list()
+
+    def _clock(self):
+        if self.device.is_cuda:
+            event = torch.cuda.Event(enable_timing=True)
+            event.record()
+            return event
+        return time.perf_counter_ns()
+
+    def _duration(self, start, end):
+        if self.device.is_cuda:
+            return start.elapsed_time(end) * 1e-3
+        return (end - start) * 1e-9
+
+    def _pre_hook(self, module, inputs):
+        if get_ident() != self._thread:
+            return
+        name = self.module_names[module]
+        if name not in self.stats.input_shapes:
+            self.stats.input_shapes[name] = _input_shapes(inputs)
+        self._stack.append([name, self._clock(), list()])
+
+    def _post_hook(self, module, inputs, output):
+        if get_ident() != self._thread or not self._stack:
+            return
+        name, start, children = self._stack.pop()
+        record = (name, start, self._clock(), children)
+        (self._stack[-1][2] if self._stack else self._records).append(record)
+
+    def start(self):
+        if not super().start():
+            return False
+        self._thread = get_ident()
+        for module in self.module_names:
+            self._handles.append(module.register_forward_pre_hook(self._pre_hook))
+            self._handles.append(module.register_forward_hook(self._post_hook))
+        return True
+
+    def stop(self, stream=None):
+        for handle in self._handles:
+            handle.remove()
+        self._handles.clear()
+        self.device.synchronize(stream)
+
+        def add(record):
+            name, start, end, children = record
+            duration = self._duration(start, end)
+            child_duration = sum(add(child) for child in children)
+            self.stats.calls[name] += 1
+            self.stats.forward_self[name] += duration - child_duration
+            return duration
+
+        for record in self._records:
+            add(record)
+        self.stats.num_steps += 1
+        self._records.clear()
+        self._stack.clear()
+        self._thread = None
+        super().stop(stream)
+
+
+class TorchModuleProfiler(ModuleProfiler):
+    """Profile the step with `torch.profiler`, annotating each module call by a `record_function` range."""
+    mode = 'torch'
+
+    def __init__(self, model, device, every=10):
+        super().__init__(model, device, every=every)
+        self._handles = list()
+        self._thread = None
+        self._ranges = list()
+        self._profiler = None
+
+    def _pre_hook(self, module, inputs):
+        if get_ident() != self._thread:
+            return
+        name = self.module_names[module]
+        if name not in self.stats.input_shapes:
+            self.stats.input_shapes[name] = _input_shapes(inputs)
+        annotation = torch.profiler.record_function(RANGE_PREFIX + name)
+        annotation.__enter__()
+        self._ranges.append(annotation)
+
+    def _post_hook(self, module, inputs, output):
+        if get_ident() != self._thread or not self._ranges:
+            return
+        self._ranges.pop().__exit__(None, None, None)
+
+    def start(self):
+        if not super().start():
+            return False
+        self._thread = get_ident()
+        for module in self.module_names:
+            self._handles.append(module.register_forward_pre_hook(self._pre_hook))
+            self._handles.append(module.register_forward_hook(self._post_hook))
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if self.device.is_cuda:
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self._profiler = torch.profiler.profile(activities=activities, record_shapes=True)
+        self._profiler.__enter__()
+        return True
+
+    def _time(self, event, self_time=True):
+        """Device time of an event on CUDA, and CPU time otherwise, in seconds."""
+        if self.device.is_cuda:
+            attr = 'self_device_time_total' if self_time else 'device_time_total'
+            if not hasattr(event, attr):
+                # PyTorch < 2.4
+                attr = 'self_cuda_time_total' if self_time else 'cuda_time_total'
+        else:
+            attr = 'self_cpu_time_total' if self_time else 'cpu_time_total'
+        return getattr(event, attr) * 1e-6
+
+    def stop(self, stream=None):
+        for handle in self._handles:
+            handle.remove()
+        self._handles.clear()
+        self.device.synchronize(stream)
+        self._profiler.__exit__(None, None, None)
+
+        events = self._profiler.events()
+        # the module running each forward operator, keyed by its autograd sequence number
+        sequence_modules = dict()
+        for event in events:
+            if event.name.startswith(RANGE_PREFIX):
+                self.stats.calls[event.name[len(RANGE_PREFIX):]] += 1
+                continue
+            module_name, in_backward, parent = None, False, event.cpu_parent
+            while parent is not None:
+                if parent.name.startswith('autograd::engine'):
+                    in_backward = True
+                    break
+                if module_name is None and parent.name.startswith(RANGE_PREFIX):
+                    module_name = parent.name[len(RANGE_PREFIX):]
+                parent = parent.cpu_parent
+            if in_backward:
+                continue
+            if event.name.startswith('autograd::engine'):
+                # attributed below, after all the forward operators are mapped
+                continue
+            if module_name is not None:
+                self.stats.forward_self[module_name] += self._time(event)
+                if event.sequence_nr >= 0:
+                    sequence_modules.setdefault((event.thread, event.sequence_nr), module_name)
+        for event in events:
+            # the sequence number is carried by the backward node, not by its `evaluate_function` range
+            parent = event.cpu_parent
+            if parent is None or not parent.name.startswith('autograd::engine') or event.sequence_nr < 0:
+                continue
+            module_name = sequence_modules.get((event.fwd_thread, event.sequence_nr))
+            if module_name is not None:
+                self.stats.backward_self[module_name] += self._time(event, self_time=False)
+        self.stats.num_steps += 1
+        self._profiler = None
+        self._ranges.clear()
+        self._thread = None
+        super().stop(stream)
+
+
+def get_module_profiler(mode: str, model, device: Device, every: int = 10):
+    """Create the module profiler of `--module-profile`, or return None if it is off."""
+    if mode == 'off' or model is None:
+        return None
+    if mode == 'hooks':
+        return HookModuleProfiler(model, device, every=every)
+    if mode == 'torch':
+        return TorchModuleProfiler(model, device, every=every)
+    raise ValueError(f'module_profile={mode} not supported, should be one of {MODULE_PROFILE_MODES}')
+
+
+def add_module_profile_arguments(parser):
+    """Register the module profiling related arguments on an `argparse.ArgumentParser`."""
+    parser.add_argument('--module-profile', type=str, default='off', choices=MODULE_PROFILE_MODES,
+                        help='Attribute the step time to the modules of the model. `hooks` times the forward '
+                             'pass with module hooks, `torch` also covers the backward pass with torch.profiler. '
+                             'Default to off.')
+    parser.add_argument('--module-profile-every', type=int, default=10,
+                        help='Profile every k-th measured step only. The profiled steps are excluded from the '
+                             'latency statistics. Default to 10.')
+    parser.add_argument('--module-profile-top', type=int, default=20,
+                        help='Number of named modules kept in the result table. Default to 20.')
+    return parser
+
+
+def check_backward_attribution(model_name: str = 'resnet18', batch_size: int = 2):
+    """Profile a training step of a torchvision model on CPU, and check that the backward pass is attributed to
+    the modules."""
+    import torchvision
+
+    device = Device('cpu')
+    model = getattr(torchvision.models, model_name)()
+    model.train()
+    profiler = TorchModuleProfiler(model, device, every=1)
+    inputs = torch.randn(batch_size, 3, 224, 224)
+    assert profiler.start(), 'The profiler is busy'
+    model(inputs).sum().backward()
+    profiler.stop()
+    stats = profiler.stats
+    assert stats.backward_self, 'No backward time is attributed to the modules'
+    conv_names = [name for name, module_type in stats.module_types.items() if module_type == 'Conv2d']
+    missing = [name for name in conv_names if not stats.backward_self.get(name)]
+    assert not missing, f'No backward time is attributed to the convolutions {missing}'
+    print(f'{model_name}: backward time of {len(stats.backward_self)} modules, '
+          f'{sum(stats.backward_self.values()) * 1e3:.1f} ms in total')
+
+
+if __name__ == '__main__':
+    check_backward_attribution()
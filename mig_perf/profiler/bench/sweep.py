@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+In-process parameter sweep of a benchmark workload, resuming from a checkpoint after an interruption.
+
+The grid is a JSON file:
+    {
+        "workload": "cv_infer",
+        "args": ["-n", "1000", "-i", "0", "-dbn", "results/batch_size"],
+        "grid": {"model": ["resnet50", "resnet101"], "bs": [1, 2, 4, 8]},
+        "runtimes": {"t1": {"num_threads": 1}, "t4": {"num_threads": 4}}
+    }
+`args` are the command line arguments shared by all the points. `grid` maps argument names (the `dest` of the
+workload arguments, e.g. `bs`, `seq_len`) to their values, or is a list of such mappings whose points are joined,
+e.g. the batch sizes fitting at each sequence length found by `bench.max_batch`. `runtimes` are optional named
+bundles of argument overrides. The sweep runs the product of them, with the points sharing a model next to each
+other, so the model stays resident in between.
+
+Each point is identified by the hash of its configuration. The progress is saved into a checkpoint file after
+each point, and the points already done are skipped when the sweep is run again.
+
+Examples:
+    python -m bench.sweep grid.json
+    python -m bench.sweep grid.json --list
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import time
+import traceback
+from pathlib import Path
+
+from bench.engine import BenchmarkEngine, get_args as get_workload_args, get_parser
+from bench.workloads import MODEL_CACHE, WORKLOADS
+from utils.device import Device, mask_cuda_devices
+
+# arguments shared by the whole sweep, as the device is selected once per process
+PROCESS_LEVEL_ARGS = ('device', 'gpu_id', 'mig_device_id')
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='In-process parameter sweep of a benchmark workload')
+    parser.add_argument('grid', type=str, help='Path to the grid JSON file.')
+    parser.add_argument('--checkpoint', type=str, default=None,
+                        help='Path to the checkpoint file. Default to <grid file name>.checkpoint.json '
+                             'next to the grid file.')
+    parser.add_argument('--max-resident-models', type=int, default=1,
+                        help='Max number of models kept resident between points. Default to 1.')
+    parser.add_argument('--max-attempts', type=int, default=2,
+                        help='Max number of attempts of a point, including the ones interrupted by a crash. '
+                             'Default to 2.')
+    parser.add_argument('--retry-failed', action='store_true', help='Retry the failed points.')
+    parser.add_argument('--stop-on-error', action='store_true', help='Stop the sweep at the first failed point.')
+    parser.add_argument('--list', action='store_true', help='List the points and their status without running.')
+    args = parser.parse_args()
+    if args.checkpoint is None:
+        grid_path = Path(args.grid)
+        args.checkpoint = str(grid_path.with_name(grid_path.stem + '.checkpoint.json'))
+    return args
+
+
+def expand_grid(grid_config):
+    """Expand the grid config into a list of points, each a dictionary of argument overrides."""
+    grids = grid_config.get('grid', dict())
+    if isinstance(grids, dict):
+        grids = [grids]
+    runtimes = grid_config.get('runtimes') or {None: dict()}
+    points = list()
+    for grid in grids:
+        keys = sorted(grid, key=lambda k: k != 'model')
+        for values in itertools.product(*(grid[k] for k in keys)):
+            for runtime, overrides in runtimes.items():
+                point = dict(zip(keys, values))
+                point.update(overrides)
+                if runtime is not None:
+                    point['runtime'] = runtime
+                points.append(point)
+    # iterate the model in the outermost loop, so the points sharing a model are consecutive
+    points.sort(key=lambda point: str(point.get('model', '')))
+    return points
+
+
+def config_hash(workload_name, base_argv, point):
+    """Stable hash of the configuration of a sweep point."""
+    config = json.dumps({'workload': workload_name, 'args': base_argv, 'point': point}, sort_keys=True)
+    return hashlib.sha1(config.encode()).hexdigest()[:16]
+
+
+def point_to_argv(parser, point):
+    """Convert the argument overrides of a point to command line arguments of the workload parser."""
+    option_strings = {action.dest: action.option_strings[-1] for action in parser._actions if action.option_strings}
+    argv = list()
+    for dest, value in point.items():
+        if dest == 'runtime':
+            continue
+        if dest not in option_strings:
+            raise ValueError(f'Unknown argument `{dest}` in the sweep grid')
+        if isinstance(value, bool):
+            if value:
+                argv.append(option_strings[dest])
+        elif isinstance(value, (list, tuple)):
+            argv.extend([option_strings[dest]] + [str(v) for v in value])
+        else:
+            argv.extend([option_strings[dest], str(value)])
+    return argv
+
+
+class SweepCheckpoint(object):
+    """Progress of a sweep, keyed by the config hash of the points and saved atomically after each update."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.records = dict()
+        if self.path.exists():
+            with open(self.path) as f:
+                self.records = json.load(f)
+
+    def get(self, key):
+        return self.records.get(key, dict())
+
+    def update(self, key, **kwargs):
+        self.records.setdefault(key, dict()).update(kwargs)
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.records, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def run_point(workload_cls, parser, base_argv, point, key):
+    args = get_workload_args(workload_cls, base_argv + point_to_argv(parser, point))
+    # recorded in the client args of the result
+    args.config_hash = key
+    if point.get('runtime') and not args.report_suffix:
+        args.report_suffix = point['runtime']
+    engine = BenchmarkEngine(workload_cls(args, Device(args.device)))
+    engine.run()
+    return [str(path) for path in engine.result_files]
+
+
+def main():
+    sweep_args = get_args()
+    with open(sweep_args.grid) as f:
+        grid_config = json.load(f)
+    workload_cls = WORKLOADS[grid_config['workload']]
+    base_argv = [str(arg) for arg in grid_config.get('args', list())]
+    points = expand_grid(grid_config)
+    for point in points:
+        shared = set(point) & set(PROCESS_LEVEL_ARGS)
+        if shared:
+            raise ValueError(f'{sorted(shared)} cannot vary within a sweep, set them in `args` instead')
+
+    parser = get_parser(workload_cls)
+    checkpoint = SweepCheckpoint(sweep_args.checkpoint)
+    keys = [config_hash(workload_cls.name, base_argv, point) for point in points]
+    if sweep_args.list:
+        for key, point in zip(keys, points):
+            print(key, checkpoint.get(key).get('status', 'pending'), point)
+        return
+
+    # the device is selected once for the whole sweep
+    mask_cuda_devices(get_workload_args(workload_cls, base_argv + point_to_argv(parser, points[0])))
+    MODEL_CACHE.capacity = sweep_args.max_resident_models
+
+    num_done, num_failed, num_skipped = 0, 0, 0
+    for i, (key, point) in enumerate(zip(keys, points)):
+        record = checkpoint.get(key)
+        status, attempts = record.get('status'), record.get('attempts', 0)
+        if status == 'done' or (status == 'failed' and not sweep_args.retry_failed):
+            num_skipped += 1
+            continue
+        if status == 'running' and attempts >= sweep_args.max_attempts:
+            # the point crashed the sweep in all the previous attempts
+            checkpoint.update(key, status='failed', error='Interrupted in all the attempts')
+            num_failed += 1
+            continue
+
+        print(f'[{i + 1}/{len(points)}] {key}: {point}')
+        checkpoint.update(key, point=point, status='running', attempts=attempts + 1, start_time=time.time())
+        try:
+            result_files = run_point(workload_cls, parser, base_argv, point, key)
+        except Exception as e:
+            traceback.print_exc()
+            checkpoint.update(key, status='failed', error=repr(e), finish_time=time.time())
+            num_failed += 1
+            if sweep_args.stop_on_error:
+                break
+            continue
+        checkpoint.update(key, status='done', result_files=result_files, finish_time=time.time())
+        num_done += 1
+
+    print(f'Sweep finished: {num_done} done, {num_failed} failed, {num_skipped} skipped. '
+          f'Checkpoint saved in {sweep_args.checkpoint}')
+
+
+if __name__ == '__main__':
+    main()
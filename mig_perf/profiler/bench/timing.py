@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Low-overhead step timers of the benchmark engine.
+
+`EventStepTimer` records CUDA events on the stream of the step and resolves the durations once the events
+complete, so the step can run asynchronously. `HostStepTimer` reads `time.perf_counter_ns`, and has to
+synchronize the device to time a CUDA step. With `--sync-every k`, only every k-th step is synchronized,
+e.g., to collect the host-side breakdown of a CUDA step, while the other steps run asynchronously.
+"""
+import time
+from typing import Dict
+
+import torch
+
+from utils.device import Device
+
+TIMER_TYPES = ('auto', 'event', 'host')
+
+
+class StepTimer(object):
+    """Phase timer of a benchmark step. A workload calls `mark` at the end of each phase of its step.
+
+    Args:
+        device (Device): The device the step runs on.
+        start: Start marker of the step returned by `clock` or a previous `finish`. Default to now.
+        stream: The CUDA stream the step runs on. Default to the current stream.
+        synchronize (bool): Wait for the device at the marks and at the end of the step. Default to True.
+    """
+    name: str = None
+
+    def __init__(self, device: Device, start=None, stream=None, synchronize: bool = True):
+        self.device = device
+        self.stream = stream
+        self.synchronize = synchronize
+        self.records = dict()
+
+    @classmethod
+    def clock(cls, device: Device, stream=None):
+        """A start marker of a step at the current time."""
+        raise NotImplementedError
+
+    @property
+    def valid(self):
+        """Whether the durations of this step are meaningful."""
+        return True
+
+    def mark(self, name: str, synchronize: bool = True):
+        """Record the time since the last mark as phase `name`, summed over the repeated marks of the phase. A host
+        timer waits for the device first if both `synchronize` and the `synchronize` of the timer are set."""
+        raise NotImplementedError
+
+    def record(self, name: str, duration):
+        """Record a duration measured apart from the marks as phase `name`, e.g. a communication overlapping the
+        other phases. `duration` is in seconds, or a callable returning it once the step is complete."""
+        self.records[name] = duration
+
+    def resolve_records(self):
+        return {name: duration() if callable(duration) else duration for name, duration in self.records.items()}
+
+    def finish(self):
+        """End the step and return its end marker, which can be the start marker of the next step."""
+        raise NotImplementedError
+
+    def ready(self):
+        """Whether the durations can be read without blocking."""
+        return True
+
+    def result(self):
+        """Return a tuple of (step latency, {phase name: duration}) in seconds. Blocks until ready."""
+        raise NotImplementedError
+
+
+class NullStepTimer(StepTimer):
+    """A timer which does nothing, used for warm-up and uninstrumented runs."""
+    name = 'null'
+
+    @classmethod
+    def clock(cls, device, stream=None):
+        return None
+
+    @property
+    def valid(self):
+        return False
+
+    def mark(self, name, synchronize=True):
+        pass
+
+    def record(self, name, duration):
+        pass
+
+    def finish(self):
+        return None
+
+    def result(self):
+        return None, dict()
+
+
+class HostStepTimer(StepTimer):
+    """Time the step with `time.perf_counter_ns` on the host."""
+    name = 'host'
+
+    def __init__(self, device, start=None, stream=None, synchronize=True):
+        super().__init__(device, start=start, stream=stream, synchronize=synchronize)
+        self.start = self.last = time.perf_counter_ns() if start is None else start
+        self.end = None
+        self.phases: Dict[str, float] = dict()
+
+    @classmethod
+    def clock(cls, device, stream=None):
+        return time.perf_counter_ns()
+
+    @property
+    def valid(self):
+        # the host clock cannot time an unsynchronized CUDA step
+        return self.synchronize or not self.device.is_cuda
+
+    def mark(self, name, synchronize=True):
+        if synchronize and self.synchronize:
+            self.device.synchronize(self.stream)
+        now = time.perf_counter_ns()
+        self.phases[name] = self.phases.get(name, 0.) + (now - self.last) * 1e-9
+        self.last = now
+
+    def finish(self):
+        if self.synchronize:
+            self.device.synchronize(self.stream)
+        self.end = time.perf_counter_ns()
+        return self.end
+
+    def result(self):
+        return (self.end - self.start) * 1e-9, dict(self.phases, **self.resolve_records())
+
+
+class EventStepTimer(StepTimer):
+    """Time the step with CUDA events recorded on its stream. The marks never synchronize."""
+    name = 'event'
+
+    def __init__(self, device, start=None, stream=None, synchronize=True):
+        super().__init__(device, start=start, stream=stream, synchronize=synchronize)
+        self.start = self.clock(device, stream) if start is None else start
+        self.end = None
+        self.events = list()
+
+    @classmethod
+    def clock(cls, device, stream=None):
+        event = torch.cuda.Event(enable_timing=True)
+        event.record(stream)
+        return event
+
+    def mark(self, name, synchronize=True):
+        self.events.append((name, self.clock(self.device, self.stream)))
+
+    def finish(self):
+        self.end = self.clock(self.device, self.stream)
+        if self.synchronize:
+            self.end.synchronize()
+        return self.end
+
+    def ready(self):
+        return self.end.query()
+
+    def result(self):
+        self.end.synchronize()
+        phases, last = dict(), self.start
+        for name, event in self.events:
+            phases[name] = phases.get(name, 0.) + last.elapsed_time(event) * 1e-3
+            last = event
+        phases.update(self.resolve_records())
+        return self.start.elapsed_time(self.end) * 1e-3, phases
+
+
+def get_step_timer_cls(timer_type: str, device: Device):
+    """Resolve the step timer class. `auto` uses CUDA events on a CUDA device, and the host clock otherwise."""
+    if timer_type == 'auto':
+        timer_type = 'event' if device.is_cuda else 'host'
+    if timer_type == 'event':
+        if not device.is_cuda:
+            raise ValueError('CUDA event timer is only available on a CUDA device')
+        return EventStepTimer
+    if timer_type == 'host':
+        return HostStepTimer
+    raise ValueError(f'timer={timer_type} not supported, should be one of {TIMER_TYPES}')
+
+
+def add_timing_arguments(parser):
+    """Register the timing related arguments on an `argparse.ArgumentParser`."""
+    parser.add_argument('--timer', type=str, default='auto', choices=TIMER_TYPES,
+                        help='Step timer. `event` records CUDA events, `host` reads perf_counter_ns and '
+                             'synchronizes the device. Default to auto, event on CUDA and host on CPU.')
+    parser.add_argument('--sync-every', type=int, default=1,
+                        help='Synchronize the device every k-th step only, the other steps run asynchronously. '
+                             'With the host timer, only the synchronized steps are timed. Default to 1.')
+    parser.add_argument('--overhead-check-steps', type=int, default=0,
+                        help='Run this many uninstrumented steps after warm-up to report how much the timing '
+                             'changes the throughput. Default to 0, disabled.')
+    return parser
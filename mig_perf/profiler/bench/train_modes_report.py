@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare the training results of the optimizations in `utils.train_modes` with the default training step.
+
+The results of the same configuration (GPU / MIG profile, model, effective batch size, sequence length, processes,
+threads, data source and prefetch depth) are grouped, and each result with non-default training modes is compared
+with the result of the default modes: the speedup of the step latency, and the ratio of the peak memory. As the
+effective batch size counts the accumulated micro-batches, `-b 64 --grad-accum-steps 4` is compared with `-b 256`.
+The results are listed even without a default result to compare with, e.g. when `-b 256` runs out of memory.
+
+Examples:
+    python train/train_cv.py -m resnet50 -n 500 -b 64 -dbn results/train
+    python train/train_cv.py -m resnet50 -n 500 -b 64 -dbn results/train --amp fp16 --channels-last
+    python train/train_cv.py -m resnet50 -n 500 -b 16 -dbn results/train --grad-accum-steps 4
+    python -m bench.train_modes_report results/train
+"""
+import argparse
+
+from utils.misc import (
+    STEP_LATENCY_METRIC, TRAIN_CONFIG_FIELDS, add_report_arguments, latest_results, load_results, report_rows,
+    train_config_key,
+)
+from utils.train_modes import train_mode_name_parts
+
+TABLE_COLUMNS = ('gpu_instance_profile', 'model_name', 'batch_size', 'sequence_length', 'train_modes',
+                 'step_latency', 'qps', 'speedup', 'peak_memory_mb', 'memory_ratio')
+
+
+def modes_name(modes):
+    return '+'.join(train_mode_name_parts(modes)) or 'default'
+
+
+def group_key(result):
+    """The configuration of a result at its effective batch size, with its data source and prefetch depth."""
+    effective_result = dict(result, batch_size=result.get('effective_batch_size', result['batch_size']))
+    return train_config_key(effective_result) + (result['data_source'], result.get('prefetch', 0))
+
+
+def compare(results, statistic='mean'):
+    """Compare each result of non-default training modes with the default result of its configuration, if any."""
+    # keep the latest result of the training modes of a configuration, grouped by the effective batch size
+    groups = latest_results(
+        [result for result in results if 'train_modes' in result], group_key=group_key,
+        key=lambda result: modes_name(result['train_modes']),
+    )
+    rows = list()
+    for key, group in groups.items():
+        baseline = group.get('default')
+        baseline_step = baseline[f'{STEP_LATENCY_METRIC}_{statistic}'] if baseline is not None else None
+        baseline_memory = baseline.get('peak_memory_mb') if baseline is not None else None
+        for name, result in sorted(group.items()):
+            step = result[f'{STEP_LATENCY_METRIC}_{statistic}']
+            memory = result.get('peak_memory_mb')
+            row = dict(zip(TRAIN_CONFIG_FIELDS, key))
+            row.update({
+                'micro_batch_size': result['batch_size'], 'data_source': key[-2], 'prefetch': key[-1],
+                'train_modes': name, 'step_latency': step,
+                'forward_time': result.get(f'forward_time_{statistic}'),
+                'backward_time': result.get(f'backward_time_{statistic}'),
+                'speedup': baseline_step / step if step and baseline_step else None, 'peak_memory_mb': memory,
+                'memory_ratio': memory / baseline_memory if memory is not None and baseline_memory else None,
+                'qps': result['qps'],
+            })
+            rows.append(row)
+    rows.sort(key=lambda r: [str(r[name]) for name in TRAIN_CONFIG_FIELDS + ('data_source', 'prefetch')])
+    return rows
+
+
+def main():
+    parser = add_report_arguments(
+        argparse.ArgumentParser(description='Step time and memory of the training optimizations'),
+    )
+    args = parser.parse_args()
+
+    rows = compare(
+        load_results(args.results, required_fields=('data_source', f'{STEP_LATENCY_METRIC}_mean')),
+        statistic=args.statistic,
+    )
+    report_rows(rows, TABLE_COLUMNS, output=args.output, empty_message='No training result found')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,502 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Workload plugins of the benchmark engine: CV / NLP blocked inference and CV / NLP training.
+"""
+import contextlib
+import itertools
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch import nn
+from torch.backends import cudnn
+
+from bench.ddp import add_ddp_arguments, get_ddp_config, init_ddp_process, wrap_ddp
+from bench.engine import Workload
+from bench.timing import StepTimer
+from utils.data_hub import (
+    DEFAULT_DATASET_ROOT, SYNTHETIC_DATA, load_amazon_review_data, load_places365_data, load_synthetic_image_data,
+    load_synthetic_text_data,
+)
+from utils.image_shards import is_shard_root, load_shard_data
+from utils.model_hub import load_pytorch_model
+from utils.pipeline_manager import PreProcessor
+from utils.precision import NLP_PRECISIONS, add_precision_arguments, build_precision_model
+from utils.prefetcher import Prefetcher, add_prefetch_arguments
+from utils.token_cache import DEFAULT_TOKEN_CACHE_ROOT, load_cached_amazon_review_data
+from utils.train_modes import (
+    add_train_mode_arguments, apply_activation_checkpointing, autocast, build_grad_scaler, get_train_modes,
+    group_micro_batches, optimizer_kwargs, train_mode_name_parts,
+)
+
+IMAGE_DATA_PATH = str(Path(__file__).parent.parent / 'client' / 'n02124075_Egyptian_cat.jpg')
+TEXT_DATA = 'Material confined likewise it humanity raillery an unpacked as he Three ' \
+            'chief merit no if. Now how her edward engage not horses Oh resolution he ' \
+            'dissimilar precaution to comparison an Matters engaged between'
+PLACES365_DATASET_PATH = str(DEFAULT_DATASET_ROOT / 'places365_standard')
+AMAZON_REVIEW_DATASET = 'amazon_reviews_multi'
+
+
+class ModelCache(object):
+    """Keep the most recently used models resident, so that the sweep points sharing a model skip loading it.
+
+    Args:
+        capacity (int): Max number of resident models. Default to 0, loading the model every time.
+    """
+
+    def __init__(self, capacity: int = 0):
+        self.capacity = capacity
+        self._models = OrderedDict()
+
+    def get(self, key, factory):
+        """Return the model cached under `key`, or build it by `factory()`."""
+        if key in self._models:
+            self._models.move_to_end(key)
+            return self._models[key]
+        model = factory()
+        if self.capacity > 0:
+            self._models[key] = model
+            while len(self._models) > self.capacity:
+                self._models.popitem(last=False)
+        return model
+
+    def clear(self):
+        self._models.clear()
+
+
+MODEL_CACHE = ModelCache()
+
+
+class InferenceWorkload(Workload):
+    """Blocked inference of the same input batch for `--num_batches` batches on each of `--num_threads` threads."""
+    description = 'Blocked model inference'
+
+    def __init__(self, args, device, rank=0):
+        super().__init__(args, device, rank=rank)
+        self.model = self.inputs = None
+        self.precision_report = dict()
+
+    def model_key(self):
+        """Arguments determining the loaded model, under which the model is cached."""
+        return self.args.model, self.args.device, self.args.precision
+
+    def load_model(self):
+        """Load the model at `--precision`. Return the model and its precision report."""
+        print(f'Load {self.args.model} model...')
+        model = self.device.to(load_pytorch_model(model_name=self.args.model))
+        if self.args.precision != 'fp32':
+            print(f'Convert the model to {self.args.precision}...')
+        return build_precision_model(
+            model, self.args.precision, self.device, task=self.args.task, seq_len=getattr(self.args, 'seq_len', 64),
+            calibration_samples=self.args.calibration_samples, accuracy_samples=self.args.accuracy_samples,
+        )
+
+    def setup(self):
+        self.model, self.precision_report = MODEL_CACHE.get(self.model_key(), self.load_model)
+        self.inputs = self.device.to(self.build_inputs())
+
+    def build_inputs(self):
+        raise NotImplementedError
+
+    @property
+    def num_steps(self):
+        return self.args.num_batches
+
+    @property
+    def num_workers(self):
+        return self.args.num_threads
+
+    def iter_inputs(self, worker_id):
+        return itertools.repeat(self.inputs, self.num_steps)
+
+    def step(self, inputs, timer):
+        self.model(inputs)
+        return inputs.shape[0]
+
+    def profiled_module(self):
+        return self.model
+
+    def result_fields(self):
+        result = {'num_test_batches': self.args.num_batches, 'num_threads': self.args.num_threads}
+        result.update(self.precision_report)
+        return result
+
+    def file_name_parts(self, result):
+        return [f'bs{result["batch_size"]}', f'j{result["num_threads"]}'] + self.precision_name_parts(result)
+
+    @staticmethod
+    def precision_name_parts(result):
+        return [result['precision']] if result['precision'] != 'fp32' else []
+
+
+class CVInferenceWorkload(InferenceWorkload):
+    name = 'cv_infer'
+
+    @staticmethod
+    def add_arguments(parser):
+        parser.add_argument('-b', '--bs', help='frontend batch size', type=int, required=True)
+        parser.add_argument('-T', '--task', type=str, default='image_classification',
+                            help='The service name you are testing. Default to image_classification.')
+        parser.add_argument('-n', '--num_batches', type=int, required=True, help='Total number of batches to test.')
+        parser.add_argument('--data', type=str, default=IMAGE_DATA_PATH,
+                            help=f'The path to your testing image. Default to {IMAGE_DATA_PATH}')
+        parser.add_argument('-t', '--num_threads', type=int, default=1,
+                            help='number of threads to run concurrently to profile')
+        add_precision_arguments(parser)
+
+    def build_inputs(self):
+        with open(self.args.data, 'rb') as f:
+            image = f.read()
+        image_np = np.frombuffer(image, dtype=np.uint8)
+        return PreProcessor.transform_image2torch([image_np] * self.args.bs)
+
+
+class NLPInferenceWorkload(InferenceWorkload):
+    name = 'nlp_infer'
+
+    @staticmethod
+    def add_arguments(parser):
+        parser.add_argument('-b', '--bs', help='frontend batch size', type=int, required=True)
+        parser.add_argument('-T', '--task', type=str, default='sequence_classification',
+                            help='The service name you are testing. Default to sequence_classification.')
+        parser.add_argument('-n', '--num_batches', type=int, required=True, help='Total number of batches to test.')
+        parser.add_argument('--data', type=str, default=TEXT_DATA,
+                            help=f'The testing text. Default to {TEXT_DATA}')
+        parser.add_argument('-t', '--num_threads', type=int, default=1,
+                            help='number of threads to run concurrently to profile')
+        parser.add_argument('--seq_len', type=int, default=64, help='Sequence length of the text to be tested.')
+        add_precision_arguments(parser, precisions=NLP_PRECISIONS)
+
+    def build_inputs(self):
+        # Generate text at specific sequence length
+        preprocessor = PreProcessor.get_preprocessor(
+            task=self.args.task, model_name=self.args.model, padding="max_length", max_length=self.args.seq_len
+        )
+        return preprocessor([self.args.data] * self.args.bs)
+
+    def result_fields(self):
+        result = super().result_fields()
+        result['sequence_length'] = self.args.seq_len
+        return result
+
+    def file_name_parts(self, result):
+        return [f'bs{result["batch_size"]}', f'seq{result["sequence_length"]}', f'j{result["num_threads"]}'] \
+            + self.precision_name_parts(result)
+
+
+class TrainWorkload(Workload):
+    """Train the model for `--max_train_steps` steps, timing the data loading, forward and backward phases.
+    The training optimizations of `utils.train_modes` apply to the step and the optimizer. With `--ddp`, each of
+    the `--procs` processes trains a `bench.ddp` rank on its share of the `--bs` global batch."""
+    description = 'Model training'
+    timing_metric_names = ('step_latency', 'data_process_time', 'forward_time', 'backward_time')
+    completed_key = 'num_completed_steps'
+    time_input_fetching = True
+
+    def __init__(self, args, device, rank=0):
+        super().__init__(args, device, rank=rank)
+        self.train_dataloader = self.val_dataloader = None
+        self.model = self.optimizer = self.criterion = self.scaler = None
+        self.prefetchers = dict()
+        if args.grad_accum_steps < 1:
+            raise ValueError(f'grad_accum_steps={args.grad_accum_steps} should be at least 1')
+        self.ddp_config = get_ddp_config(args) if args.ddp else None
+        self.allreduce_timer = None
+        if self.ddp_config is not None:
+            self.timing_metric_names = self.timing_metric_names + ('allreduce_time',)
+
+    @property
+    def batch_size(self):
+        """Batch size of this process, the share of the rank in DDP."""
+        return self.ddp_config['per_rank_batch_size'] if self.ddp_config is not None else self.args.bs
+
+    def metric_instances(self):
+        if self.ddp_config is None:
+            return None
+        return self.ddp_config['metric_instances']
+
+    def data_shard_kwargs(self):
+        """Keyword arguments of the train data loaders splitting the data among the DDP ranks."""
+        if self.ddp_config is None:
+            return dict()
+        return {'num_replicas': self.ddp_config['world_size'], 'rank': self.rank}
+
+    @property
+    def num_loader_workers(self):
+        """Loader worker processes of this process, the host CPUs being shared by the DDP ranks."""
+        world_size = self.ddp_config['world_size'] if self.ddp_config is not None else 1
+        return max(os.cpu_count() // world_size, 1)
+
+    def setup(self):
+        if self.ddp_config is not None:
+            init_ddp_process(self.ddp_config, self.rank)
+        if self.device.is_cuda:
+            cudnn.benchmark = True
+        print('Prepare dataset...')
+        self.train_dataloader, self.val_dataloader = self.load_data()
+        self.criterion = self.device.to(nn.CrossEntropyLoss())
+
+    @property
+    def synthetic(self):
+        return self.args.data == SYNTHETIC_DATA
+
+    def load_data(self):
+        raise NotImplementedError
+
+    def build_model(self):
+        raise NotImplementedError
+
+    def build_optimizer(self, model):
+        """Build the optimizer, passing `self.optimizer_kwargs()` to select its implementation."""
+        raise NotImplementedError
+
+    def optimizer_kwargs(self):
+        return optimizer_kwargs(self.args.optimizer_impl)
+
+    @property
+    def channels_last(self):
+        return getattr(self.args, 'channels_last', False)
+
+    @property
+    def num_steps(self):
+        return self.args.max_train_steps
+
+    def prepare(self):
+        # train from the same initial state at each point of the sweep
+        print(f'Load {self.args.model} model...')
+        model = self.build_model()
+        if self.args.activation_checkpointing:
+            model = apply_activation_checkpointing(model)
+        self.model = self.device.to(model)
+        if self.channels_last:
+            self.model = self.model.to(memory_format=torch.channels_last)
+        if self.ddp_config is not None:
+            self.model, self.allreduce_timer = wrap_ddp(self.model, self.device)
+        print('Setup optimizer')
+        self.optimizer = self.build_optimizer(self.model)
+        self.scaler = build_grad_scaler(self.args.amp, self.device)
+
+    def warm_up_inputs(self):
+        # the synthetic batches are cycled
+        return itertools.cycle(self.val_dataloader) if self.synthetic else self.val_dataloader
+
+    def warm_up_step(self, inputs, timer):
+        with torch.no_grad(), autocast(self.args.amp, self.device):
+            self.forward(self.device.to(inputs))
+
+    def iter_inputs(self, worker_id):
+        self.model.train()
+        inputs = itertools.cycle(self.train_dataloader) if self.synthetic else self.train_dataloader
+        if self.args.prefetch:
+            inputs = self.prefetchers[worker_id] = Prefetcher(inputs, self.device, depth=self.args.prefetch)
+        return group_micro_batches(inputs, self.args.grad_accum_steps)
+
+    def prefetch_stats(self, worker_id):
+        prefetcher = self.prefetchers.get(worker_id)
+        return prefetcher.stats if prefetcher is not None else None
+
+    def forward(self, inputs):
+        """Return the model output and the labels of a batch already on the device."""
+        raise NotImplementedError
+
+    def no_sync(self, sync):
+        """Skip the DDP gradient all-reduce of the backward unless `sync`."""
+        if sync or self.ddp_config is None:
+            return contextlib.nullcontext()
+        return self.model.no_sync()
+
+    def step(self, inputs, timer: StepTimer):
+        # the inputs of an optimizer step are `--grad-accum-steps` micro-batches, timed into the same phases
+        micro_batches = self.device.to(inputs)
+        timer.mark('data_process_time', synchronize=False)
+        num_samples = 0
+        for i, micro_batch in enumerate(micro_batches):
+            last = i == len(micro_batches) - 1
+            with autocast(self.args.amp, self.device):
+                output, labels = self.forward(micro_batch)
+                loss = self.criterion(output, labels) / len(micro_batches)
+            timer.mark('forward_time')
+
+            if i == 0:
+                self.optimizer.zero_grad(set_to_none=self.args.set_to_none)
+            with self.no_sync(last):
+                (self.scaler.scale(loss) if self.scaler is not None else loss).backward()
+            if last and self.scaler is not None:
+                self.scaler.step(self.optimizer)
+                self.scaler.update()
+            elif last:
+                self.optimizer.step()
+            timer.mark('backward_time')
+            num_samples += len(labels)
+        if self.allreduce_timer is not None:
+            timer.record('allreduce_time', self.allreduce_timer.take())
+        return num_samples
+
+    def profiled_module(self):
+        # the modules of the model wrapped by DDP
+        return getattr(self.model, 'module', self.model)
+
+    def result_fields(self):
+        return {
+            'train_steps': self.args.max_train_steps, 'learning_rate': self.args.lr,
+            'weight_decay': self.args.weight_decay, 'data_source': 'synthetic' if self.synthetic else 'real',
+            'train_modes': get_train_modes(self.args), 'prefetch': self.args.prefetch,
+            'effective_batch_size': self.args.bs * self.args.grad_accum_steps, 'ddp': self.ddp_config,
+        }
+
+    def file_name_parts(self, result):
+        return [f'bs{result["batch_size"]}', f'lr{result["learning_rate"]}'] + self.data_name_parts(result)
+
+    @staticmethod
+    def data_name_parts(result):
+        parts = [result['data_source']] if result['data_source'] == 'synthetic' else []
+        if result['prefetch']:
+            parts.append(f'prefetch{result["prefetch"]}')
+        if result['ddp'] is not None:
+            parts.append(f'ddp{result["ddp"]["world_size"]}')
+        return parts + train_mode_name_parts(result['train_modes'])
+
+
+class CVTrainWorkload(TrainWorkload):
+    name = 'cv_train'
+    description = 'CV model training'
+
+    @staticmethod
+    def add_arguments(parser):
+        parser.add_argument('-T', '--task', type=str, default='image_classification',
+                            help='The service name you are testing. Default to image_classification.')
+        parser.add_argument('-b', '--bs', help='training batch size', type=int, default=256)
+        parser.add_argument('--data', type=str, default=PLACES365_DATASET_PATH,
+                            help=f'The path to your train dataset, the root of its image shards converted by '
+                                 f'`python -m utils.image_shards convert`, or `{SYNTHETIC_DATA}` for random images '
+                                 f'generated on the device. Default to {PLACES365_DATASET_PATH}')
+        parser.add_argument('--synthetic-batches', type=int, default=4,
+                            help='Number of distinct batches cycled with the synthetic data. Default to 4.')
+        parser.add_argument('-n', '--max_train_steps', type=int, required=True,
+                            help='Total number of batches to test.')
+        parser.add_argument('--lr', type=float, default=0.1, help='Learning rate')
+        parser.add_argument('--momentum', default=0.9, type=float, help='momentum')
+        parser.add_argument('--weight-decay', '--wd', default=1e-4, type=float,
+                            help='weight decay (default: 1e-4)')
+        parser.add_argument('--num_classes', default=365, type=int, help='num of class in the model')
+        add_train_mode_arguments(parser, torch.optim.SGD, channels_last=True)
+        add_prefetch_arguments(parser)
+        add_ddp_arguments(parser)
+
+    def load_data(self):
+        if self.synthetic:
+            return load_synthetic_image_data(
+                batch_size=self.batch_size, num_classes=self.args.num_classes, device=self.device.torch_device,
+                num_batches=self.args.synthetic_batches,
+            )
+        if is_shard_root(self.args.data):
+            return load_shard_data(
+                batch_size=self.batch_size, shard_root=self.args.data, device=self.device.torch_device,
+                **self.data_shard_kwargs(),
+            )
+        return load_places365_data(
+            batch_size=self.batch_size, data_root=self.args.data, num_workers=self.num_loader_workers,
+            **self.data_shard_kwargs(),
+        )
+
+    def build_model(self):
+        return load_pytorch_model(model_name=self.args.model, num_classes=self.args.num_classes)
+
+    def build_optimizer(self, model):
+        return torch.optim.SGD(model.parameters(), self.args.lr,
+                               momentum=self.args.momentum,
+                               weight_decay=self.args.weight_decay, **self.optimizer_kwargs())
+
+    def forward(self, inputs):
+        images, labels = inputs
+        if self.channels_last:
+            images = images.contiguous(memory_format=torch.channels_last)
+        return self.model(images), labels
+
+    def result_fields(self):
+        result = super().result_fields()
+        result['momentum'] = self.args.momentum
+        return result
+
+
+class NLPTrainWorkload(TrainWorkload):
+    name = 'nlp_train'
+    description = 'NLP model training'
+
+    @staticmethod
+    def add_arguments(parser):
+        parser.add_argument('-T', '--task', type=str, default='single_label_classification',
+                            help='The service name you are testing. Default to single_label_classification.')
+        parser.add_argument('-b', '--bs', help='training batch size', type=int, default=256)
+        parser.add_argument('--seq_len', type=int, default=64, help='Max sequence length')
+        parser.add_argument('--data', type=str, default=AMAZON_REVIEW_DATASET,
+                            choices=[AMAZON_REVIEW_DATASET, SYNTHETIC_DATA],
+                            help=f'The train dataset, or `{SYNTHETIC_DATA}` for random token IDs generated on the '
+                                 f'device and padded to --seq_len. Default to {AMAZON_REVIEW_DATASET}')
+        parser.add_argument('--token-cache', type=str, nargs='?', default=None, const=str(DEFAULT_TOKEN_CACHE_ROOT),
+                            help=f'Train on the pre-tokenized data cached under this root, batched by length, '
+                                 f'instead of tokenizing every batch. Default to {DEFAULT_TOKEN_CACHE_ROOT} if '
+                                 f'given without a value.')
+        parser.add_argument('--synthetic-batches', type=int, default=4,
+                            help='Number of distinct batches cycled with the synthetic data. Default to 4.')
+        parser.add_argument('-n', '--max_train_steps', type=int, required=True,
+                            help='Total number of batches to test.')
+        parser.add_argument('--lr', type=float, default=0.1, help='Learning rate')
+        parser.add_argument('--weight-decay', '--wd', default=1e-4, type=float,
+                            help='weight decay (default: 1e-4)')
+        parser.add_argument('--num_classes', default=5, type=int, help='num of class in the model')
+        add_train_mode_arguments(parser, torch.optim.AdamW)
+        add_prefetch_arguments(parser)
+        add_ddp_arguments(parser)
+
+    def load_data(self):
+        if self.synthetic:
+            from transformers import AutoConfig
+
+            return load_synthetic_text_data(
+                batch_size=self.batch_size, max_seq_len=self.args.seq_len,
+                vocab_size=AutoConfig.from_pretrained(self.args.model).vocab_size,
+                num_classes=self.args.num_classes, device=self.device.torch_device,
+                num_batches=self.args.synthetic_batches,
+            )
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(self.args.model)
+        if self.args.token_cache:
+            return load_cached_amazon_review_data(
+                tokenizer, batch_size=self.batch_size, max_seq_len=self.args.seq_len, cache_root=self.args.token_cache,
+                **self.data_shard_kwargs(),
+            )
+        return load_amazon_review_data(
+            batch_size=self.batch_size, max_seq_len=self.args.seq_len, tokenizer=tokenizer,
+            num_workers=self.num_loader_workers, **self.data_shard_kwargs(),
+        )
+
+    def build_model(self):
+        return load_pytorch_model(model_name=self.args.model, num_labels=self.args.num_classes)
+
+    def build_optimizer(self, model):
+        return torch.optim.AdamW(
+            model.parameters(), self.args.lr, weight_decay=self.args.weight_decay, **self.optimizer_kwargs(),
+        )
+
+    def forward(self, inputs):
+        return self.model(**inputs).logits, inputs['labels']
+
+    def result_fields(self):
+        result = super().result_fields()
+        result['sequence_length'] = self.args.seq_len
+        return result
+
+    def file_name_parts(self, result):
+        return [f'bs{result["batch_size"]}', f'seq{result["sequence_length"]}', f'lr{result["learning_rate"]}'] \
+            + self.data_name_parts(result)
+
+
+WORKLOADS = {
+    workload_cls.name: workload_cls
+    for workload_cls in (CVInferenceWorkload, NLPInferenceWorkload, CVTrainWorkload, NLPTrainWorkload)
+}
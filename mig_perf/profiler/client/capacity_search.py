@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Search the maximum sustainable throughput (QPS) of an inference service under a latency SLO.
+
+Instead of sweeping a fixed list of arrival rates, the search runs short Poisson probes against the
+service, grows the arrival rate exponentially until the SLO is violated, then bisects the bracket
+[last passing rate, first failing rate] until its relative width is below `--tolerance`. A probe is
+aborted as soon as the SLO has been violated for `--probe-abort-after` seconds. The final bracket is saved as
+`qps_bracket`, the resolution of the search.
+
+Both edges of the bracket are then probed `--confirm-probes` more times, with other arrival times. The latencies of
+all the probes of a rate are pooled, and the confidence interval of their SLO metric at `--ci-confidence` tells if
+the rate confidently meets the SLO (the upper bound below the threshold), confidently violates it (the lower bound
+above the threshold, or the error rate or the throughput checks failing), or neither. `max_sustainable_qps_ci` is
+[highest confidently passing rate, lowest confidently failing rate], assuming the latency grows with the rate.
+
+Examples:
+    # start the server first (see mig_perf/profiler/README.md)
+    python client/capacity_search.py -m resnet50 -b 1 -P --slo 'p99<0.1' -i 0 -gi 3
+"""
+import argparse
+import json
+import math
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+
+import numpy as np
+import requests
+
+from client.monitor import dcgm_gpu_metric_parser
+from client.pytorch_cv_client import DATA_PATH, SEED, sender
+from generator import WorkloadGenerator
+from utils.histogram import LatencyHistogram
+from utils.live_metrics import EarlyStopRule, LiveReporter
+from utils.pipeline_manager import PreProcessor
+from utils.request import make_restful_request_from_numpy
+
+SLO_PATTERN = re.compile(r'^\s*(p50|p95|p99|mean)\s*<\s*([0-9.eE+-]+)\s*$')
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Max sustainable throughput search under a latency SLO')
+    parser.add_argument('-b', '--bs', help='frontend batch size', type=int, required=True)
+    parser.add_argument('-m', '--model', type=str, required=True,
+                        help='Name of the used models. For example, resnet18.')
+    parser.add_argument('--url', type=str, default='http://localhost:50075',
+                        help='The host url of your services. Default to http://localhost:50075.')
+    parser.add_argument('-T', '--task', type=str, default='image_classification',
+                        help='The service name you are testing. Default to image_classification.')
+    parser.add_argument('--data', type=str, default=DATA_PATH,
+                        help=f'The path to your testing image. Default to {DATA_PATH}')
+    parser.add_argument('-P', '--preprocessing', action='store_true', help='Use client preprocessing.')
+    # search settings
+    parser.add_argument('--slo', type=str, default='p99<0.1',
+                        help='Latency SLO in seconds, one of p50/p95/p99/mean, e.g. "p99<0.1". Default to p99<0.1.')
+    parser.add_argument('--max-error-rate', type=float, default=0.01,
+                        help='Max ratio of failed requests for a probe to pass. Default to 0.01.')
+    parser.add_argument('--rate-tolerance', type=float, default=0.1,
+                        help='A probe fails if the achieved QPS is below (1 - tolerance) * offered QPS. '
+                             'Default to 0.1.')
+    parser.add_argument('--start-rate', type=float, default=25, help='The first probed arrival rate. Default to 25.')
+    parser.add_argument('--max-rate', type=float, default=10000, help='Upper bound of the arrival rate.')
+    parser.add_argument('--growth', type=float, default=2., help='Exponential bracketing factor. Default to 2.')
+    parser.add_argument('--tolerance', type=float, default=0.05,
+                        help='Stop bisection when (hi - lo) / hi is below this value. Default to 0.05.')
+    parser.add_argument('--max-probes', type=int, default=16, help='Max number of probes. Default to 16.')
+    parser.add_argument('--probe-time', type=float, default=10, help='Duration of each probe. Default to 10.')
+    parser.add_argument('--probe-abort-after', type=float, default=2.,
+                        help='Abort a probe once the SLO is violated for this many seconds. Default to 2.')
+    parser.add_argument('--cooldown', type=float, default=2.,
+                        help='Idle seconds between probes to drain the server queue. Default to 2.')
+    parser.add_argument('--num-workers', type=int, default=10,
+                        help='Number of concurrent sender threads. Default to 10.')
+    parser.add_argument('--confirm-probes', type=int, default=3,
+                        help='Number of extra probes of each edge of the final bracket, pooled into the confidence '
+                             'interval of the max sustainable QPS. Default to 3.')
+    parser.add_argument('--ci-confidence', type=float, default=0.95,
+                        help='Confidence level of the SLO metric and max sustainable QPS intervals. '
+                             'Default to 0.95.')
+    # GPU related arguments
+    parser.add_argument('-i', '--gpu-id', type=int, default=0, help='GPU ID. Default to 0.')
+    parser.add_argument(
+        '-gi', '--gpu-instance-id', type=int, default=None,
+        help='GPU Instance ID. Specified when MIG is enabled.'
+    )
+    parser.add_argument('--dcgm-url', type=str, default='http://0.0.0.0:9400/metrics',
+                        help='DCGM exporter URL to read the GPU (instance) profile from.')
+    # experiment settings
+    parser.add_argument('-dbn', '--database_name', type=str, default='test',
+                        help='The database name you record data to. Default to test.')
+    parser.add_argument('--report-suffix', type=str, default='',
+                        help='Suffix to the database name the record data saved.')
+    parser.add_argument('--dry-run', action='store_true', help='Dry running the experiment without save result.')
+    args = parser.parse_args()
+    match = SLO_PATTERN.match(args.slo)
+    if not match:
+        parser.error(f'Cannot parse SLO: {args.slo}, expecting {{p50|p95|p99|mean}}<SECONDS')
+    args.slo_metric, args.slo_threshold = match.group(1), float(match.group(2))
+    return args
+
+
+def slo_metric_ci(hist: LatencyHistogram, args):
+    """Confidence interval of the SLO metric of the latencies at `args.ci_confidence`."""
+    if args.slo_metric == 'mean':
+        return hist.mean_ci(args.ci_confidence)
+    return hist.percentile_ci(float(args.slo_metric[1:]), args.ci_confidence)
+
+
+def run_probe(url, request, rate, args, seed=SEED):
+    """Send a Poisson workload at `rate` req/s for `args.probe_time` seconds and check it against the SLO.
+
+    Returns:
+        A dictionary of the probe result, whose `passed` field tells if the SLO is met, with the latency
+        `histogram` pooled by `rate_verdicts`.
+    """
+    hist = LatencyHistogram()
+    fail_count = 0
+    lock = Lock()
+    reporter = LiveReporter(
+        window=max(args.probe_abort_after, 1.), interval=0.5, verbose=False,
+        rules=[EarlyStopRule(args.slo_metric, '>', args.slo_threshold, duration=args.probe_abort_after)],
+    )
+
+    def record_result(future):
+        nonlocal fail_count
+        try:
+            latency = future.result()['times']['latency']
+        except Exception:
+            with lock:
+                fail_count += 1
+            reporter.record_error()
+            return
+        hist.record(latency)
+        reporter.record(latency)
+
+    send_time_list = WorkloadGenerator.gen_arrival_time(duration=args.probe_time, arrival_rate=rate, seed=seed)
+    request_num = 0
+    reporter.start()
+    start_time = time.time()
+    with ThreadPoolExecutor(args.num_workers) as executor:
+        for arrive_time in send_time_list:
+            if reporter.should_stop:
+                break
+            executor.submit(sender, url, request).add_done_callback(record_result)
+            request_num += 1
+            time.sleep(max(arrive_time + start_time - time.time(), 0))
+        send_finish_time = time.time()
+    finish_time = time.time()
+    reporter.stop()
+
+    # a saturated service cannot keep up with the offered load, its backlog delays the finish time
+    offered_qps = request_num / max(send_finish_time - start_time, 1e-9)
+    qps = hist.count / (finish_time - start_time)
+    error_rate = fail_count / request_num if request_num else 0.
+    if args.slo_metric == 'mean':
+        observed = hist.mean
+    else:
+        observed = hist.percentile(float(args.slo_metric[1:])) if hist.count else math.nan
+    passed = (
+            not reporter.should_stop
+            and hist.count > 0 and observed < args.slo_threshold
+            and error_rate <= args.max_error_rate
+            and qps >= (1 - args.rate_tolerance) * offered_qps
+    )
+    result = {
+        'arrival_rate': rate, 'seed': seed, 'passed': passed, 'aborted': reporter.should_stop,
+        'probe_time': finish_time - start_time, 'num_sent_requests': request_num,
+        'fail_count': fail_count, 'error_rate': error_rate, 'offered_qps': offered_qps, 'qps': qps,
+        f'latency_{args.slo_metric}': observed,
+    }
+    result.update(hist.summary('latency'))
+    if hist.count:
+        result[f'latency_{args.slo_metric}_ci'] = slo_metric_ci(hist, args)
+    result['histogram'] = hist.to_dict()
+    return result
+
+
+def search_capacity(probe, start_rate, max_rate, growth=2., tolerance=0.05, max_probes=16):
+    """Exponential bracketing followed by bisection on the arrival rate.
+
+    Args:
+        probe (Callable[[float], dict]): Run a probe at the given rate, returning a dict with a `passed` field.
+        start_rate (float): The first probed rate.
+        max_rate (float): Upper bound of the searched rate.
+        growth (float): Multiplier of the rate during bracketing.
+        tolerance (float): Bisection stops when (hi - lo) / hi < tolerance.
+        max_probes (int): Budget of probes.
+
+    Returns:
+        A tuple of (highest passing rate, lowest failing rate, list of probe records). The lowest
+        failing rate is None if `max_rate` is sustainable.
+    """
+    probes = list()
+    lo, hi = 0., None
+
+    # exponential bracketing
+    rate = start_rate
+    while len(probes) < max_probes:
+        record = probe(rate)
+        probes.append(record)
+        if not record['passed']:
+            hi = rate
+            break
+        lo = rate
+        if rate >= max_rate:
+            break
+        rate = min(rate * growth, max_rate)
+
+    # bisection
+    while hi is not None and len(probes) < max_probes and (hi - lo) / hi > tolerance:
+        rate = (lo + hi) / 2
+        record = probe(rate)
+        probes.append(record)
+        if record['passed']:
+            lo = rate
+        else:
+            hi = rate
+
+    return lo, hi, probes
+
+
+def rate_verdicts(probes, args):
+    """Pool the probes of each arrival rate, and tell if the rate confidently passes the SLO, confidently fails it,
+    or is inconclusive, from the confidence interval of the SLO metric of the pooled latencies.
+
+    Returns:
+        A list of dictionaries of the verdict of each probed rate, in increasing rate.
+    """
+    probes_by_rate = dict()
+    for record in probes:
+        probes_by_rate.setdefault(record['arrival_rate'], list()).append(record)
+    verdicts = list()
+    for rate, records in sorted(probes_by_rate.items()):
+        hist = LatencyHistogram()
+        for record in records:
+            hist.merge(LatencyHistogram.from_dict(record['histogram']))
+        num_sent = sum(record['num_sent_requests'] for record in records)
+        error_rate = sum(record['fail_count'] for record in records) / num_sent if num_sent else 0.
+        ci_lo, ci_hi = slo_metric_ci(hist, args) if hist.count else (math.nan, math.nan)
+        # an aborted or saturated probe violated the SLO for a sustained period
+        violated = error_rate > args.max_error_rate or any(
+            record['aborted'] or record['qps'] < (1 - args.rate_tolerance) * record['offered_qps']
+            for record in records
+        )
+        if violated or not hist.count or ci_lo >= args.slo_threshold:
+            verdict = 'fail'
+        elif ci_hi < args.slo_threshold:
+            verdict = 'pass'
+        else:
+            verdict = 'inconclusive'
+        verdicts.append({
+            'arrival_rate': rate, 'verdict': verdict, 'num_probes': len(records), 'error_rate': error_rate,
+            f'latency_{args.slo_metric}_ci': [ci_lo, ci_hi],
+        })
+    return verdicts
+
+
+def max_sustainable_qps_ci(verdicts):
+    """[highest confidently passing rate, lowest confidently failing rate] of the rate verdicts. The upper bound
+    is None if no rate confidently fails."""
+    upper = min((v['arrival_rate'] for v in verdicts if v['verdict'] == 'fail'), default=None)
+    passing = [v['arrival_rate'] for v in verdicts if v['verdict'] == 'pass']
+    lower = max((rate for rate in passing if upper is None or rate < upper), default=0.)
+    return [lower, upper]
+
+
+def get_gpu_labels(args):
+    """Read the static GPU (instance) profile from a single DCGM exporter scrape, if available."""
+    try:
+        metrics = dcgm_gpu_metric_parser(requests.get(args.dcgm_url, timeout=5).text)
+    except requests.RequestException:
+        return dict()
+    return dict(metrics.get((args.gpu_id, args.gpu_instance_id), dict()).get('labels', dict()))
+
+
+if __name__ == '__main__':
+    args_ = get_args()
+    url_ = f'{args_.url}/predict'
+    with open(args_.data, 'rb') as f:
+        image = f.read()
+    image_np = np.frombuffer(image, dtype=np.uint8)
+    if args_.preprocessing:
+        image_np = PreProcessor.transform_image2torch([image_np]).numpy()[0]
+    request_ = make_restful_request_from_numpy(image_np)
+
+    print(f'Searching max sustainable QPS of {args_.model} under SLO {args_.slo}...')
+    gpu_labels = get_gpu_labels(args_)
+    search_start_time = time.time()
+
+
+    def probe_(rate, seed=SEED):
+        record = run_probe(url_, request_, rate, args_, seed=seed)
+        print(f'rate: {rate:.2f} req/s, qps: {record["qps"]:.2f}, '
+              f'{args_.slo_metric}: {record[f"latency_{args_.slo_metric}"] * 1000:.2f} ms, '
+              f'error rate: {record["error_rate"] * 100:.2f}%, {"PASS" if record["passed"] else "FAIL"}')
+        time.sleep(args_.cooldown)
+        return record
+
+
+    lo_, hi_, probes_ = search_capacity(
+        probe_, start_rate=args_.start_rate, max_rate=args_.max_rate, growth=args_.growth,
+        tolerance=args_.tolerance, max_probes=args_.max_probes,
+    )
+    # probe the bracket edges again with other arrival times, to pool them into the confidence interval
+    confirm_probes_ = [
+        probe_(rate, seed=SEED + i + 1) for rate in (lo_, hi_) if rate for i in range(args_.confirm_probes)
+    ]
+    verdicts_ = rate_verdicts(probes_ + confirm_probes_, args_)
+    qps_ci_ = max_sustainable_qps_ci(verdicts_)
+    print(f'Max sustainable QPS: {lo_:.2f} (bracket: [{lo_:.2f}, {hi_ if hi_ is not None else math.inf:.2f}], '
+          f'{args_.ci_confidence:.0%} CI: [{qps_ci_[0]:.2f}, '
+          f'{qps_ci_[1] if qps_ci_[1] is not None else math.inf:.2f}])')
+
+    metrics = {
+        'test_time': datetime.now().strftime('%Y-%m-%d_%H-%M-%S'), 'start_time': search_start_time,
+        'batch_size': args_.bs, 'model_name': args_.model, 'task': args_.task,
+        'slo': args_.slo, 'max_sustainable_qps': lo_, 'qps_bracket': [lo_, hi_],
+        'max_sustainable_qps_ci': qps_ci_, 'ci_confidence': args_.ci_confidence, 'rate_verdicts': verdicts_,
+        'num_probes': len(probes_), 'num_confirm_probes': len(confirm_probes_),
+        'probe_time_total': sum(p['probe_time'] for p in probes_ + confirm_probes_),
+        'search_time': time.time() - search_start_time, 'probes': probes_, 'confirm_probes': confirm_probes_,
+        'client_preprocessing': args_.preprocessing,
+        'gpu_model_name': gpu_labels.get('modelName', 'unknown'),
+        'config': {
+            'client_args': vars(args_),
+            'gpu_static_profile': gpu_labels,
+            'mig': {
+                'enabled': gpu_labels.get('GPU_I_ID', None) is not None,
+                'gpu_instance_id': gpu_labels.get('GPU_I_ID', None),
+                'gpu_instance_profile': gpu_labels.get('GPU_I_PROFILE', None),
+            },
+        },
+    }
+    if args_.dry_run:
+        print('Dry running, result will not dumped')
+        exit(0)
+
+    save_json_file_name = Path(args_.database_name) / (
+            '_'.join([
+                metrics['gpu_model_name'].replace(' ', '-'),
+                metrics['model_name'],
+                f'bs{metrics["batch_size"]}',
+                'capacity',
+            ]) + (f'_{args_.report_suffix}' if args_.report_suffix else '') + '.json'
+    )
+    save_json_file_name.parent.mkdir(exist_ok=True, parents=True)
+    with open(save_json_file_name, 'w') as f:
+        json.dump(metrics, f)
+        print(f'result saved successfully as {save_json_file_name}')
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+A fake of the subset of the `pynvml` API read by `client.monitor.NVMLMetricCollector`, so that the NVML collector
+and the result processing of the GPU metrics can be run without a GPU.
+
+The fake GPUs draw a power oscillating between the idle and the max power, and the energy counter is the exact
+integral of that power since the creation of the fake. As on real GPUs, the utilization is not supported on a MIG
+device.
+
+Examples:
+    >>> collector = NVMLMetricCollector(nvml=FakeNVML(num_gpus=2, mig_instances=[(7, '1g.10gb'), (8, '1g.10gb')]))
+"""
+import math
+import re
+import time
+from types import SimpleNamespace
+
+MIB = 1024 ** 2
+
+
+class FakeNVMLError(Exception):
+    def __init__(self, value):
+        super().__init__(f'NVML error {value}')
+        self.value = value
+
+
+class _Handle(object):
+    def __init__(self, gpu_index, mig_index=None):
+        self.gpu_index = gpu_index
+        self.mig_index = mig_index
+
+
+class FakeNVML(object):
+    """Fake NVML of `num_gpus` GPUs, each with the MIG devices of `mig_instances` if given.
+
+    Args:
+        num_gpus (int): Number of GPUs. Default to 1.
+        mig_instances (List[tuple]): (gpu_instance_id, profile) of the MIG devices of each GPU, e.g.
+            [(1, '3g.40gb'), (2, '3g.40gb')]. Default to None, MIG disabled.
+        model_name (str): Model name of the GPUs. Default to 'NVIDIA Fake GPU'.
+        memory_mb (int): Memory of a GPU in MiB. Default to 81920.
+        idle_power (float): Min power in W. Default to 60.
+        max_power (float): Max power in W. Default to 300.
+        period (float): Period of the power oscillation in seconds. Default to 10.
+    """
+    NVMLError = FakeNVMLError
+    NVML_ERROR_NOT_SUPPORTED = 3
+    NVML_ERROR_NOT_FOUND = 6
+    NVML_TEMPERATURE_GPU = 0
+
+    def __init__(self, num_gpus=1, mig_instances=None, model_name='NVIDIA Fake GPU', memory_mb=81920,
+                 idle_power=60., max_power=300., period=10.):
+        self.num_gpus = num_gpus
+        self.mig_instances = list(mig_instances or ())
+        self.model_name = model_name
+        self.memory_mb = memory_mb
+        self.idle_power = idle_power
+        self.max_power = max_power
+        self.period = period
+        self.start_time = time.time()
+
+    @classmethod
+    def for_instances(cls, instances, **kwargs):
+        """Fake GPUs having the (gpu_id, gpu_instance_id) keys of `instances`, on MIG devices of 1g.10gb."""
+        instances = list(instances or [(0, None)])
+        gpu_instance_ids = sorted({i for _, i in instances if i is not None})
+        return cls(
+            num_gpus=max(gpu_id for gpu_id, _ in instances) + 1,
+            mig_instances=[(i, '1g.10gb') for i in gpu_instance_ids], **kwargs,
+        )
+
+    def _load(self, elapsed):
+        return 0.5 - 0.5 * math.cos(2 * math.pi * elapsed / self.period)
+
+    def _energy(self, elapsed):
+        """Energy in J since the creation, the integral of the power."""
+        dynamic = self.max_power - self.idle_power
+        oscillation = self.period / (2 * math.pi) * math.sin(2 * math.pi * elapsed / self.period)
+        return self.idle_power * elapsed + dynamic * 0.5 * (elapsed - oscillation)
+
+    def _elapsed(self):
+        return time.time() - self.start_time
+
+    def _check(self, handle):
+        if not isinstance(handle, _Handle) or handle.gpu_index >= self.num_gpus:
+            raise FakeNVMLError(self.NVML_ERROR_NOT_FOUND)
+
+    def nvmlInit(self):
+        pass
+
+    def nvmlShutdown(self):
+        pass
+
+    def nvmlDeviceGetCount(self):
+        return self.num_gpus
+
+    def nvmlDeviceGetHandleByIndex(self, index):
+        handle = _Handle(index)
+        self._check(handle)
+        return handle
+
+    def nvmlDeviceGetName(self, handle):
+        self._check(handle)
+        if handle.mig_index is None:
+            return self.model_name
+        return f'{self.model_name} MIG {self.mig_instances[handle.mig_index][1]}'
+
+    def nvmlDeviceGetUUID(self, handle):
+        self._check(handle)
+        if handle.mig_index is None:
+            return f'GPU-{handle.gpu_index:08x}-0000-0000-0000-000000000000'
+        return f'MIG-{handle.gpu_index:08x}-{handle.mig_index:04x}-0000-0000-000000000000'
+
+    def nvmlDeviceGetMigMode(self, handle):
+        self._check(handle)
+        mode = int(bool(self.mig_instances))
+        return [mode, mode]
+
+    def nvmlDeviceGetMaxMigDeviceCount(self, handle):
+        self._check(handle)
+        return 7
+
+    def nvmlDeviceGetMigDeviceHandleByIndex(self, handle, index):
+        self._check(handle)
+        if index >= len(self.mig_instances):
+            raise FakeNVMLError(self.NVML_ERROR_NOT_FOUND)
+        return _Handle(handle.gpu_index, index)
+
+    def nvmlDeviceGetGpuInstanceId(self, handle):
+        self._check(handle)
+        if handle.mig_index is None:
+            raise FakeNVMLError(self.NVML_ERROR_NOT_SUPPORTED)
+        return self.mig_instances[handle.mig_index][0]
+
+    def nvmlDeviceGetUtilizationRates(self, handle):
+        self._check(handle)
+        if handle.mig_index is not None:
+            raise FakeNVMLError(self.NVML_ERROR_NOT_SUPPORTED)
+        load = self._load(self._elapsed())
+        return SimpleNamespace(gpu=round(load * 100), memory=round(load * 60))
+
+    def nvmlDeviceGetMemoryInfo(self, handle):
+        self._check(handle)
+        total = self.memory_mb
+        if handle.mig_index is not None:
+            match = re.search(r'(\d+)gb', self.mig_instances[handle.mig_index][1])
+            total = int(match.group(1)) * 1024 if match else total
+        used = int(total * (0.2 + 0.5 * self._load(self._elapsed())))
+        return SimpleNamespace(total=total * MIB, used=used * MIB, free=(total - used) * MIB)
+
+    def nvmlDeviceGetPowerUsage(self, handle):
+        """Power in mW."""
+        self._check(handle)
+        load = self._load(self._elapsed())
+        return int((self.idle_power + (self.max_power - self.idle_power) * load) * 1e3)
+
+    def nvmlDeviceGetTotalEnergyConsumption(self, handle):
+        """Energy in mJ."""
+        self._check(handle)
+        return int(self._energy(self._elapsed()) * 1e3)
+
+    def nvmlDeviceGetTemperature(self, handle, sensor):
+        self._check(handle)
+        return int(35 + 40 * self._load(self._elapsed()))
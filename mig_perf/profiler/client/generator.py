@@ -10,6 +10,7 @@ Reference:
     - http://web.stanford.edu/class/archive/cs/cs109/cs109.1192/lectureNotes/8%20-%20Poisson.pdf
     -  http://web.mit.edu/modiano/www/6.263/lec5-6.pdf
 """
+import heapq
 import random
 
 
@@ -37,4 +38,39 @@ class WorkloadGenerator:
             start_time = start_time + random.expovariate(arrival_rate)
             arrive_time.append(start_time)
 
-        return arrive_time
\ No newline at end of file
+        return arrive_time
+
+    @staticmethod
+    def gen_split_arrival_time(duration=60 * 1, arrival_rate=5, weights=None, seed=None):
+        """
+        Generating the arrival time of a single poisson process and splitting the requests among endpoints
+        by the given weights. Each endpoint then receives a poisson process with rate `arrival_rate * weight`.
+        :param duration: the requests sending duration (in second).
+        :param arrival_rate: the total average number of requests per second.
+        :param weights: a list of relative traffic weight per endpoint. Default to a single endpoint.
+        :param seed: the random seed to reproduce the generated results.
+        :return: a list of (time to send request, endpoint index).
+        """
+        weights = weights or [1]
+        arrive_time = WorkloadGenerator.gen_arrival_time(duration=duration, arrival_rate=arrival_rate, seed=seed)
+        rng = random.Random(seed)
+        endpoints = rng.choices(range(len(weights)), weights=weights, k=len(arrive_time))
+        return list(zip(arrive_time, endpoints))
+
+    @staticmethod
+    def gen_merged_arrival_time(duration=60 * 1, arrival_rates=(5,), seed=None):
+        """
+        Generating an independent poisson process per endpoint and merging them into one schedule.
+        :param duration: the requests sending duration (in second).
+        :param arrival_rates: a list of average number of requests per second, one per endpoint.
+        :param seed: the random seed to reproduce the generated results.
+        :return: a list of (time to send request, endpoint index) sorted by time.
+        """
+        streams = list()
+        for i, arrival_rate in enumerate(arrival_rates):
+            stream_seed = None if seed is None else seed + i
+            arrive_time = WorkloadGenerator.gen_arrival_time(
+                duration=duration, arrival_rate=arrival_rate, seed=stream_seed
+            )
+            streams.append([(t, i) for t in arrive_time])
+        return list(heapq.merge(*streams))
@@ -5,60 +5,652 @@ Author: Li Yuanming
 Email: yuanmingleee@gmail.com
 Date: Dec 5, 2022
 """
+import json
+import math
+import re
+import socket
 import time
 from collections import defaultdict
-from threading import Thread
+from pathlib import Path
+from threading import Event, Lock, Thread
 
+import numpy as np
 import requests
-from prometheus_client.parser import text_string_to_metric_families
 
 
-def dcgm_gpu_metric_parser(metrics: str):
+DCGM_URL = 'http://0.0.0.0:9400/metrics'
+# time span of the samples kept in memory by default
+DEFAULT_BUFFER_SECONDS = 3600
+
+_LABEL_PATTERN = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def _parse_labels(label_str: str):
+    return {name: value.replace('\\"', '"').replace('\\\\', '\\')
+            for name, value in _LABEL_PATTERN.findall(label_str)}
+
+
+class DCGMTextParser(object):
+    """A single pass parser of the dcgm-exporter text exposition, extracting only the requested fields of the
+    requested GPU (instances).
+
+    A sample line is skipped by its field name before its labels are looked at. The label string of a GPU (instance)
+    is the same across the fields and the scrapes, so it is parsed once into the (gpu, GPU_I_ID) key and the labels,
+    and looked up afterwards. The labels of all the GPU (instances) are kept in `labels`, while the values are only
+    extracted for the requested ones. As `prometheus_client` does, the samples of a counter are named with a
+    `_total` suffix.
+
+    Args:
+        fields (Iterable[str]): Names of the extracted DCGM fields. Default to None, all the fields.
+        instances (Iterable[tuple]): (gpu_id, gpu_instance_id) keys of the extracted GPU (instances), where the GPU
+            instance ID is None if MIG is not enabled. A (gpu_id, None) key of a MIG-enabled GPU extracts all of its
+            instances. Default to None, all the GPU (instances).
+    """
+
+    def __init__(self, fields=None, instances=None):
+        # the fields are matched by their exposed names, without the `_total` suffix of the counters
+        self.fields = frozenset(f[:-len('_total')] if f.endswith('_total') else f for f in fields) if fields else None
+        self.instances = frozenset(instances) if instances else None
+        # (gpu_id, gpu_instance_id) -> labels
+        self.labels = dict()
+        self._keys = dict()
+        # exposed name -> sample name of the counters
+        self._sample_names = dict()
+
+    def _parse_key(self, label_str: str):
+        labels = _parse_labels(label_str)
+        gpu_instance_id = labels.get('GPU_I_ID', None)
+        key = int(labels['gpu']), int(gpu_instance_id) if gpu_instance_id else None
+        self.labels.setdefault(key, labels)
+        self._keys[label_str] = key
+        return key
+
+    def parse(self, text: str):
+        """Parse a scrape into {(gpu_id, gpu_instance_id): {field: value}}."""
+        fields, instances, keys, sample_names = self.fields, self.instances, self._keys, self._sample_names
+        values = dict()
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line[0] == '#':
+                if line.startswith('# TYPE ') and line.endswith(' counter'):
+                    name = line.split()[2]
+                    if not name.endswith('_total'):
+                        sample_names[name] = name + '_total'
+                continue
+            brace = line.find('{')
+            # dcgm-exporter labels every sample with its GPU
+            if brace < 0:
+                continue
+            name = line[:brace]
+            if fields is not None and name not in fields:
+                continue
+            end = line.rfind('}')
+            label_str = line[brace + 1:end]
+            key = keys.get(label_str)
+            if key is None:
+                key = self._parse_key(label_str)
+            if instances is not None and key not in instances and (key[0], None) not in instances:
+                continue
+            # the value, optionally followed by a timestamp
+            value = line[end + 1:].split(None, 1)[0]
+            try:
+                values.setdefault(key, dict())[sample_names.get(name, name)] = float(value)
+            except ValueError:
+                continue
+        return values
+
+
+def dcgm_gpu_metric_parser(metrics: str, fields=None, instances=None):
     # TODO: change GPU Instance ID -> MIG Device ID. GPU Instance ID is not determined by device order
     # gpu_id -> { gpu_instance_id -> metrics }
     # if no gpu instance (MIG not enabled), gpu_instance_id is None
+    parser = DCGMTextParser(fields=fields, instances=instances)
+    values = parser.parse(metrics)
     gpu_metrics_dict = defaultdict(dict)
-    for family in text_string_to_metric_families(metrics):
-        for sample in family.samples:
-            name, labels, value = sample.name, sample.labels, sample.value
-            # build id
-            gpu_id = int(labels['gpu'])
-            if labels.get('GPU_I_ID', None):
-                gpu_instance_id = int(labels['GPU_I_ID'])
-            else:
-                gpu_instance_id = None
-
-            if not gpu_metrics_dict[gpu_id, gpu_instance_id]:
-                gpu_metrics_dict[gpu_id, gpu_instance_id]['labels'] = labels
-            gpu_metrics_dict[gpu_id, gpu_instance_id][name] = value
+    for key, labels in parser.labels.items():
+        gpu_metrics_dict[key]['labels'] = labels
+        gpu_metrics_dict[key].update(values.get(key, dict()))
+    return gpu_metrics_dict
+
+
+def _encode_key(key):
+    gpu_id, gpu_instance_id = key
+    return f'{gpu_id},{"" if gpu_instance_id is None else gpu_instance_id}'
+
+
+def _decode_key(key):
+    gpu_id, gpu_instance_id = key.split(',')
+    return int(gpu_id), int(gpu_instance_id) if gpu_instance_id else None
+
 
+def _to_list(array: np.ndarray):
+    """A JSON serializable list of a column, with the missing values as None."""
+    values = array.tolist()
+    if np.isnan(array).any():
+        values = [None if v != v else v for v in values]
+    return values
+
+
+def gpu_metrics_arrays_to_dict(times, arrays, labels):
+    """Convert the arrays of the samples to {'time': times, (gpu_id, gpu_instance_id): {'labels': [labels], field:
+    values}} of lists, the format of the GPU metrics in the results."""
+    gpu_metrics_dict = {'time': times.tolist()}
+    for key, key_labels in labels.items():
+        gpu_metrics_dict[key] = {'labels': [key_labels]}
+        for field, column in arrays.get(key, dict()).items():
+            gpu_metrics_dict[key][field] = _to_list(column)
     return gpu_metrics_dict
 
 
-class DCGMMetricCollector(object):
-    def __init__(self, dcgm_url='http://0.0.0.0:9400/metrics'):
-        self.dcgm_url = dcgm_url
+class ColumnarMetricStore(object):
+    """The metric samples in a NumPy array per (GPU (instance), field), indexed by the sample times in `times`.
+
+    The arrays double when full. With a capacity, they stop growing at it and become a ring buffer, and `append`
+    returns the sample it overwrites. A field missing from a sample is NaN.
+
+    Args:
+        capacity (int): Max number of samples. Default to None, unbounded.
+        initial_capacity (int): Initial length of the arrays. Default to 1024.
+    """
+
+    def __init__(self, capacity=None, initial_capacity=1024):
+        self.capacity = capacity
+        self._length = min(capacity, initial_capacity) if capacity else initial_capacity
+        self._count = 0
+        self.times = np.empty(self._length)
+        # (gpu_id, gpu_instance_id) -> field -> values
+        self.columns = defaultdict(dict)
+        self._num_columns = 0
 
-        self._thread = Thread(target=self.runner)
+    def __len__(self):
+        return min(self._count, self.capacity) if self.capacity else self._count
+
+    def clear(self):
+        self._count = 0
+        self.columns.clear()
+        self._num_columns = 0
+
+    def _grow(self):
+        extra = min(self._length, self.capacity - self._length) if self.capacity else self._length
+        self.times = np.concatenate((self.times, np.empty(extra)))
+        for columns in self.columns.values():
+            for field, column in columns.items():
+                columns[field] = np.concatenate((column, np.full(extra, np.nan)))
+        self._length += extra
+
+    def _row(self, index):
+        row = {'time': self.times[index].item()}
+        for key, columns in self.columns.items():
+            row[key] = {
+                field: column[index].item() for field, column in columns.items() if not np.isnan(column[index])
+            }
+        return row
+
+    def append(self, sample_time: float, values: dict):
+        """Append a sample of {(gpu_id, gpu_instance_id): {field: value}}. Return the overwritten sample in the same
+        format with its 'time', or None."""
+        evicted = None
+        if self.capacity and self._count >= self.capacity:
+            index = self._count % self.capacity
+            evicted = self._row(index)
+        else:
+            index = self._count
+            if index == self._length:
+                self._grow()
+        self.times[index] = sample_time
+        num_values = 0
+        for key, fields in values.items():
+            columns = self.columns[key]
+            for field, value in fields.items():
+                column = columns.get(field)
+                if column is None:
+                    column = columns[field] = np.full(self._length, np.nan)
+                    self._num_columns += 1
+                column[index] = value
+                num_values += 1
+        if num_values < self._num_columns:
+            for key, columns in self.columns.items():
+                fields = values.get(key, dict())
+                for field, column in columns.items():
+                    if field not in fields:
+                        column[index] = np.nan
+        self._count += 1
+        return evicted
+
+    def _ordered(self, array):
+        if self.capacity and self._count > self.capacity:
+            index = self._count % self.capacity
+            return np.concatenate((array[index:], array[:index]))
+        return array[:len(self)]
+
+    def to_arrays(self):
+        """The sample times and {(gpu_id, gpu_instance_id): {field: values}}, in time order."""
+        return self._ordered(self.times), {
+            key: {field: self._ordered(column) for field, column in columns.items()}
+            for key, columns in self.columns.items()
+        }
+
+
+class MetricCollector(object):
+    """Sample the GPU metrics periodically on a background thread. The base class of the collector backends.
+
+    The samples are taken at absolute deadlines `start + k * interval`, so the period does not drift by the
+    sampling time. A deadline already passed when the previous sample finishes is skipped and counted as missed.
+    The samples are kept in a `ColumnarMetricStore`, a ring buffer of `max_samples`, by default one hour of samples
+    at the interval. The samples evicted from it are either dropped, keeping the latest ones only, or appended to
+    `spill_path` as JSON lines and read back by `gpu_metrics_arrays`.
+
+    A backend implements `fetch` returning the raw sample, and `parse` extracting {(gpu_id, gpu_instance_id):
+    {field: value}} of the `fields` of the `instances` from it, with the fields named as the DCGM fields. It keeps
+    the labels of the GPU (instances) in `labels`, in the format of the dcgm-exporter labels.
+
+    Args:
+        interval (float): Sampling interval in seconds, down to `min_interval` of the backend. Default to 1.
+        max_samples (int): Capacity of the ring buffer. Default to None, `DEFAULT_BUFFER_SECONDS` at the interval,
+            and 0 for unbounded.
+        spill_path (str): Path of the JSON lines file of the evicted samples. Default to None, dropping them.
+        fields (Iterable[str]): Names of the collected DCGM fields. Default to None, all the fields of the backend.
+        instances (Iterable[tuple]): (gpu_id, gpu_instance_id) keys of the collected GPU (instances), a (gpu_id,
+            None) key collecting all the instances of a MIG-enabled GPU. The labels of the others are still
+            collected. Default to None, all the GPU (instances).
+    """
+    name = None
+    min_interval = 0.1
+    # errors of `fetch` counted as failed samples instead of stopping the collector
+    fetch_errors = ()
+
+    def __init__(self, interval=1., max_samples=None, spill_path=None, fields=None, instances=None):
+        if interval < self.min_interval:
+            raise ValueError(f'interval={interval} should be at least {self.min_interval} second for {self.name}')
+        self.interval = interval
+        if max_samples is None:
+            max_samples = math.ceil(DEFAULT_BUFFER_SECONDS / interval)
+        self.max_samples = max_samples or None
+        self.spill_path = Path(spill_path) if spill_path else None
+        self.fields = fields
+        self.instances = instances
+
+        self._thread = None
+        self._stop_event = Event()
+        self._lock = Lock()
+        self.store = ColumnarMetricStore(capacity=self.max_samples)
         self.is_running = False
-        self.gpu_metrics_list = list()
+        self.start_time = self.stop_time = None
+        self.stats = dict()
+
+    @classmethod
+    def from_args(cls, args, instances=None, **kwargs):
+        return cls(
+            interval=args.dcgm_interval, max_samples=args.dcgm_max_samples, spill_path=args.dcgm_spill_path,
+            fields=args.dcgm_fields, instances=instances, **kwargs,
+        )
+
+    @property
+    def labels(self):
+        """{(gpu_id, gpu_instance_id): labels} of all the GPU (instances) seen."""
+        raise NotImplementedError
+
+    def open(self):
+        """Acquire the resources of the sampling, called on the collector thread before the first sample."""
+
+    def close(self):
+        """Release the resources of the sampling, called on the collector thread after the last sample."""
+
+    def fetch(self):
+        raise NotImplementedError
+
+    def parse(self, raw):
+        raise NotImplementedError
+
+    def _reset_stats(self):
+        self.stats = {
+            'num_samples': 0, 'num_missed': 0, 'num_errors': 0, 'num_dropped': 0, 'num_spilled': 0,
+            'fetch_time': 0., 'max_fetch_time': 0., 'parse_time': 0., 'max_parse_time': 0.,
+            'lateness': 0., 'max_lateness': 0.,
+        }
+
+    def _add_time(self, name, value):
+        self.stats[name] += value
+        self.stats[f'max_{name}'] = max(self.stats[f'max_{name}'], value)
+
+    def _store(self, sample_time, values):
+        with self._lock:
+            evicted = self.store.append(sample_time, values)
+        if evicted is None:
+            return
+        if self.spill_path is not None:
+            with open(self.spill_path, 'a') as f:
+                f.write(json.dumps({k if k == 'time' else _encode_key(k): v for k, v in evicted.items()}) + '\n')
+            self.stats['num_spilled'] += 1
+        else:
+            self.stats['num_dropped'] += 1
 
     def runner(self):
-        while self.is_running:
-            metrics = requests.get(self.dcgm_url).text
-            data_collected_time = time.time()
-            metrics = dcgm_gpu_metric_parser(metrics)
-            metrics['time'] = data_collected_time
-            self.gpu_metrics_list.append(metrics)
-            time.sleep(1)
+        self.open()
+        deadline = self.start_time
+        try:
+            while not self._stop_event.is_set():
+                fetch_start = time.time()
+                self._add_time('lateness', max(fetch_start - deadline, 0.))
+                try:
+                    raw = self.fetch()
+                except self.fetch_errors:
+                    self.stats['num_errors'] += 1
+                else:
+                    data_collected_time = time.time()
+                    self._add_time('fetch_time', data_collected_time - fetch_start)
+                    self._store(data_collected_time, self.parse(raw))
+                    self._add_time('parse_time', time.time() - data_collected_time)
+                    self.stats['num_samples'] += 1
+                # the next deadline not passed yet, skipping the missed ones
+                num_periods = max(int((time.time() - deadline) // self.interval) + 1, 1)
+                self.stats['num_missed'] += num_periods - 1
+                deadline += num_periods * self.interval
+                self._stop_event.wait(max(deadline - time.time(), 0.))
+        finally:
+            self.close()
 
     def start(self):
+        self._reset_stats()
+        self.store.clear()
+        if self.spill_path is not None:
+            self.spill_path.parent.mkdir(exist_ok=True, parents=True)
+            self.spill_path.write_text('')
+        self._stop_event.clear()
+        self.start_time = time.time()
+        self._thread = Thread(target=self.runner, daemon=True)
         self.is_running = True
         self._thread.start()
 
     def stop(self):
-        self.is_running = False
+        self._stop_event.set()
         self._thread.join()
+        self.is_running = False
+        self.stop_time = time.time()
+
+    def _read_spilled(self):
+        """The spilled samples in the format of `ColumnarMetricStore.to_arrays`."""
+        rows = list()
+        if self.spill_path is not None and self.spill_path.exists():
+            with open(self.spill_path) as f:
+                rows = [json.loads(line) for line in f]
+        times = np.array([row.pop('time') for row in rows], dtype=float)
+        arrays = defaultdict(dict)
+        for i, row in enumerate(rows):
+            for key, fields in row.items():
+                columns = arrays[_decode_key(key)]
+                for field, value in fields.items():
+                    if field not in columns:
+                        columns[field] = np.full(len(rows), np.nan)
+                    columns[field][i] = value
+        return times, arrays
+
+    def gpu_metrics_arrays(self):
+        """The sample times and {(gpu_id, gpu_instance_id): {field: values}} as NumPy arrays in time order,
+        including the spilled samples."""
+        spilled_times, spilled_arrays = self._read_spilled()
+        with self._lock:
+            times, arrays = self.store.to_arrays()
+        if not len(spilled_times):
+            return times, arrays
+        merged = dict()
+        for key in set(spilled_arrays) | set(arrays):
+            spilled_columns, columns = spilled_arrays.get(key, dict()), arrays.get(key, dict())
+            merged[key] = {
+                field: np.concatenate((
+                    spilled_columns.get(field, np.full(len(spilled_times), np.nan)),
+                    columns.get(field, np.full(len(times), np.nan)),
+                ))
+                for field in set(spilled_columns) | set(columns)
+            }
+        return np.concatenate((spilled_times, times)), merged
+
+    @property
+    def gpu_metrics_dict(self):
+        """The samples in time order as {'time': times, (gpu_id, gpu_instance_id): {'labels': [labels], field:
+        values}} of lists, including the labels of the GPU (instances) not collected."""
+        times, arrays = self.gpu_metrics_arrays()
+        return gpu_metrics_arrays_to_dict(times, arrays, self.labels)
+
+    def overhead(self):
+        """Metadata of the collector itself: the fetch and parse times, and the missed, failed, dropped and
+        spilled samples."""
+        stats = self.stats
+        num_samples = max(stats['num_samples'], 1)
+        num_attempts = max(stats['num_samples'] + stats['num_errors'], 1)
+        duration = ((self.stop_time or time.time()) - self.start_time) if self.start_time else 0.
+        return {
+            'backend': self.name, 'interval': self.interval, 'max_samples': self.max_samples, 'duration': duration,
+            'num_samples': stats['num_samples'], 'num_missed': stats['num_missed'],
+            'num_errors': stats['num_errors'], 'num_dropped': stats['num_dropped'],
+            'num_spilled': stats['num_spilled'],
+            'mean_fetch_time': stats['fetch_time'] / num_samples, 'max_fetch_time': stats['max_fetch_time'],
+            'mean_parse_time': stats['parse_time'] / num_samples, 'max_parse_time': stats['max_parse_time'],
+            'mean_lateness': stats['lateness'] / num_attempts, 'max_lateness': stats['max_lateness'],
+            # fraction of the time the collector thread is busy
+            'busy_fraction': (stats['fetch_time'] + stats['parse_time']) / duration if duration else 0.,
+        }
+
+
+class DCGMMetricCollector(MetricCollector):
+    """Scrape the dcgm-exporter metrics over HTTP.
+
+    The scrapes share a keep-alive HTTP session, and are parsed by a `DCGMTextParser` extracting only the `fields`
+    of the `instances`. The interval should not be shorter than the collection interval of dcgm-exporter (`-c` in
+    milliseconds).
+
+    Args:
+        dcgm_url (str): URL of the dcgm-exporter metrics.
+        timeout (float): Timeout of a scrape in seconds. Default to 5.
+        **kwargs: The arguments of `MetricCollector`.
+    """
+    name = 'dcgm'
+    min_interval = 0.1
+    fetch_errors = (requests.RequestException,)
+
+    def __init__(self, dcgm_url=DCGM_URL, timeout=5., **kwargs):
+        super().__init__(**kwargs)
+        self.dcgm_url = dcgm_url
+        self.timeout = timeout
+        self.parser = DCGMTextParser(fields=self.fields, instances=self.instances)
+        self._session = None
+
+    @classmethod
+    def from_args(cls, args, instances=None, **kwargs):
+        return super().from_args(args, instances=instances, dcgm_url=args.dcgm_url, **kwargs)
+
+    @property
+    def labels(self):
+        return self.parser.labels
+
+    def open(self):
+        self._session = requests.Session()
+
+    def close(self):
+        self._session.close()
+
+    def fetch(self):
+        return self._session.get(self.dcgm_url, timeout=self.timeout).text
+
+    def parse(self, raw):
+        return self.parser.parse(raw)
+
+
+def _read_utilization(nvml, handle):
+    rates = nvml.nvmlDeviceGetUtilizationRates(handle)
+    return {'DCGM_FI_DEV_GPU_UTIL': rates.gpu, 'DCGM_FI_DEV_MEM_COPY_UTIL': rates.memory}
+
+
+def _read_memory(nvml, handle):
+    memory = nvml.nvmlDeviceGetMemoryInfo(handle)
+    return {'DCGM_FI_DEV_FB_USED': memory.used / 1024 ** 2, 'DCGM_FI_DEV_FB_FREE': memory.free / 1024 ** 2}
+
+
+def _read_power(nvml, handle):
+    return {'DCGM_FI_DEV_POWER_USAGE': nvml.nvmlDeviceGetPowerUsage(handle) / 1e3}
+
+
+def _read_energy(nvml, handle):
+    return {'DCGM_FI_DEV_TOTAL_ENERGY_CONSUMPTION_total': nvml.nvmlDeviceGetTotalEnergyConsumption(handle)}
+
+
+def _read_temperature(nvml, handle):
+    return {'DCGM_FI_DEV_GPU_TEMP': nvml.nvmlDeviceGetTemperature(handle, nvml.NVML_TEMPERATURE_GPU)}
+
+
+# (fields, read function, whether read from the MIG device instead of its GPU)
+NVML_READINGS = (
+    (('DCGM_FI_DEV_GPU_UTIL', 'DCGM_FI_DEV_MEM_COPY_UTIL'), _read_utilization, False),
+    (('DCGM_FI_DEV_FB_USED', 'DCGM_FI_DEV_FB_FREE'), _read_memory, True),
+    (('DCGM_FI_DEV_POWER_USAGE',), _read_power, False),
+    (('DCGM_FI_DEV_TOTAL_ENERGY_CONSUMPTION_total',), _read_energy, False),
+    (('DCGM_FI_DEV_GPU_TEMP',), _read_temperature, False),
+)
+
+
+def _decode(value):
+    # pynvml before 11.5 returns bytes
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class NVMLMetricCollector(MetricCollector):
+    """Read the GPU metrics in-process through NVML by `pynvml`, with no dcgm-exporter.
+
+    The metrics are named as the DCGM fields in `NVML_READINGS`, in the same units. NVML has no profiling metrics,
+    e.g. `DCGM_FI_PROF_GR_ENGINE_ACTIVE`. The memory of a MIG device is its own, while the utilization, power, energy
+    and temperature of a MIG device are those of its GPU, as NVML reports them per GPU. A reading not supported by
+    a device is skipped in the later samples.
+
+    Args:
+        nvml (module): The NVML binding, e.g. a `client.fake_nvml.FakeNVML`. Default to None, `pynvml`.
+        **kwargs: The arguments of `MetricCollector`.
+    """
+    name = 'nvml'
+    min_interval = 0.01
+
+    def __init__(self, nvml=None, **kwargs):
+        super().__init__(**kwargs)
+        if nvml is None:
+            import pynvml as nvml
+        self.nvml = nvml
+        self.fetch_errors = (nvml.NVMLError,)
+        self._labels = dict()
+        # (key, device handle, GPU handle) of the collected GPU (instances)
+        self._devices = list()
+        self._unsupported = set()
+
+    @property
+    def labels(self):
+        return self._labels
+
+    def open(self):
+        nvml = self.nvml
+        nvml.nvmlInit()
+        hostname = socket.gethostname()
+        self._devices = list()
+        for gpu_id in range(nvml.nvmlDeviceGetCount()):
+            handle = nvml.nvmlDeviceGetHandleByIndex(gpu_id)
+            gpu_labels = {
+                'gpu': str(gpu_id), 'UUID': _decode(nvml.nvmlDeviceGetUUID(handle)), 'device': f'nvidia{gpu_id}',
+                'modelName': _decode(nvml.nvmlDeviceGetName(handle)), 'Hostname': hostname,
+            }
+            devices = [((gpu_id, None), handle, gpu_labels)]
+            if nvml.nvmlDeviceGetMigMode(handle)[0]:
+                devices = list()
+                for i in range(nvml.nvmlDeviceGetMaxMigDeviceCount(handle)):
+                    try:
+                        mig_handle = nvml.nvmlDeviceGetMigDeviceHandleByIndex(handle, i)
+                    except nvml.NVMLError:
+                        continue
+                    gpu_instance_id = nvml.nvmlDeviceGetGpuInstanceId(mig_handle)
+                    labels = dict(
+                        gpu_labels, UUID=_decode(nvml.nvmlDeviceGetUUID(mig_handle)),
+                        # e.g. NVIDIA A100-SXM4-80GB MIG 1g.10gb
+                        GPU_I_PROFILE=_decode(nvml.nvmlDeviceGetName(mig_handle)).rsplit(' ', 1)[-1],
+                        GPU_I_ID=str(gpu_instance_id),
+                    )
+                    devices.append(((gpu_id, gpu_instance_id), mig_handle, labels))
+            for key, device_handle, labels in devices:
+                self._labels[key] = labels
+                if self.instances is None or key in self.instances or (gpu_id, None) in self.instances:
+                    self._devices.append((key, device_handle, handle))
+
+    def close(self):
+        self.nvml.nvmlShutdown()
+
+    def _read(self, read, handle):
+        if (read, handle) in self._unsupported:
+            return dict()
+        try:
+            return read(self.nvml, handle)
+        except self.nvml.NVMLError as e:
+            if e.value != self.nvml.NVML_ERROR_NOT_SUPPORTED:
+                raise
+            self._unsupported.add((read, handle))
+            return dict()
+
+    def fetch(self):
+        fields = set(self.fields) if self.fields else None
+        values = dict()
+        gpu_readings = dict()
+        for key, device_handle, gpu_handle in self._devices:
+            sample = values[key] = dict()
+            for reading_fields, read, per_device in NVML_READINGS:
+                if fields is not None and fields.isdisjoint(reading_fields):
+                    continue
+                if per_device:
+                    sample.update(self._read(read, device_handle))
+                else:
+                    # read once per GPU for all of its MIG devices
+                    if (read, key[0]) not in gpu_readings:
+                        gpu_readings[read, key[0]] = self._read(read, gpu_handle)
+                    sample.update(gpu_readings[read, key[0]])
+            if fields is not None:
+                values[key] = {k: v for k, v in sample.items() if k in fields}
+        return values
+
+    def parse(self, raw):
+        return raw
+
+
+METRIC_COLLECTORS = ('dcgm', 'nvml', 'fake-nvml')
+
+
+def build_metric_collector(args, instances=None):
+    """The GPU metric collector of the `--monitor` backend, collecting the (gpu_id, gpu_instance_id) keys of
+    `instances`."""
+    if args.monitor == 'dcgm':
+        return DCGMMetricCollector.from_args(args, instances=instances)
+    if args.monitor == 'nvml':
+        return NVMLMetricCollector.from_args(args, instances=instances)
+    if args.monitor == 'fake-nvml':
+        from client.fake_nvml import FakeNVML
+        return NVMLMetricCollector.from_args(args, instances=instances, nvml=FakeNVML.for_instances(instances))
+    raise ValueError(f'monitor={args.monitor} not supported, should be one of {METRIC_COLLECTORS}')
+
+
+def add_dcgm_arguments(parser):
+    """Register the GPU metric collector arguments on an `argparse.ArgumentParser`."""
+    parser.add_argument('--monitor', type=str, default='dcgm', choices=METRIC_COLLECTORS,
+                        help='Backend of the GPU metrics: scraping dcgm-exporter, reading NVML in-process, or a '
+                             'fake NVML of the benchmarked GPU (instance), running without a GPU. Default to dcgm.')
+    parser.add_argument('--dcgm-url', type=str, default=DCGM_URL,
+                        help=f'URL of the dcgm-exporter metrics. Default to {DCGM_URL}')
+    parser.add_argument('--dcgm-interval', type=float, default=1.,
+                        help='Sampling interval of the GPU metrics in seconds, down to 0.1 for dcgm and 0.01 for '
+                             'nvml. Default to 1.')
+    parser.add_argument('--dcgm-max-samples', type=int, default=None,
+                        help=f'Max number of GPU metric samples kept in memory, the oldest ones being dropped or '
+                             f'spilled beyond it. Default to {DEFAULT_BUFFER_SECONDS} seconds of samples at '
+                             f'--dcgm-interval, 0 for unbounded.')
+    parser.add_argument('--dcgm-spill-path', type=str, default=None,
+                        help='JSON lines file the samples beyond --dcgm-max-samples are spilled to, instead of '
+                             'dropping the oldest ones.')
+    parser.add_argument('--dcgm-fields', type=str, nargs='+', default=None,
+                        help='Names of the DCGM fields collected, e.g. DCGM_FI_PROF_GR_ENGINE_ACTIVE. Default to '
+                             'all the fields of the backend.')
+    return parser
 
 
 if __name__ == '__main__':
@@ -66,4 +658,5 @@ if __name__ == '__main__':
     collector.start()
     time.sleep(3)
     collector.stop()
-    print(collector.gpu_metrics_list)
+    print(collector.gpu_metrics_dict)
+    print(collector.overhead())
@@ -49,29 +49,37 @@ Notes:
 import argparse
 import json
 import time
-from collections import defaultdict
+from threading import Lock
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from copy import deepcopy
 from datetime import datetime
+from functools import partial
 from pathlib import Path
 
 import numpy as np
 import requests
 from tqdm import tqdm
 
-from client.monitor import DCGMMetricCollector
+from client.monitor import add_dcgm_arguments, build_metric_collector
 from generator import WorkloadGenerator
-from utils.misc import consolidate_list_of_dict
+from utils.energy import instance_energy, summarize_energy
+from utils.histogram import LatencyHistogram, merge_histograms
+from utils.live_metrics import LiveReporter, add_live_report_arguments
 from utils.request import make_restful_request_from_numpy
+from utils.timeline import Timeline, add_timeline_arguments, summarize_timeline
 # from utils.logger import Printer
 from utils.pipeline_manager import PreProcessor
 
 DATA_PATH = str(Path(__file__).parent / 'n02124075_Egyptian_cat.jpg')
 SEED = 666
 start_time = 0
-request_num = 0
+finish_time = 0
+result_lock = Lock()
 
-results = set()
+# per endpoint statistics, indexed by the order of `--url`
+request_nums = list()
+fail_counts = list()
+endpoint_hist_dicts = list()
+endpoint_timelines = list()
 
 send_time_list = []
 
@@ -82,8 +90,19 @@ def get_args():
     parser.add_argument('-b', '--bs', help='frontend batch size', type=int, required=True)
     parser.add_argument('-m', '--model', type=str, required=True,
                         help='Name of the used models. For example, resnet18.')
-    parser.add_argument('--url', type=str, default='http://localhost:50075',
-                        help='The host url of your services. Default to http://localhost:50075.')
+    parser.add_argument('--url', type=str, nargs='+', default=['http://localhost:50075'],
+                        help='The host url(s) of your services. All endpoints share one request scheduler and '
+                             'clock. Default to http://localhost:50075.')
+    parser.add_argument('--split', type=str, default='even', choices=['even', 'weighted', 'rate'],
+                        help='How to split the traffic among multiple endpoints: `even` and `weighted` split the '
+                             'arrival rate `-r` evenly or by `--weights`, `rate` uses per-endpoint `--rates`. '
+                             'Default to even.')
+    parser.add_argument('--weights', type=float, nargs='+', default=None,
+                        help='Relative traffic weight per endpoint, used with `--split weighted`.')
+    parser.add_argument('--rates', type=float, nargs='+', default=None,
+                        help='Arrival rate per endpoint, used with `--split rate`.')
+    parser.add_argument('--num-workers', type=int, default=10,
+                        help='Number of concurrent sender threads per endpoint. Default to 10.')
     parser.add_argument('-T', '--task', type=str, default='image_classification',
                         help='The service name you are testing. Default to image_classification.')
     parser.add_argument('-dbn', '--database_name', type=str, default='test',
@@ -98,12 +117,45 @@ def get_args():
     # GPU related arguments
     parser.add_argument('-i', '--gpu-id', type=int, default=0, help='GPU ID. Default to 0.')
     parser.add_argument(
-        '-gi', '--gpu-instance-id', type=int, default=None,
-        help='GPU Instance ID. Specified when MIG is enabled.'
+        '-gi', '--gpu-instance-id', type=int, nargs='+', default=[None],
+        help='GPU Instance ID. Specified when MIG is enabled. Give one per `--url` if the endpoints are served '
+             'by different GPU instances.'
     )
     # experiment settings
+    parser.add_argument('--save-raw-latency', action='store_true',
+                        help='Dump every raw timing sample into the result file.')
     parser.add_argument('--dry-run', action='store_true', help='Dry running the experiment without save result.')
-    return parser.parse_args()
+    add_live_report_arguments(parser)
+    add_dcgm_arguments(parser)
+    add_timeline_arguments(parser)
+    args = parser.parse_args()
+
+    num_endpoints = len(args.url)
+    if args.split == 'even':
+        args.weights = [1.] * num_endpoints
+    elif args.split == 'weighted':
+        if args.weights is None or len(args.weights) != num_endpoints:
+            parser.error('`--split weighted` requires one `--weights` per `--url`.')
+    else:
+        if args.rates is None or len(args.rates) != num_endpoints:
+            parser.error('`--split rate` requires one `--rates` per `--url`.')
+        args.rate = sum(args.rates)
+        args.weights = list(args.rates)
+    if len(args.gpu_instance_id) == 1:
+        args.gpu_instance_id = args.gpu_instance_id * num_endpoints
+    elif len(args.gpu_instance_id) != num_endpoints:
+        parser.error('Specify either one `--gpu-instance-id` or one per `--url`.')
+    return args
+
+
+def get_timing_metric_names(args):
+    timing_metric_names = [
+        'latency', 'client_server_rtt',  # 'batching_time',
+        'inference_time', 'postprocessing_time'
+    ]
+    if not args.preprocessing:
+        timing_metric_names.append('preprocessing_time')
+    return timing_metric_names
 
 
 def sender(url, request):
@@ -120,13 +172,29 @@ def sender(url, request):
     result['times'].update({
         'latency': latency,
         'client_server_rtt': client_server_rtt,
+        'receive_time': receive_time,
     })
     return result
 
 
+def record_result(endpoint, future):
+    """Done callback of a request future, record its timing as soon as the response arrives."""
+    try:
+        times = future.result()['times']
+    except Exception:
+        with result_lock:
+            fail_counts[endpoint] += 1
+        live_reporter.record_error()
+        return
+    for metric_name, hist in endpoint_hist_dicts[endpoint].items():
+        hist.record(times[metric_name])
+    endpoint_timelines[endpoint].record(times['receive_time'], times['latency'])
+    live_reporter.record(times['latency'])
+
+
 def warm_up(args):
     """Warm up for 100 requests at 10ms each pre GPU worker"""
-    url = f'{args.url}/predict'
+    urls = [f'{url}/predict' for url in args.url]
     with open(args.data, 'rb') as f:
         image = f.read()
     image_np = np.frombuffer(image, dtype=np.uint8)
@@ -138,7 +206,8 @@ def warm_up(args):
     with ThreadPoolExecutor(10) as executor:
         futures = set()
         for i in range(num):
-            futures.add(executor.submit(sender, url, request))
+            for url in urls:
+                futures.add(executor.submit(sender, url, request))
             time.sleep(0.01)
         for future in as_completed(futures):
             future.result()
@@ -148,11 +217,11 @@ def send_stress_test_data(args):
     """
     send stress testing data.
     """
-    global start_time, request_num, send_time_list
+    global start_time, finish_time, send_time_list
 
     arrival_rate = args.rate
     duration = args.time
-    url = f'{args.url}/predict'
+    urls = [f'{url}/predict' for url in args.url]
     with open(args.data, 'rb') as f:
         image = f.read()
     image_np = np.frombuffer(image, dtype=np.uint8)
@@ -160,85 +229,131 @@ def send_stress_test_data(args):
         image_np = PreProcessor.transform_image2torch([image_np]).numpy()[0]
     request = make_restful_request_from_numpy(image_np)
 
-    send_time_list = WorkloadGenerator.gen_arrival_time(
-        duration=duration, arrival_rate=arrival_rate, seed=SEED
-    )
+    # all endpoints share a single schedule of (arrival time, endpoint index)
+    if args.split == 'rate':
+        schedule = WorkloadGenerator.gen_merged_arrival_time(
+            duration=duration, arrival_rates=args.rates, seed=SEED
+        )
+    else:
+        schedule = WorkloadGenerator.gen_split_arrival_time(
+            duration=duration, arrival_rate=arrival_rate, weights=args.weights, seed=SEED
+        )
 
     # cut list to a multiple of <BATCH_SIZE>, so that the light-weight system can do full batch prediction
-    request_num = len(send_time_list) // args.bs * args.bs
+    request_num = len(schedule) // args.bs * args.bs
+    schedule = schedule[:request_num]
+    send_time_list = [arrive_time for arrive_time, _ in schedule]
     print(f'Generating {request_num} exadmples')
 
     start_time = time.time()
 
-    with ThreadPoolExecutor(10) as executor:
-        for arrive_time in tqdm(send_time_list[:request_num]):
-            results.add(executor.submit(sender, url, request))
+    with ThreadPoolExecutor(args.num_workers * len(urls)) as executor:
+        for arrive_time, endpoint in tqdm(schedule):
+            if live_reporter.should_stop:
+                break
+            executor.submit(sender, urls[endpoint], request).add_done_callback(partial(record_result, endpoint))
+            request_nums[endpoint] += 1
             time.sleep(max(arrive_time + start_time - time.time(), 0))
 
-
-def process_result(args):
-    timing_metric_names = [
-        'latency', 'client_server_rtt',  # 'batching_time',
-        'inference_time', 'postprocessing_time'
-    ]
-    if not args.preprocessing:
-        timing_metric_names.append('preprocessing_time')
-    timing_metric_raw_result_dict = defaultdict(list)
-    timing_metric_aggr_result_dict = dict()
-
-    raw_result = list()
-    fail_count = 0
-    for future in as_completed(results):
-        try:
-            raw_result.append(future.result()['times'])
-        except Exception:
-            fail_count += 1
-            print('.', end='')
-            if fail_count % 20 == 0:
-                print(fail_count)
-
     finish_time = time.time()
 
-    for result in raw_result:
-        for metric_name in timing_metric_names:
-            timing_metric_raw_result_dict[metric_name].append(result[metric_name])
 
-    for metric_name, raw_result in timing_metric_raw_result_dict.items():
-        mean = np.mean(raw_result)
-        std = np.std(raw_result)
-        p50 = np.percentile(raw_result, 50)
-        p95 = np.percentile(raw_result, 95)
-        p99 = np.percentile(raw_result, 99)
+def summarize_timing(hist_dict, args):
+    """Aggregated timing metrics, histograms and (optionally) raw samples of a group of histograms."""
+    result = dict()
+    for metric_name, hist in hist_dict.items():
+        result.update(hist.summary(metric_name))
+    result['histograms'] = {metric_name: hist.to_dict() for metric_name, hist in hist_dict.items()}
+    if args.save_raw_latency:
+        result.update({metric_name: hist.samples for metric_name, hist in hist_dict.items()})
+    return result
+
 
-        timing_metric_aggr_result_dict[metric_name + '_mean'] = mean
-        timing_metric_aggr_result_dict[metric_name + '_std'] = std
-        timing_metric_aggr_result_dict[metric_name + '_p50'] = p50
-        timing_metric_aggr_result_dict[metric_name + '_p95'] = p95
-        timing_metric_aggr_result_dict[metric_name + '_p99'] = p99
+def process_result(args):
+    duration = finish_time - start_time
+    # aggregate over all endpoints
+    timing_metric_hist_dict = {
+        metric_name: merge_histograms(hist_dict[metric_name] for hist_dict in endpoint_hist_dicts)
+        for metric_name in endpoint_hist_dicts[0]
+    }
+    fail_count = sum(fail_counts)
 
     # report
     print(f'Failing test number: {fail_count}')
 
     result = {
         'test_time': datetime.now().strftime('%Y-%m-%d_%H-%M-%S'), 'start_time': start_time,
-        'arrival_rate': args.rate, 'testing_time': args.time,
+        'finish_time': finish_time, 'arrival_rate': args.rate, 'testing_time': args.time,
         'batch_size': args.bs, 'time_list': send_time_list,
         'model_name': args.model, 'task': args.task,
-        'fail_count': fail_count, 'qps': request_num / (finish_time - start_time),
+        'fail_count': fail_count, 'num_sent_requests': sum(request_nums),
+        'qps': timing_metric_hist_dict['latency'].count / duration,
         'client_preprocessing': args.preprocessing,
     }
 
-    result.update(timing_metric_raw_result_dict)
-    result.update(timing_metric_aggr_result_dict)
-    gpu_metrics_list = deepcopy(dcgm_metrics_collector.gpu_metrics_list)
-    gpu_metrics_dict = consolidate_list_of_dict(gpu_metrics_list, depth=2)
+    result.update(summarize_timing(timing_metric_hist_dict, args))
+    result.update(live_reporter.result())
+
+    # per endpoint report
+    total_weight = sum(args.weights)
+    endpoints = list()
+    for i, url in enumerate(args.url):
+        endpoint_result = {
+            'url': url, 'gpu_instance_id': args.gpu_instance_id[i],
+            'arrival_rate': args.rate * args.weights[i] / total_weight,
+            'fail_count': fail_counts[i], 'num_sent_requests': request_nums[i],
+            'qps': endpoint_hist_dicts[i]['latency'].count / duration,
+        }
+        endpoint_result.update(summarize_timing(endpoint_hist_dicts[i], args))
+        endpoints.append(endpoint_result)
+    result['endpoints'] = endpoints
+
+    gpu_metrics_dict = dcgm_metrics_collector.gpu_metrics_dict
     # gpu_label_example = {
     #     'gpu': '0', 'UUID': 'GPU-bd8c3d28-4b3e-e4ad-650a-4c5a3692b72f', 'device': 'nvidia0',
     #     'modelName': 'NVIDIA A30', 'Hostname': '2e140b568f0c',
     #     'GPU_I_PROFILE': '4g.24gb', 'GPU_I_ID': '0',
     # }
-    gpu_labels: dict = gpu_metrics_dict[args.gpu_id, args.gpu_instance_id].pop('labels')[0]
-    result['metrics'] = gpu_metrics_dict[args.gpu_id, args.gpu_instance_id]
+    gpu_instance_id = args.gpu_instance_id[0]
+    gpu_labels: dict = gpu_metrics_dict[args.gpu_id, gpu_instance_id]['labels'][0]
+    result['metrics'] = {k: v for k, v in gpu_metrics_dict[args.gpu_id, gpu_instance_id].items() if k != 'labels'}
+    result['metrics']['time'] = gpu_metrics_dict['time']
+    # energy of the whole GPU per sample of all the endpoints, and on MIG the estimated share of their instances
+    result.update(summarize_energy(
+        gpu_metrics_dict['time'], result['metrics'], start_time, finish_time,
+        num_samples=timing_metric_hist_dict['latency'].count * args.bs,
+        num_steps=timing_metric_hist_dict['latency'].count,
+    ) or dict())
+    result.update(instance_energy(
+        gpu_metrics_dict['time'], gpu_metrics_dict, [(args.gpu_id, i) for i in args.gpu_instance_id], start_time,
+        finish_time, num_samples=timing_metric_hist_dict['latency'].count * args.bs,
+        num_steps=timing_metric_hist_dict['latency'].count,
+    ) or dict())
+    if args.timeline_window:
+        timeline = Timeline(args.timeline_window, keep_events=args.save_raw_latency)
+        for endpoint_timeline in endpoint_timelines:
+            timeline.merge(endpoint_timeline)
+        result['timeline'] = summarize_timeline(
+            timeline, gpu_metrics_dict['time'], result['metrics'], start_time, finish_time,
+            spike_factor=args.spike_factor,
+        )
+        if args.save_raw_latency:
+            result['timeline']['events'] = timeline.events_to_dict()
+    if len(args.url) > 1:
+        for i, endpoint_result in enumerate(endpoints):
+            key = args.gpu_id, endpoint_result['gpu_instance_id']
+            endpoint_result['gpu_instance_profile'] = gpu_metrics_dict[key]['labels'][0].get('GPU_I_PROFILE', None)
+            endpoint_result['metrics'] = {k: v for k, v in gpu_metrics_dict[key].items() if k != 'labels'}
+            endpoint_result.update(instance_energy(
+                gpu_metrics_dict['time'], gpu_metrics_dict, [key], start_time, finish_time,
+                num_samples=endpoint_hist_dicts[i]['latency'].count * args.bs,
+                num_steps=endpoint_hist_dicts[i]['latency'].count,
+            ) or dict())
+            if args.timeline_window:
+                endpoint_result['timeline'] = summarize_timeline(
+                    endpoint_timelines[i], gpu_metrics_dict['time'], endpoint_result['metrics'], start_time,
+                    finish_time, spike_factor=args.spike_factor,
+                )
 
     # export config
     config = {
@@ -254,27 +369,42 @@ def process_result(args):
     if config['mig']['enabled']:
         gpu_instance_profiles = [config['mig']['gpu_instance_profile']]
         for k, v in gpu_metrics_dict.items():
-            if k[0] == args.gpu_id and k[1] != args.gpu_instance_id:
+            if k[0] == args.gpu_id and k[1] != gpu_instance_id:
                 gpu_instance_profiles.append(v['labels'][0]['GPU_I_PROFILE'])
         config['mig']['gpu_instance_profiles'] = gpu_instance_profiles
     result['gpu_model_name'] = config['gpu_static_profile']['modelName']
     result['config'] = config
+    result['metrics_collector'] = dcgm_metrics_collector.overhead()
     return result
 
 
 if __name__ == '__main__':
     args_ = get_args()
-    dcgm_metrics_collector = DCGMMetricCollector()
+    instances = {(args_.gpu_id, gpu_instance_id) for gpu_instance_id in args_.gpu_instance_id}
+    # on MIG, also the sibling instances of the GPU, whose activity apportions its energy among them
+    dcgm_metrics_collector = build_metric_collector(args_, instances=instances | {(args_.gpu_id, None)})
+    for _ in args_.url:
+        request_nums.append(0)
+        fail_counts.append(0)
+        endpoint_hist_dicts.append({
+            metric_name: LatencyHistogram(keep_samples=args_.save_raw_latency)
+            for metric_name in get_timing_metric_names(args_)
+        })
+        endpoint_timelines.append(Timeline(args_.timeline_window, keep_events=args_.save_raw_latency))
+    live_reporter = LiveReporter.from_args(args_)
 
     print('Testing on:')
     print(f'arrival rate: {args_.rate};', f'testing time: {args_.time};')
+    print(f'endpoints: {args_.url};', f'traffic split: {args_.split} {args_.weights};')
     print(f'batch size: {args_.bs};', f'model name: {args_.model}')
 
     print('Warming up...')
     warm_up(args_)
     print('Testing...')
     dcgm_metrics_collector.start()
+    live_reporter.start()
     send_stress_test_data(args_)
+    live_reporter.stop()
     print('Finish')
 
     metrics = process_result(args_)
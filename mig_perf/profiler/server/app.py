@@ -74,6 +74,8 @@ class HttpServer(Sanic):
             'server_preprocessing': SERVER_PREPROCESSING,
             'max_batch_size': MAX_BATCH_SIZE,
             'max_wait_time': MAX_WAIT_TIME,
+            'precision': PRECISION,
+            'device': DEVICE,
             'model_runner': None,
         }
         super().__init__(name=name, ctx=ctx)
@@ -93,9 +95,10 @@ class HttpServer(Sanic):
     async def load_init_replicas(self):
         # TODO: get the batching configuration here.
         self.ctx['model_runner'] = ModelRunner(
-            model_name=self.ctx['model_name'], task=self.ctx['task'], device='cuda',
+            model_name=self.ctx['model_name'], task=self.ctx['task'], device=self.ctx['device'],
             max_batch_size=self.ctx['max_batch_size'], max_wait=self.ctx['max_wait_time'],
-            server_preprocessing=self.ctx['server_preprocessing'], loop=asyncio.get_event_loop(),
+            server_preprocessing=self.ctx['server_preprocessing'], precision=self.ctx['precision'],
+            loop=asyncio.get_event_loop(),
         )
 
     def _notify_before_server_start(self, *args):
@@ -115,10 +118,14 @@ if __name__ == '__main__':
     MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '1'))
     MAX_WAIT_TIME = float(os.getenv('MAX_WAIT_TIME', '0.1'))
     SERVER_PREPROCESSING = os.getenv('SERVER_PREPROCESSING', '0').upper() in ['1', 'TRUE', 'Y', 'YES']
+    # one of fp32, fp16, bf16, int8-dynamic or int8-static (image classification only), see `utils.precision`
+    PRECISION = os.getenv('PRECISION', 'fp32')
+    DEVICE = os.getenv('DEVICE', 'cuda')
 
     # Mask out other cuda devices
-    os.environ['CUDA_DEVICE_ORDER'] = "PCI_BUS_ID"
-    os.environ['CUDA_VISIBLE_DEVICES'] = DEVICE_ID
+    if DEVICE == 'cuda':
+        os.environ['CUDA_DEVICE_ORDER'] = "PCI_BUS_ID"
+        os.environ['CUDA_VISIBLE_DEVICES'] = DEVICE_ID
 
     app = HttpServer(name='PyTorch-Inference-Server')
     app.run(host='0.0.0.0', port=PORT)
@@ -21,7 +21,9 @@ import torch.hub
 from utils.logger import Logger
 # we only run 1 inference run at any time (one could schedule between several runners if desired)
 from utils.model_hub import load_pytorch_model
+from utils.device import Device
 from utils.pipeline_manager import PostProcessor, PreProcessor
+from utils.precision import build_precision_model
 
 
 class Task(object):
@@ -51,6 +53,7 @@ class ModelRunner(object):
             self,
             model_name, task: str, device, max_batch_size=1, max_wait=0.1, max_queue_size=200,
             server_preprocessing=True,
+            precision='fp32',
             share_memory=False,
             loop=None, group_batching=False
     ):
@@ -61,6 +64,7 @@ class ModelRunner(object):
         self.max_wait = max_wait
         self.max_batch_size = max_batch_size
         self.group_batching = group_batching
+        self.precision = precision
 
         if server_preprocessing:
             self.preprocessor = PreProcessor.get_preprocessor(self.task, model_name=self.model_name)
@@ -76,6 +80,10 @@ class ModelRunner(object):
 
         # load model
         self.model = load_pytorch_model(model_name=self.model_name, task=self.task).to(self.device).eval()
+        self.model, self.precision_report = build_precision_model(
+            self.model, self.precision, Device(self.device.type),
+            task='image_classification' if self.task == 'image_classification' else 'sequence_classification',
+        )
         if self.share_memory:
             self.model.share_memory()
 
@@ -87,6 +95,7 @@ class ModelRunner(object):
         self.needs_processing_timer = None
 
         self._logger = Logger(f'Model Runner, {model_name}')
+        self._logger.info(f'model precision: {self.precision_report}')
         self._model_runner_task = self._loop.create_task(self.model_runner())
 
     def terminate(self):
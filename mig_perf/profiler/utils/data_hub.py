@@ -1,7 +1,10 @@
+import math
 import os
 from pathlib import Path
 
-from torch.utils.data import DataLoader, default_collate
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, DistributedSampler, default_collate
 
 model_names = {
     'distil_v1': 'sentence-transformers/distiluse-base-multilingual-cased-v1',
@@ -12,11 +15,24 @@ model_names = {
 }
 
 DEFAULT_DATASET_ROOT = Path.home() / '.dataset'
+# `--data` value of the synthetic training data
+SYNTHETIC_DATA = 'synthetic'
+
+
+def split_among_replicas(items, num_replicas=1, rank=0):
+    """The share of `rank` among `num_replicas` data parallel ranks of a sequence (e.g. the sample order of an
+    epoch), padded by wrapping around so that all the ranks get the same number of items, as `DistributedSampler`."""
+    if num_replicas <= 1 or not len(items):
+        return items
+    total = math.ceil(len(items) / num_replicas) * num_replicas
+    padded = [items[i % len(items)] for i in range(total)] if isinstance(items, list) else \
+        items[np.arange(total) % len(items)]
+    return padded[rank::num_replicas]
 
 
 def load_places365_data(
         batch_size, data_root=str(DEFAULT_DATASET_ROOT / 'places365_standard'),
-        num_workers=os.cpu_count()
+        num_workers=os.cpu_count(), num_replicas=1, rank=0,
 ):
     """transform data and load data into dataloader. Images should be arranged in this way by default: ::
         root/my_dataset/dog/xxx.png
@@ -29,6 +45,8 @@ def load_places365_data(
         batch_size (int): batch size
         data_root (str): eg. root/my_dataset/
         num_workers (int): number of pytorch DataLoader worker subprocess
+        num_replicas (int): number of data parallel ranks, each loading its own share of the train data
+        rank (int): data parallel rank of this process
     """
     from torchvision import transforms, datasets
 
@@ -37,14 +55,16 @@ def load_places365_data(
     normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406],
                                      std=[0.229, 0.224, 0.225])
 
+    train_dataset = datasets.ImageFolder(traindir, transforms.Compose([
+        transforms.RandomResizedCrop(224),
+        transforms.RandomHorizontalFlip(),
+        transforms.ToTensor(),
+        normalize,
+    ]))
+    train_sampler = DistributedSampler(train_dataset, num_replicas, rank) if num_replicas > 1 else None
     train_loader = DataLoader(
-        datasets.ImageFolder(traindir, transforms.Compose([
-            transforms.RandomResizedCrop(224),
-            transforms.RandomHorizontalFlip(),
-            transforms.ToTensor(),
-            normalize,
-        ])),
-        batch_size=batch_size, shuffle=True,
+        train_dataset,
+        batch_size=batch_size, shuffle=train_sampler is None, sampler=train_sampler,
         num_workers=num_workers, pin_memory=True
     )
 
@@ -61,7 +81,7 @@ def load_places365_data(
     return train_loader, val_loader
 
 
-def load_amazon_review_data(tokenizer, batch_size, max_seq_len, num_workers=os.cpu_count()):
+def load_amazon_review_data(tokenizer, batch_size, max_seq_len, num_workers=os.cpu_count(), num_replicas=1, rank=0):
     from datasets import load_dataset
 
     # prepare test data
@@ -76,8 +96,9 @@ def load_amazon_review_data(tokenizer, batch_size, max_seq_len, num_workers=os.c
         inputs['labels'] = (x['stars'] - 1).long()
         return inputs
 
+    train_sampler = DistributedSampler(train_dataset, num_replicas, rank, shuffle=False) if num_replicas > 1 else None
     train_dataloader = DataLoader(
-        train_dataset, batch_size=batch_size,
+        train_dataset, batch_size=batch_size, sampler=train_sampler,
         collate_fn=collate_fn,
         num_workers=num_workers,
     )
@@ -88,3 +109,48 @@ def load_amazon_review_data(tokenizer, batch_size, max_seq_len, num_workers=os.c
     )
     return train_dataloader, val_dataloader
 
+
+def load_synthetic_image_data(batch_size, num_classes, device=None, num_batches=4, image_size=224, seed=0):
+    """Generate `num_batches` batches of random normalized images and labels once, directly on the device, in
+    place of the Places365 data. Cycling them measures the training step without the input pipeline.
+    Args:
+        batch_size (int): batch size
+        num_classes (int): number of classes of the labels
+        device (torch.device): device to place the batches on
+        num_batches (int): number of distinct batches
+        image_size (int): height and width of the images
+        seed (int): random seed
+    """
+    generator = torch.Generator().manual_seed(seed)
+    batches = [
+        (
+            torch.randn(batch_size, 3, image_size, image_size, generator=generator).to(device),
+            torch.randint(0, num_classes, (batch_size,), generator=generator).to(device),
+        )
+        for _ in range(num_batches)
+    ]
+    return batches, batches
+
+
+def load_synthetic_text_data(batch_size, max_seq_len, vocab_size, num_classes, device=None, num_batches=4, seed=0):
+    """Generate `num_batches` batches of random token IDs padded to `max_seq_len` once, directly on the device, in
+    place of the tokenized Amazon review data.
+    Args:
+        batch_size (int): batch size
+        max_seq_len (int): sequence length of the batches
+        vocab_size (int): vocabulary size of the tokenizer
+        num_classes (int): number of classes of the labels
+        device (torch.device): device to place the batches on
+        num_batches (int): number of distinct batches
+        seed (int): random seed
+    """
+    generator = torch.Generator().manual_seed(seed)
+    batches = [
+        {
+            'input_ids': torch.randint(0, vocab_size, (batch_size, max_seq_len), generator=generator).to(device),
+            'attention_mask': torch.ones(batch_size, max_seq_len, dtype=torch.long).to(device),
+            'labels': torch.randint(0, num_classes, (batch_size,), generator=generator).to(device),
+        }
+        for _ in range(num_batches)
+    ]
+    return batches, batches
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Device backend of the profiling harnesses, so that the same harness runs on a (MIG) GPU or on CPU.
+"""
+import contextlib
+import os
+import platform
+import threading
+import time
+
+import torch
+
+from utils.misc import get_gpu_device_uuid, get_ids_from_mig_device_id
+
+SUPPORTED_DEVICES = ('cuda', 'cpu')
+
+
+class Device(object):
+    """A thin wrapper of `torch.device` with a device-appropriate synchronization and streams.
+
+    Args:
+        device_type (str): One of 'cuda' or 'cpu'.
+    """
+
+    def __init__(self, device_type: str = 'cuda'):
+        if device_type not in SUPPORTED_DEVICES:
+            raise ValueError(f'device={device_type} not supported, should be one of {SUPPORTED_DEVICES}')
+        self.type = device_type
+        self.torch_device = torch.device(device_type)
+
+    @property
+    def is_cuda(self):
+        return self.type == 'cuda'
+
+    def synchronize(self, stream=None):
+        """Wait for the queued work on the device, or only on `stream` if given. CPU operators are synchronous,
+        so this is a no-op on CPU."""
+        if self.is_cuda:
+            if stream is not None:
+                stream.synchronize()
+            else:
+                torch.cuda.synchronize()
+
+    def new_stream(self):
+        """A new CUDA stream, or None on CPU."""
+        if self.is_cuda:
+            return torch.cuda.Stream()
+        return None
+
+    def stream(self, stream):
+        """Context manager making `stream` the current stream of the calling thread."""
+        if stream is None:
+            return contextlib.nullcontext()
+        return torch.cuda.stream(stream)
+
+    def to(self, obj, **kwargs):
+        """Move a tensor / module, or all tensors in a dictionary / list / tuple to this device."""
+        if isinstance(obj, dict):
+            return {k: self.to(v, **kwargs) for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self.to(v, **kwargs) for v in obj)
+        return obj.to(self.torch_device, **kwargs)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.type})'
+
+
+def _rss_bytes():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class PeakMemoryMonitor(object):
+    """Peak memory of a run, from the CUDA caching allocator, or by sampling the resident memory of the process
+    on CPU.
+
+    Args:
+        device (Device): The device of the run.
+        interval (float): Sampling interval of the resident memory in seconds. Default to 5 ms.
+    """
+
+    def __init__(self, device: Device, interval: float = 0.005):
+        self.device = device
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop_event.is_set():
+            self.peak = max(self.peak, _rss_bytes())
+            time.sleep(self.interval)
+
+    def start(self):
+        if self.device.is_cuda:
+            torch.cuda.reset_peak_memory_stats()
+        else:
+            self.peak = _rss_bytes()
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop monitoring and return the peak memory in bytes."""
+        if self.device.is_cuda:
+            self.peak = torch.cuda.max_memory_allocated()
+        else:
+            self._stop_event.set()
+            self._thread.join()
+            self.peak = max(self.peak, _rss_bytes())
+        return self.peak
+
+
+def get_cpu_static_profile():
+    """Static information of the host CPU, reported in place of the DCGM GPU labels."""
+    model_name = platform.processor() or platform.machine()
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    model_name = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return {
+        'modelName': model_name, 'Hostname': platform.node(),
+        'num_cpus': os.cpu_count(), 'num_threads': torch.get_num_threads(),
+    }
+
+
+def add_device_arguments(parser):
+    """Register the device related arguments on an `argparse.ArgumentParser`."""
+    parser.add_argument('--device', type=str, default='cuda', choices=SUPPORTED_DEVICES,
+                        help='Device to run the benchmark on. Default to cuda.')
+    parser.add_argument('--intra-op-threads', type=int, nargs='+', default=None,
+                        help='CPU only. A list of intra-op thread numbers (`torch.set_num_threads`) to sweep, '
+                             'one result is saved per value. Default to the PyTorch default.')
+    return parser
+
+
+def setup_device_args(args):
+    """Resolve the device UUID and MIG instance IDs of a CUDA run. Must be called after argument parsing."""
+    if args.device == 'cuda':
+        args.device_uuid = get_gpu_device_uuid(args.gpu_id, args.mig_device_id)
+        assert args.device_uuid is not None, \
+            f'Cannot find device UUID of GPU ID: {args.gpu_id}, MIG Device ID: {args.mig_device_id}'
+        args.gpu_instance_id, args.compute_instance_id = get_ids_from_mig_device_id(args.gpu_id, args.mig_device_id)
+        args.intra_op_threads = [None]
+    else:
+        args.device_uuid = None
+        args.gpu_instance_id, args.compute_instance_id = None, None
+        args.intra_op_threads = args.intra_op_threads or [None]
+    return args
+
+
+def mask_cuda_devices(args):
+    """Mask out other cuda devices, so that the run only sees the (MIG) device under test."""
+    if args.device == 'cuda':
+        os.environ['CUDA_DEVICE_ORDER'] = "PCI_BUS_ID"
+        os.environ['CUDA_VISIBLE_DEVICES'] = args.device_uuid
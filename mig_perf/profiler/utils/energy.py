@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Energy of a GPU (instance) over the measurement window of a benchmark, from its sampled GPU metrics.
+
+The energy is the delta of the total energy counter `DCGM_FI_DEV_TOTAL_ENERGY_CONSUMPTION` (in mJ) between the
+window start and end, interpolated linearly between the samples around them. When the counter is missing, too
+sparse, or resets within the window, the power `DCGM_FI_DEV_POWER_USAGE` (in W) is integrated over the window by the
+trapezoidal rule instead. The part of the window not covered by the samples is extrapolated at the average power of
+the covered part for the counter, and at the first and last sampled powers for the power. The covered fraction of
+the window is reported as `energy_coverage`.
+
+On a MIG-enabled GPU, the energy and the power are those of the whole GPU, shared by all of its instances. The
+energy of a run on several GPUs, e.g. the DDP ranks on full GPUs, is the sum over the GPUs.
+
+NVIDIA does not meter the energy of a MIG instance. `instance_energy` estimates it by apportioning the energy of the
+GPU among its instances by their share of the activity: the mean `DCGM_FI_PROF_GR_ENGINE_ACTIVE` of an instance over
+the window, weighted by its compute slices (3 for a 3g.40gb). The idle power of the GPU is thus charged to the busy
+instances, and an idle GPU is split by the compute slices. The estimate needs the activity of all the instances of
+the GPU, so it is not available from NVML, which has no profiling metrics.
+
+Examples:
+    >>> summarize_energy(metrics['time'], metrics[gpu_id, gpu_instance_id], start_time, finish_time,
+    ...                  num_samples=num_samples)
+    >>> instance_energy(metrics['time'], metrics, [(gpu_id, gpu_instance_id)], start_time, finish_time,
+    ...                 num_samples=num_samples)
+"""
+import re
+
+import numpy as np
+
+ENERGY_FIELD = 'DCGM_FI_DEV_TOTAL_ENERGY_CONSUMPTION_total'
+POWER_FIELD = 'DCGM_FI_DEV_POWER_USAGE'
+ACTIVITY_FIELD = 'DCGM_FI_PROF_GR_ENGINE_ACTIVE'
+INSTANCE_ENERGY_METHOD = 'gract-share estimate'
+
+_SLICES_PATTERN = re.compile(r'(\d+)g\.')
+
+
+def _valid(times, values):
+    """The samples with a value, as float arrays, the missing values being None or NaN."""
+    times, values = np.asarray(times, dtype=float), np.asarray(values, dtype=float)
+    mask = ~np.isnan(values)
+    return times[mask], values[mask]
+
+
+def counter_energy(times, energy_mj, start_time, end_time):
+    """Energy in J over the window by the counter delta, and the covered fraction of the window. None if the counter
+    has less than 2 samples in or around the window, or resets within it."""
+    times, energy_mj = _valid(times, energy_mj)
+    if len(times) < 2:
+        return None
+    covered_start, covered_end = max(start_time, times[0]), min(end_time, times[-1])
+    if covered_end <= covered_start:
+        return None
+    inside = (times > covered_start) & (times < covered_end)
+    values = np.concatenate((
+        np.interp([covered_start], times, energy_mj), energy_mj[inside], np.interp([covered_end], times, energy_mj),
+    ))
+    if np.any(np.diff(values) < 0):
+        return None
+    coverage = (covered_end - covered_start) / (end_time - start_time)
+    return float(values[-1] - values[0]) * 1e-3 / coverage, coverage
+
+
+def power_energy(times, power_w, start_time, end_time):
+    """Energy in J over the window by integrating the power, and the covered fraction of the window. None if there
+    is no power sample."""
+    times, power_w = _valid(times, power_w)
+    if not len(times):
+        return None
+    inside = (times > start_time) & (times < end_time)
+    grid = np.concatenate(([start_time], times[inside], [end_time]))
+    # the power is held constant before the first and after the last samples
+    power_w = np.interp(grid, times, power_w)
+    energy = np.sum((power_w[1:] + power_w[:-1]) / 2 * np.diff(grid))
+    covered = max(min(end_time, times[-1]) - max(start_time, times[0]), 0.)
+    return float(energy), covered / (end_time - start_time)
+
+
+def gpu_energy(times, metrics, start_time, end_time):
+    """(energy in J, method, covered fraction of the window) of a GPU over the window, None if neither the energy
+    counter nor the power is sampled."""
+    estimate, method = None, None
+    if metrics.get(ENERGY_FIELD) is not None:
+        estimate, method = counter_energy(times, metrics[ENERGY_FIELD], start_time, end_time), 'counter'
+    if estimate is None and metrics.get(POWER_FIELD) is not None:
+        estimate, method = power_energy(times, metrics[POWER_FIELD], start_time, end_time), 'power'
+    if estimate is None:
+        return None
+    return estimate[0], method, estimate[1]
+
+
+def summarize_energy(times, metrics, start_time, end_time, num_samples=None, num_steps=None):
+    """Energy, average power and energy efficiency of a GPU (instance) over the window [start_time, end_time].
+
+    Args:
+        times (Sequence[float]): Times of the GPU metric samples.
+        metrics (Union[dict, List[dict]]): {field: values} of the GPU (instance), values aligned with `times`, or
+            one such dict per GPU of a run on several GPUs.
+        start_time (float): Start of the measurement window, in the clock of `times`.
+        end_time (float): End of the measurement window.
+        num_samples (int): Number of samples (e.g. images) processed in the window. Default to None.
+        num_steps (int): Number of steps (batches or training steps) completed in the window. Default to None.
+
+    Returns:
+        dict: The energy in J, its method ('counter' or 'power'), the covered fraction of the window, the average
+            power in W, and the J per sample / step and samples per J if the counts are given. None if neither
+            the energy counter nor the power is sampled on any GPU. On several GPUs, the energy and the power are
+            summed, the coverage is the lowest, and the number of GPUs with an energy is reported as `energy_gpus`.
+    """
+    duration = end_time - start_time
+    if duration <= 0:
+        return None
+    gpu_metrics = [metrics] if isinstance(metrics, dict) else metrics
+    estimates = [gpu_energy(times, m, start_time, end_time) for m in gpu_metrics]
+    estimates = [estimate for estimate in estimates if estimate is not None]
+    if not estimates:
+        return None
+    energy = sum(estimate[0] for estimate in estimates)
+    summary = {
+        'energy_j': energy, 'energy_method': ','.join(sorted({estimate[1] for estimate in estimates})),
+        'energy_coverage': min(estimate[2] for estimate in estimates),
+        'window_duration': duration, 'avg_power_w': energy / duration,
+    }
+    if not isinstance(metrics, dict):
+        summary['energy_gpus'] = len(estimates)
+    if num_samples:
+        summary.update({'j_per_sample': energy / num_samples, 'samples_per_j': num_samples / energy})
+    if num_steps:
+        summary['j_per_step'] = energy / num_steps
+    return summary
+
+
+def compute_slices(gpu_instance_profile):
+    """Number of compute slices of a MIG profile, e.g. 3 for `3g.40gb`, 1 if it cannot be parsed."""
+    match = _SLICES_PATTERN.match(gpu_instance_profile or '')
+    return int(match.group(1)) if match else 1
+
+
+def mean_activity(times, activity, start_time, end_time):
+    """Mean activity over the window, from the samples in it or else the nearest ones. None if there is no sample."""
+    times, activity = _valid(times, activity)
+    if not len(times):
+        return None
+    inside = (times >= start_time) & (times <= end_time)
+    if np.any(inside):
+        return float(np.mean(activity[inside]))
+    return float(np.mean(np.interp([start_time, end_time], times, activity)))
+
+
+def instance_energy(times, gpu_metrics_dict, instances, start_time, end_time, num_samples=None, num_steps=None):
+    """Estimated energy, average power and energy efficiency of the MIG `instances` of a run over the window, their
+    share of the energy of their GPUs by the graphics engine activity.
+
+    Args:
+        times (Sequence[float]): Times of the GPU metric samples.
+        gpu_metrics_dict (dict): {(gpu_id, gpu_instance_id): {'labels': [labels], field: values}} of the GPU
+            instances, including the siblings of `instances` on their GPUs, as `MetricCollector.gpu_metrics_dict`.
+        instances (Iterable[tuple]): (gpu_id, gpu_instance_id) keys of the MIG instances used by the run.
+        start_time (float): Start of the measurement window, in the clock of `times`.
+        end_time (float): End of the measurement window.
+        num_samples (int): Number of samples processed by the `instances` in the window. Default to None.
+        num_steps (int): Number of steps completed by the `instances` in the window. Default to None.
+
+    Returns:
+        dict: The `instance_` energy in J, average power in W, J per sample / step and samples per J, the share of
+            the GPU energy as `energy_share`, and `instance_energy_method`. None if an instance is not a MIG
+            instance, or the energy or the activity of an instance of its GPUs is not sampled.
+    """
+    duration = end_time - start_time
+    instances = set(instances)
+    if duration <= 0 or not instances.issubset(gpu_metrics_dict.keys()) or any(
+            gpu_instance_id is None for _, gpu_instance_id in instances):
+        return None
+    energy = gpu_energy_total = 0.
+    for gpu_id in sorted({gpu_id for gpu_id, _ in instances}):
+        siblings = {key: value for key, value in gpu_metrics_dict.items() if key != 'time' and key[0] == gpu_id}
+        # every instance reports the energy of the whole GPU
+        gpu_metrics = next(metrics for key, metrics in siblings.items() if key in instances)
+        estimate = gpu_energy(times, gpu_metrics, start_time, end_time)
+        if estimate is None:
+            return None
+        weights, slices = dict(), dict()
+        for key, metrics in siblings.items():
+            if metrics.get(ACTIVITY_FIELD) is None:
+                return None
+            activity = mean_activity(times, metrics[ACTIVITY_FIELD], start_time, end_time)
+            if activity is None:
+                return None
+            slices[key] = compute_slices(metrics['labels'][0].get('GPU_I_PROFILE'))
+            weights[key] = activity * slices[key]
+        if not sum(weights.values()):
+            weights = slices
+        share = sum(weights[key] for key in instances if key in weights) / sum(weights.values())
+        energy += estimate[0] * share
+        gpu_energy_total += estimate[0]
+    summary = {
+        'instance_energy_j': energy, 'instance_avg_power_w': energy / duration,
+        'energy_share': energy / gpu_energy_total if gpu_energy_total else 0.,
+        'instance_energy_method': INSTANCE_ENERGY_METHOD,
+    }
+    if num_samples and energy:
+        summary.update({'instance_j_per_sample': energy / num_samples, 'instance_samples_per_j': num_samples / energy})
+    if num_steps:
+        summary['instance_j_per_step'] = energy / num_steps
+    return summary
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Streaming log-linear (HDR-style) latency histogram.
+
+Each power-of-two range of values is split into `sub_buckets` linear buckets, so a recorded value is
+represented by its bucket midpoint with a relative error of at most 1 / (2 * sub_buckets). Memory is
+bounded by the dynamic range of the recorded values instead of the number of samples, which makes the
+histogram suitable for hour-long profiling runs.
+"""
+import math
+import threading
+from statistics import NormalDist
+from typing import Dict, Iterable, List, Optional
+
+DEFAULT_PERCENTILES = (50, 95, 99)
+
+
+class LatencyHistogram(object):
+    """Thread-safe, mergeable log-linear latency histogram.
+
+    Args:
+        sub_buckets (int): Number of linear buckets per power of two. The relative error of the reported
+            percentiles is bounded by 1 / (2 * sub_buckets). Default to 128 (< 0.4% error).
+        keep_samples (bool): Also keep every raw sample, e.g. for dumping into the result file.
+            Default to False.
+    """
+
+    def __init__(self, sub_buckets: int = 128, keep_samples: bool = False):
+        if sub_buckets <= 0:
+            raise ValueError(f'sub_buckets must be a positive integer, but got {sub_buckets}')
+        self.sub_buckets = sub_buckets
+        self.keep_samples = keep_samples
+
+        self._lock = threading.Lock()
+        # bucket index -> count, values <= 0 are counted in `_zero_count`
+        self._counts: Dict[int, int] = dict()
+        self._zero_count = 0
+        self.count = 0
+        self.sum = 0.
+        self._sum_sq = 0.
+        self.min = math.inf
+        self.max = -math.inf
+        self.samples: List[float] = list()
+
+    def _bucket_index(self, value: float):
+        mantissa, exponent = math.frexp(value)
+        # mantissa is in [0.5, 1)
+        return exponent * self.sub_buckets + int((mantissa - 0.5) * 2 * self.sub_buckets)
+
+    def _bucket_value(self, index: int):
+        exponent, sub_index = divmod(index, self.sub_buckets)
+        mantissa = 0.5 + (sub_index + 0.5) / (2 * self.sub_buckets)
+        return math.ldexp(mantissa, exponent)
+
+    def record(self, value: float, count: int = 1):
+        """Record a value (e.g., a latency in seconds) `count` times."""
+        with self._lock:
+            if value > 0:
+                index = self._bucket_index(value)
+                self._counts[index] = self._counts.get(index, 0) + count
+            else:
+                self._zero_count += count
+            self.count += count
+            self.sum += value * count
+            self._sum_sq += value * value * count
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+            if self.keep_samples:
+                self.samples.extend([value] * count)
+
+    def record_many(self, values: Iterable[float]):
+        for value in values:
+            self.record(value)
+
+    def merge(self, other: 'LatencyHistogram'):
+        """Merge another histogram into this one in place. Both histograms must share `sub_buckets`."""
+        if other.sub_buckets != self.sub_buckets:
+            raise ValueError(
+                f'Cannot merge histograms with different sub_buckets: {self.sub_buckets} vs {other.sub_buckets}'
+            )
+        other = other.snapshot()
+        with self._lock:
+            for index, count in other._counts.items():
+                self._counts[index] = self._counts.get(index, 0) + count
+            self._zero_count += other._zero_count
+            self.count += other.count
+            self.sum += other.sum
+            self._sum_sq += other._sum_sq
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            if self.keep_samples:
+                self.samples.extend(other.samples)
+        return self
+
+    def snapshot(self):
+        """Return a consistent copy of the histogram, which is safe to read while recording continues."""
+        copied = LatencyHistogram(sub_buckets=self.sub_buckets, keep_samples=self.keep_samples)
+        with self._lock:
+            copied._counts = dict(self._counts)
+            copied._zero_count = self._zero_count
+            copied.count = self.count
+            copied.sum = self.sum
+            copied._sum_sq = self._sum_sq
+            copied.min = self.min
+            copied.max = self.max
+            copied.samples = list(self.samples)
+        return copied
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+            self._zero_count = 0
+            self.count = 0
+            self.sum = 0.
+            self._sum_sq = 0.
+            self.min = math.inf
+            self.max = -math.inf
+            self.samples = list()
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return math.nan
+        return self.sum / self.count
+
+    @property
+    def std(self):
+        """Population standard deviation, the same as `np.std`."""
+        if self.count == 0:
+            return math.nan
+        mean = self.mean
+        return math.sqrt(max(self._sum_sq / self.count - mean * mean, 0.))
+
+    def value_at_rank(self, rank: float):
+        """Value of the `rank`-th (0-based, may be fractional) smallest recorded sample."""
+        if self.count == 0:
+            return math.nan
+        if rank <= 0:
+            return self.min
+        if rank >= self.count - 1:
+            return self.max
+        seen = self._zero_count
+        if rank < seen:
+            return min(0., self.max)
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if rank < seen:
+                # clamp to the exact extremes, which are tracked separately
+                return min(max(self._bucket_value(index), self.min), self.max)
+        return self.max
+
+    def percentile(self, q: float):
+        """The q-th percentile (0 <= q <= 100) of the recorded values."""
+        if not 0 <= q <= 100:
+            raise ValueError(f'Percentile should be in [0, 100], but got {q}')
+        return self.value_at_rank(q / 100 * (self.count - 1))
+
+    def mean_ci(self, confidence: float = 0.95):
+        """Normal approximation confidence interval of the mean, assuming independent samples.
+
+        Returns:
+            A tuple of (lower bound, upper bound).
+        """
+        if self.count < 2:
+            return -math.inf, math.inf
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        half_width = z * self.std * math.sqrt(1 / (self.count - 1))
+        return self.mean - half_width, self.mean + half_width
+
+    def percentile_ci(self, q: float, confidence: float = 0.95):
+        """Distribution-free confidence interval of the q-th percentile.
+
+        The bounds are order statistics whose ranks come from the normal approximation of the binomial
+        distribution of the number of samples below the true percentile.
+
+        Returns:
+            A tuple of (lower bound, upper bound).
+        """
+        if self.count == 0:
+            return math.nan, math.nan
+        p = q / 100
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        half_width = z * math.sqrt(self.count * p * (1 - p))
+        return self.value_at_rank(self.count * p - half_width - 1), self.value_at_rank(self.count * p + half_width)
+
+    def percentiles(self, qs: Iterable[float] = DEFAULT_PERCENTILES):
+        """Compute several percentiles with a single pass over a snapshot."""
+        hist = self.snapshot()
+        return {q: hist.percentile(q) for q in qs}
+
+    def summary(self, prefix: str = 'latency', percentiles: Iterable[float] = DEFAULT_PERCENTILES):
+        """Aggregated result in the report format, e.g. `latency_mean`, `latency_std`, `latency_p99`."""
+        hist = self.snapshot()
+        result = {f'{prefix}_mean': hist.mean, f'{prefix}_std': hist.std}
+        for q in percentiles:
+            result[f'{prefix}_p{q:g}'] = hist.percentile(q)
+        return result
+
+    def to_dict(self, include_samples: bool = False):
+        """Serializable (JSON) form of the histogram, which can be restored by `from_dict`.
+
+        Args:
+            include_samples (bool): Also include the raw samples kept by the histogram. Default to False.
+        """
+        hist = self.snapshot()
+        result = {
+            'sub_buckets': hist.sub_buckets, 'count': hist.count, 'sum': hist.sum, 'sum_sq': hist._sum_sq,
+            'min': hist.min if hist.count else None, 'max': hist.max if hist.count else None,
+            'zero_count': hist._zero_count,
+            'buckets': [[index, count] for index, count in sorted(hist._counts.items())],
+        }
+        if include_samples:
+            result['samples'] = hist.samples
+        return result
+
+    @classmethod
+    def from_dict(cls, d: dict, keep_samples: bool = False):
+        hist = cls(sub_buckets=d['sub_buckets'], keep_samples=keep_samples)
+        hist._counts = {int(index): int(count) for index, count in d['buckets']}
+        hist._zero_count = d.get('zero_count', 0)
+        hist.count = d['count']
+        hist.sum = d['sum']
+        hist._sum_sq = d['sum_sq']
+        hist.min = d['min'] if d['min'] is not None else math.inf
+        hist.max = d['max'] if d['max'] is not None else -math.inf
+        if keep_samples:
+            hist.samples = list(d.get('samples', list()))
+        return hist
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(count={self.count}, mean={self.mean}, max={self.max})'
+
+
+def merge_histograms(histograms: Iterable[LatencyHistogram], keep_samples: Optional[bool] = None):
+    """Merge a collection of histograms into a new one."""
+    histograms = list(histograms)
+    if not histograms:
+        return LatencyHistogram(keep_samples=bool(keep_samples))
+    if keep_samples is None:
+        keep_samples = all(hist.keep_samples for hist in histograms)
+    merged = LatencyHistogram(sub_buckets=histograms[0].sub_buckets, keep_samples=keep_samples)
+    for hist in histograms:
+        merged.merge(hist)
+    return merged
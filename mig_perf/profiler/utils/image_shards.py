@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Pre-decoded image shards, so that the training input pipeline does not decode JPEG on the host at every step.
+
+`convert` decodes an ImageFolder dataset (e.g. Places365) once, resizes the shorter side of every image to
+`--size` and center crops it, and writes the uint8 CHW pixels into fixed-size `.npy` shards, which are memory
+mapped when loading. The `index.json` next to the shards records the classes and the shards of each split:
+    root/index.json
+    root/train_00000.npy   uint8 [num_samples, 3, size, size]
+    root/train_labels.npy  int64 [num_samples]
+    root/val_00000.npy
+    root/val_labels.npy
+
+`ShardLoader` gathers a batch of uint8 images from the shards, randomly crops and flips the whole batch at once
+(center crops for validation), and normalizes the batch on the target device after the copy.
+
+Examples:
+    python -m utils.image_shards convert ~/.dataset/places365_standard ~/.dataset/places365_shards
+    python -m utils.image_shards bench ~/.dataset/places365_standard ~/.dataset/places365_shards -b 64
+"""
+import argparse
+import json
+import math
+import os
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from utils.data_hub import split_among_replicas
+
+INDEX_FILE = 'index.json'
+SPLITS = ('train', 'val')
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+def is_shard_root(path):
+    return (Path(path) / INDEX_FILE).exists()
+
+
+class _Decoder(object):
+    """Decode, resize and center crop an image file to uint8 CHW pixels, picklable for the worker pool."""
+
+    def __init__(self, size):
+        self.size = size
+
+    def __call__(self, path):
+        from PIL import Image
+        from torchvision.transforms import functional as F
+
+        with Image.open(path) as image:
+            image = F.center_crop(F.resize(image.convert('RGB'), self.size), self.size)
+            return np.asarray(image, dtype=np.uint8).transpose(2, 0, 1)
+
+
+def convert(src_root, dst_root, size=256, shard_size=4096, num_workers=os.cpu_count()):
+    """Convert the ImageFolder splits under `src_root` into uint8 shards under `dst_root`."""
+    from torchvision.datasets import ImageFolder
+
+    dst_root = Path(dst_root)
+    dst_root.mkdir(exist_ok=True, parents=True)
+    index = {'size': size, 'mean': IMAGENET_MEAN, 'std': IMAGENET_STD, 'splits': dict()}
+    with Pool(num_workers) as pool:
+        for split in SPLITS:
+            split_dir = Path(src_root) / split
+            if not split_dir.exists():
+                continue
+            dataset = ImageFolder(str(split_dir))
+            index['classes'] = dataset.classes
+            paths, labels = zip(*dataset.samples)
+            shards = list()
+            images = pool.imap(_Decoder(size), paths, chunksize=64)
+            for shard_id, start in enumerate(range(0, len(paths), shard_size)):
+                num_samples = min(shard_size, len(paths) - start)
+                file_name = f'{split}_{shard_id:05d}.npy'
+                shard = np.lib.format.open_memmap(
+                    dst_root / file_name, mode='w+', dtype=np.uint8, shape=(num_samples, 3, size, size),
+                )
+                for i in range(num_samples):
+                    shard[i] = next(images)
+                shard.flush()
+                del shard
+                shards.append({'file': file_name, 'num_samples': num_samples})
+                print(f'{split}: {start + num_samples}/{len(paths)} images converted')
+            np.save(dst_root / f'{split}_labels.npy', np.asarray(labels, dtype=np.int64))
+            index['splits'][split] = {'num_samples': len(paths), 'shards': shards}
+    with open(dst_root / INDEX_FILE, 'w') as f:
+        json.dump(index, f, indent=2)
+    return index
+
+
+class ShardLoader(object):
+    """Iterate over batches of a split of the image shards.
+
+    Args:
+        root (str): Root of the shards, containing `index.json`.
+        split (str): 'train' or 'val'.
+        batch_size (int): Batch size.
+        train (bool): Random crop and horizontal flip if True, center crop otherwise.
+        crop_size (int): Output image size.
+        shuffle (bool): Shuffle the samples at each epoch.
+        device (torch.device): Device on which the batch is normalized.
+        seed (int): Random seed of the shuffling and augmentation.
+        num_replicas (int): Number of data parallel ranks, each iterating over its own share of the samples.
+        rank (int): Data parallel rank of this loader.
+    """
+
+    def __init__(self, root, split, batch_size, train=True, crop_size=224, shuffle=True, device=None, seed=0,
+                 num_replicas=1, rank=0):
+        self.root = Path(root)
+        with open(self.root / INDEX_FILE) as f:
+            self.index = json.load(f)
+        split_index = self.index['splits'][split]
+        self.shards = [np.load(self.root / shard['file'], mmap_mode='r') for shard in split_index['shards']]
+        self.offsets = np.cumsum([0] + [shard['num_samples'] for shard in split_index['shards']])
+        self.labels = np.load(self.root / f'{split}_labels.npy')
+        self.num_samples = split_index['num_samples']
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.batch_size = batch_size
+        self.train = train
+        self.crop_size = crop_size
+        self.shuffle = shuffle
+        self.device = torch.device('cpu') if device is None else device
+        # the same sample order on all the ranks, and a different augmentation on each
+        self.order_rng = np.random.default_rng(seed)
+        self.rng = np.random.default_rng(seed + rank)
+        self.mean = torch.tensor(self.index['mean'], device=self.device).view(1, 3, 1, 1) * 255
+        self.std = torch.tensor(self.index['std'], device=self.device).view(1, 3, 1, 1) * 255
+
+    def __len__(self):
+        return math.ceil(math.ceil(self.num_samples / self.num_replicas) / self.batch_size)
+
+    def gather(self, indices):
+        """Read the uint8 images of the sample indices, sorted so that each shard is read sequentially."""
+        indices = np.sort(indices)
+        shard_ids = np.searchsorted(self.offsets, indices, side='right') - 1
+        images = np.concatenate([
+            self.shards[shard_id][indices[shard_ids == shard_id] - self.offsets[shard_id]]
+            for shard_id in np.unique(shard_ids)
+        ])
+        return images, self.labels[indices]
+
+    def augment(self, images):
+        """Crop (and randomly flip) the uint8 batch at once."""
+        size, crop = images.shape[-1], self.crop_size
+        if self.train:
+            top, left = self.rng.integers(0, size - crop + 1, size=2)
+        else:
+            top = left = (size - crop) // 2
+        images = images[..., top:top + crop, left:left + crop]
+        if self.train:
+            flip = self.rng.random(len(images)) < 0.5
+            images = np.where(flip[:, None, None, None], images[..., ::-1], images)
+        return np.ascontiguousarray(images)
+
+    def __iter__(self):
+        order = self.order_rng.permutation(self.num_samples) if self.shuffle else np.arange(self.num_samples)
+        order = split_among_replicas(order, self.num_replicas, self.rank)
+        for start in range(0, len(order), self.batch_size):
+            images, labels = self.gather(order[start:start + self.batch_size])
+            images = torch.from_numpy(self.augment(images))
+            labels = torch.from_numpy(labels)
+            if self.device.type == 'cuda':
+                images, labels = images.pin_memory(), labels.pin_memory()
+            images = images.to(self.device, non_blocking=True).float().sub_(self.mean).div_(self.std)
+            yield images, labels.to(self.device, non_blocking=True)
+
+
+def load_shard_data(batch_size, shard_root, device=None, crop_size=224, num_replicas=1, rank=0):
+    """Train and validation loaders of the image shards, in place of `load_places365_data`. The train data is
+    split among the `num_replicas` data parallel ranks."""
+    train_loader = ShardLoader(
+        shard_root, 'train', batch_size, train=True, crop_size=crop_size, shuffle=True, device=device,
+        num_replicas=num_replicas, rank=rank,
+    )
+    val_loader = ShardLoader(
+        shard_root, 'val', batch_size, train=False, crop_size=crop_size, shuffle=False, device=device,
+    )
+    return train_loader, val_loader
+
+
+def bench_loaders(image_folder_root, shard_root, batch_size, num_batches=20):
+    """Host CPU time per batch of the ImageFolder loader and of the shard loader."""
+    from utils.data_hub import load_places365_data
+
+    loaders = {
+        'image_folder': load_places365_data(batch_size=batch_size, data_root=image_folder_root, num_workers=0)[0],
+        'shards': load_shard_data(batch_size, shard_root)[0],
+    }
+    result = dict()
+    for name, loader in loaders.items():
+        start_cpu, start = time.process_time(), time.perf_counter()
+        count = 0
+        for _ in zip(range(num_batches), loader):
+            count += 1
+        result[name] = {
+            'cpu_time_per_batch': (time.process_time() - start_cpu) / count,
+            'wall_time_per_batch': (time.perf_counter() - start) / count,
+        }
+        print(f'{name}: {result[name]["cpu_time_per_batch"] * 1e3:.2f} ms CPU time per batch')
+    print(f'shards / image_folder CPU time: '
+          f'{result["shards"]["cpu_time_per_batch"] / result["image_folder"]["cpu_time_per_batch"]:.3f}')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-decoded memory-mapped image shards')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    convert_parser = subparsers.add_parser('convert', help='Convert an ImageFolder dataset into shards.')
+    convert_parser.add_argument('src', type=str, help='Root of the ImageFolder dataset, with train/ and val/.')
+    convert_parser.add_argument('dst', type=str, help='Root of the shards.')
+    convert_parser.add_argument('--size', type=int, default=256,
+                                help='Size of the stored square images. Default to 256.')
+    convert_parser.add_argument('--shard-size', type=int, default=4096,
+                                help='Number of images per shard. Default to 4096.')
+    convert_parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(),
+                                help='Number of decoding processes. Default to the CPU count.')
+    bench_parser = subparsers.add_parser('bench', help='Compare the host CPU time of the loaders.')
+    bench_parser.add_argument('src', type=str, help='Root of the ImageFolder dataset.')
+    bench_parser.add_argument('dst', type=str, help='Root of the shards.')
+    bench_parser.add_argument('-b', '--bs', type=int, default=64, help='Batch size. Default to 64.')
+    bench_parser.add_argument('-n', '--num-batches', type=int, default=20, help='Number of batches. Default to 20.')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        convert(args.src, args.dst, size=args.size, shard_size=args.shard_size, num_workers=args.workers)
+    else:
+        bench_loaders(args.src, args.dst, args.bs, num_batches=args.num_batches)
+
+
+if __name__ == '__main__':
+    main()
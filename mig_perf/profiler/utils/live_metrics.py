@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Live rolling-window metrics and SLO-based early termination for the profiling harnesses.
+
+Example:
+    >>> reporter = LiveReporter(window=10, rules=[EarlyStopRule.parse('p99>0.5:10')])
+    >>> reporter.start()
+    >>> while not reporter.should_stop:
+    ...     reporter.record(latency, num_samples=batch_size)
+    >>> reporter.stop()
+    >>> result.update(reporter.result())
+"""
+import math
+import re
+import threading
+import time
+from collections import deque
+from typing import List, Optional
+
+from tqdm import tqdm
+
+from utils.histogram import merge_histograms, LatencyHistogram
+
+
+class RollingMetrics(object):
+    """Per-second buckets of latency, sample and error counts over a sliding time window.
+
+    Args:
+        window (float): Length of the sliding window in seconds. Default to 10.
+    """
+
+    def __init__(self, window: float = 10.):
+        self.window = window
+        self._lock = threading.Lock()
+        # deque of [second, histogram, num_samples, num_errors]
+        self._buckets = deque()
+        self.start_time = time.time()
+
+    def _current_bucket(self, now):
+        second = int(now)
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, LatencyHistogram(), 0, 0])
+        # drop buckets out of the window
+        while self._buckets and self._buckets[0][0] < now - self.window - 1:
+            self._buckets.popleft()
+        return self._buckets[-1]
+
+    def record(self, latency: Optional[float], num_samples: int = 1):
+        """Record a finished request / batch / step with `num_samples` samples. `latency` is None for an
+        untimed step, which only counts towards the throughput."""
+        with self._lock:
+            bucket = self._current_bucket(time.time())
+            if latency is not None:
+                bucket[1].record(latency)
+            bucket[2] += num_samples
+
+    def record_error(self, num_errors: int = 1):
+        with self._lock:
+            bucket = self._current_bucket(time.time())
+            bucket[3] += num_errors
+
+    def snapshot(self, now: Optional[float] = None):
+        """Aggregated metrics over the window.
+
+        Returns:
+            A dictionary of `throughput` (samples/s), `p50`, `p95`, `p99`, `mean` (seconds),
+            `error_rate` (fraction of failed requests), `count` and `errors`.
+        """
+        now = now or time.time()
+        with self._lock:
+            buckets = [b for b in self._buckets if b[0] >= now - self.window]
+            hist = merge_histograms(b[1] for b in buckets)
+            num_samples = sum(b[2] for b in buckets)
+            num_errors = sum(b[3] for b in buckets)
+        # the window can be shorter than configured at the beginning of the run, and spans the empty buckets too
+        window_start = max(self.start_time, now - self.window)
+        span = max(now - window_start, 1e-9)
+        total = hist.count + num_errors
+        return {
+            'throughput': num_samples / span,
+            'p50': hist.percentile(50) if hist.count else math.nan,
+            'p95': hist.percentile(95) if hist.count else math.nan,
+            'p99': hist.percentile(99) if hist.count else math.nan,
+            'mean': hist.mean,
+            'error_rate': num_errors / total if total else 0.,
+            'count': hist.count,
+            'errors': num_errors,
+        }
+
+
+class EarlyStopRule(object):
+    """Abort a run when a rolling metric violates a threshold for a given duration.
+
+    A rule is written as `METRIC{>|<}THRESHOLD[:SECONDS]`, for example:
+        -   `p99>0.1:5`: p99 latency above 100 ms for 5 seconds
+        -   `error_rate>0.05`: more than 5% failed requests
+        -   `throughput<10:30`: less than 10 samples/s for 30 seconds
+    Latencies are in seconds. Supported metrics are the keys returned by `RollingMetrics.snapshot`.
+    """
+    PATTERN = re.compile(r'^\s*(\w+)\s*([<>])\s*([0-9.eE+-]+)\s*(?::\s*([0-9.]+)\s*)?$')
+    METRICS = ('throughput', 'p50', 'p95', 'p99', 'mean', 'error_rate')
+
+    def __init__(self, metric: str, op: str, threshold: float, duration: float = 0.):
+        if metric not in self.METRICS:
+            raise ValueError(f'metric={metric} is not supported, should be one of {self.METRICS}')
+        if op not in ('<', '>'):
+            raise ValueError(f'op should be one of `<` or `>`, but got {op}')
+        self.metric = metric
+        self.op = op
+        self.threshold = threshold
+        self.duration = duration
+        self._violated_since = None
+
+    @classmethod
+    def parse(cls, rule: str):
+        match = cls.PATTERN.match(rule)
+        if not match:
+            raise ValueError(f'Cannot parse early stop rule: {rule}, expecting METRIC{{>|<}}THRESHOLD[:SECONDS]')
+        metric, op, threshold, duration = match.groups()
+        return cls(metric, op, float(threshold), float(duration or 0.))
+
+    def check(self, stats: dict, now: float):
+        """Return True if the rule has been violated for at least `duration` seconds."""
+        value = stats[self.metric]
+        if value is None or math.isnan(value):
+            violated = False
+        elif self.op == '>':
+            violated = value > self.threshold
+        else:
+            violated = value < self.threshold
+        if not violated:
+            self._violated_since = None
+            return False
+        if self._violated_since is None:
+            self._violated_since = now
+        return now - self._violated_since >= self.duration
+
+    def __str__(self):
+        return f'{self.metric}{self.op}{self.threshold:g}' + (f':{self.duration:g}' if self.duration else '')
+
+
+class LiveReporter(object):
+    """Background thread reporting rolling metrics periodically and evaluating early stop rules.
+
+    Args:
+        window (float): Rolling window in seconds. Default to 10.
+        interval (float): Report and rule evaluation interval in seconds. Default to 1.
+        rules (list of EarlyStopRule): Early stop rules, the run is stopped once any of them triggers.
+        verbose (bool): Print the rolling metrics every interval. Default to True.
+    """
+
+    def __init__(self, window: float = 10., interval: float = 1., rules: List[EarlyStopRule] = None,
+                 verbose: bool = True):
+        self.metrics = RollingMetrics(window=window)
+        self.interval = interval
+        self.rules = rules or list()
+        self.verbose = verbose
+
+        self.stop_reason = None
+        self._stop_event = threading.Event()
+        self._early_stop_event = threading.Event()
+        self._thread = threading.Thread(target=self.runner, daemon=True)
+
+    @classmethod
+    def from_args(cls, args):
+        rules = [EarlyStopRule.parse(rule) for rule in (args.early_stop or list())]
+        return cls(window=args.report_window, interval=args.report_interval or 1., rules=rules,
+                   verbose=bool(args.report_interval))
+
+    @property
+    def should_stop(self):
+        return self._early_stop_event.is_set()
+
+    def record(self, latency: Optional[float], num_samples: int = 1):
+        self.metrics.record(latency, num_samples=num_samples)
+
+    def record_error(self, num_errors: int = 1):
+        self.metrics.record_error(num_errors)
+
+    def runner(self):
+        while not self._stop_event.wait(self.interval):
+            now = time.time()
+            stats = self.metrics.snapshot(now)
+            if self.verbose:
+                tqdm.write(
+                    f'[{now - self.metrics.start_time:7.1f}s] throughput: {stats["throughput"]:.2f}/s, '
+                    f'p50: {stats["p50"] * 1000:.2f} ms, p99: {stats["p99"] * 1000:.2f} ms, '
+                    f'error rate: {stats["error_rate"] * 100:.2f}%'
+                )
+            for rule in self.rules:
+                if rule.check(stats, now):
+                    self.stop_reason = f'{rule} (observed {rule.metric}={stats[rule.metric]:g})'
+                    tqdm.write(f'Early stop triggered by rule {self.stop_reason}')
+                    self._early_stop_event.set()
+                    return
+
+    def start(self):
+        self.metrics.start_time = time.time()
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def result(self):
+        """Early stop fields to be merged into the result document."""
+        return {
+            'early_stopped': self.should_stop,
+            'early_stop_reason': self.stop_reason,
+            'early_stop_rules': [str(rule) for rule in self.rules],
+        }
+
+
+def add_live_report_arguments(parser):
+    """Register the live report and early stop arguments on an `argparse.ArgumentParser`."""
+    parser.add_argument('--report-interval', type=float, default=1.,
+                        help='Interval in seconds to print rolling metrics. 0 to disable. Default to 1.')
+    parser.add_argument('--report-window', type=float, default=10.,
+                        help='Rolling window in seconds of the live metrics. Default to 10.')
+    parser.add_argument('--early-stop', type=str, action='append', default=None, metavar='RULE',
+                        help='Early stop rule METRIC{>|<}THRESHOLD[:SECONDS], e.g. "p99>0.1:5" or '
+                             '"error_rate>0.05". Can be specified multiple times.')
+    return parser
@@ -5,10 +5,18 @@ Author: Li Yuanming
 Email: yli056@e.ntu.edu.sg
 Date: 11/3/2020
 """
+import csv
+import json
 import re
 import subprocess
+from pathlib import Path
 from typing import Optional
 
+# the configuration of a training result compared by the report tools, and its step latency
+TRAIN_CONFIG_FIELDS = ('gpu_model_name', 'gpu_instance_profile', 'model_name', 'batch_size', 'sequence_length',
+                       'procs', 'intra_op_threads')
+STEP_LATENCY_METRIC = 'step_latency'
+
 
 def camelcase_to_snakecase(camel_str):
     """
@@ -32,6 +40,82 @@ def consolidate_list_of_dict(l: list, depth=-1):
     return d
 
 
+def print_table(rows, columns):
+    """Print the `columns` of a list of dict rows as a left-aligned text table, floats with 4 decimals."""
+    cells = [columns] + [
+        tuple(f'{row[c]:.4f}' if isinstance(row[c], float) else str(row[c]) for c in columns) for row in rows
+    ]
+    widths = [max(len(cell[i]) for cell in cells) for i in range(len(columns))]
+    for cell in cells:
+        print('  '.join(value.ljust(width) for value, width in zip(cell, widths)).rstrip())
+
+
+def load_results(paths, required_fields=()):
+    """Load the JSON results in the files or directories of `paths`, keeping those with all the `required_fields`."""
+    results = list()
+    for path in paths:
+        path = Path(path)
+        for file in sorted(path.rglob('*.json') if path.is_dir() else [path]):
+            with open(file) as f:
+                result = json.load(f)
+            if all(field in result for field in required_fields):
+                results.append(result)
+    return results
+
+
+def gpu_instance_profile(result):
+    """MIG profile of the GPU instance of a result, or the GPU model name without MIG."""
+    return result['config']['mig'].get('gpu_instance_profile') or result['gpu_model_name']
+
+
+def train_config_key(result):
+    """Values of `TRAIN_CONFIG_FIELDS` of a training result."""
+    fields = dict(result, gpu_instance_profile=gpu_instance_profile(result))
+    return tuple(fields.get(name) for name in TRAIN_CONFIG_FIELDS)
+
+
+def latest_results(results, group_key, key):
+    """Group the results by `group_key(result)`, keeping the latest result of each `key(result)` in a group.
+
+    Returns:
+        dict: {group key: {key: result}}.
+    """
+    groups = dict()
+    for result in results:
+        group = groups.setdefault(group_key(result), dict())
+        result_key = key(result)
+        if result_key not in group or result['start_time'] > group[result_key]['start_time']:
+            group[result_key] = result
+    return groups
+
+
+def add_report_arguments(parser, statistic=True):
+    """Register the arguments shared by the report tools on an `argparse.ArgumentParser`, with `--statistic` of the
+    step latency if `statistic`."""
+    parser.add_argument('results', type=str, nargs='+', help='Result files or directories.')
+    if statistic:
+        parser.add_argument('--statistic', type=str, default='mean', choices=['mean', 'p50', 'p99'],
+                            help='Statistic of the step latency compared. Default to mean.')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Path to save the comparison as CSV.')
+    return parser
+
+
+def report_rows(rows, columns, output=None, empty_message='No result found'):
+    """Print the `columns` of the rows as a table, and save all their fields as CSV to `output` if given. Return
+    whether there is any row."""
+    if not rows:
+        print(empty_message)
+        return False
+    print_table(rows, columns=columns)
+    if output:
+        with open(output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f'Comparison saved as {output}')
+    return True
+
+
 def get_gpu_device_uuid(gpu_id: int, gpu_mig_device_id: Optional[int] = None):
     """nvidia-smi -L"""
     p = subprocess.Popen(['nvidia-smi', '-L'], stdout=subprocess.PIPE)
@@ -47,7 +131,7 @@ def get_gpu_device_uuid(gpu_id: int, gpu_mig_device_id: Optional[int] = None):
             # Found GPU ID line
             current_gpu_id = int(match.group(1))
             # start from this line, all information is about this GPU ID
-            if gpu_mig_device_id is None:
+            if gpu_mig_device_id is None and current_gpu_id == gpu_id:
                 # Return current GPU UUID
                 return line.split('UUID:')[1].strip().rstrip(')')
         elif current_gpu_id == gpu_id:
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Reduced precision and quantized inference models.
+
+`fp16` and `bf16` run the fp32 model under `torch.autocast`. `int8-dynamic` quantizes the weights of the linear
+layers with `torch.ao.quantization.quantize_dynamic`, and `int8-static` quantizes the weights and activations
+by FX graph mode quantization, calibrated on a small fixed sample. The int8 modes run on the quantized CPU kernels.
+`int8-static` is only supported by the image classification models: the Hugging Face models cannot be traced by the
+`torch.fx` symbolic tracer of FX graph mode quantization.
+
+The outputs of a reduced precision model are compared with the fp32 model on a fixed sample, so the result
+tells how much accuracy the precision costs next to its latency.
+"""
+import io
+
+import torch
+from torch import nn
+
+PRECISIONS = ('fp32', 'fp16', 'bf16', 'int8-dynamic', 'int8-static')
+# precisions of the Hugging Face NLP models, which cannot be traced for the FX graph mode static quantization
+NLP_PRECISIONS = ('fp32', 'fp16', 'bf16', 'int8-dynamic')
+STATIC_QUANTIZATION_TASKS = ('image_classification',)
+AUTOCAST_DTYPES = {'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+
+class AutocastModel(nn.Module):
+    """Run the forward of a model under `torch.autocast`.
+
+    Args:
+        model (nn.Module): The fp32 model.
+        device_type (str): 'cuda' or 'cpu'.
+        dtype (torch.dtype): The autocast data type.
+    """
+
+    def __init__(self, model: nn.Module, device_type: str, dtype: torch.dtype):
+        super().__init__()
+        self.model = model
+        self.device_type = device_type
+        self.dtype = dtype
+
+    def forward(self, *args, **kwargs):
+        with torch.autocast(self.device_type, dtype=self.dtype):
+            return self.model(*args, **kwargs)
+
+
+def get_sample_inputs(task: str, model: nn.Module, num_samples: int, seq_len: int = 64, seed: int = 0):
+    """A fixed synthetic sample of the model inputs, for calibration and accuracy comparison."""
+    generator = torch.Generator().manual_seed(seed)
+    if task == 'image_classification':
+        # normalized images
+        return torch.randn(num_samples, 3, 224, 224, generator=generator)
+    return torch.randint(0, model.config.vocab_size, (num_samples, seq_len), generator=generator)
+
+
+def _logits(outputs):
+    return getattr(outputs, 'logits', outputs).float()
+
+
+@torch.no_grad()
+def predict(model: nn.Module, inputs: torch.Tensor, device: torch.device, batch_size: int = 8):
+    """Logits of the model on the inputs, computed in batches."""
+    return torch.cat([
+        _logits(model(batch.to(device))).cpu() for batch in inputs.split(batch_size)
+    ])
+
+
+def compare_outputs(reference: torch.Tensor, outputs: torch.Tensor):
+    """Deviation of the logits from the fp32 reference, and the agreement of their top-1 predictions."""
+    diff = (outputs - reference).abs()
+    return {
+        'max_abs_diff': diff.max().item(), 'mean_abs_diff': diff.mean().item(),
+        'relative_error': (diff.norm() / reference.norm().clamp_min(1e-12)).item(),
+        'top1_agreement': (outputs.argmax(-1) == reference.argmax(-1)).float().mean().item(),
+    }
+
+
+def model_size_mb(model: nn.Module):
+    """Size of the serialized model state, which covers the packed parameters of the quantized modules."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes / 2 ** 20
+
+
+def quantize_static(model: nn.Module, calibration_inputs: torch.Tensor, batch_size: int = 8):
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    prepared = prepare_fx(model, qconfig_mapping, example_inputs=(calibration_inputs[:1],))
+    with torch.no_grad():
+        for batch in calibration_inputs.split(batch_size):
+            prepared(batch)
+    return convert_fx(prepared)
+
+
+def build_precision_model(
+        model: nn.Module, precision: str, device, task: str, seq_len: int = 64,
+        calibration_samples: int = 32, accuracy_samples: int = 32,
+):
+    """Convert an fp32 model to `precision`, and compare it with the fp32 model on a fixed sample.
+
+    Args:
+        model (nn.Module): The fp32 model, already on the device.
+        precision (str): One of `PRECISIONS`.
+        device (utils.device.Device): The device the model runs on.
+        task (str): The inference task, deciding the sample inputs.
+        seq_len (int): Sequence length of the NLP sample inputs.
+        calibration_samples (int): Number of samples calibrating `int8-static`.
+        accuracy_samples (int): Number of samples comparing the outputs with fp32. 0 to skip the comparison.
+
+    Returns:
+        A tuple of the model in eval mode, and a report of its size and accuracy deltas.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f'precision={precision} not supported, should be one of {PRECISIONS}')
+    if precision.startswith('int8') and device.is_cuda:
+        raise ValueError(f'precision={precision} runs on the quantized CPU kernels, run it on CPU')
+    if precision == 'int8-static' and task not in STATIC_QUANTIZATION_TASKS:
+        raise ValueError(
+            f'precision={precision} is not supported for task={task}, as its model cannot be traced by torch.fx, '
+            f'use int8-dynamic instead'
+        )
+    model.eval()
+    report = {'precision': precision, 'fp32_model_size_mb': model_size_mb(model)}
+    if precision == 'fp32':
+        report['model_size_mb'] = report['fp32_model_size_mb']
+        return model, report
+
+    accuracy_inputs = get_sample_inputs(task, model, accuracy_samples, seq_len=seq_len, seed=1)
+    reference = predict(model, accuracy_inputs, device.torch_device) if accuracy_samples else None
+    if precision in AUTOCAST_DTYPES:
+        precision_model = AutocastModel(model, device.type, AUTOCAST_DTYPES[precision])
+    elif precision == 'int8-dynamic':
+        precision_model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    else:
+        calibration_inputs = get_sample_inputs(task, model, calibration_samples, seq_len=seq_len, seed=0)
+        precision_model = quantize_static(model, calibration_inputs)
+    precision_model.eval()
+
+    report['model_size_mb'] = model_size_mb(precision_model)
+    if reference is not None:
+        outputs = predict(precision_model, accuracy_inputs, device.torch_device)
+        report['accuracy_delta'] = compare_outputs(reference, outputs)
+        report['accuracy_samples'] = accuracy_samples
+    return precision_model, report
+
+
+def add_precision_arguments(parser, precisions=PRECISIONS):
+    """Register the precision related arguments on an `argparse.ArgumentParser`, offering `precisions`."""
+    parser.add_argument('--precision', type=str, default='fp32', choices=precisions,
+                        help='Inference precision. fp16 and bf16 use autocast, the int8 precisions quantize the '
+                             'model for CPU. Default to fp32.')
+    parser.add_argument('--calibration-samples', type=int, default=32,
+                        help='Number of samples calibrating the int8-static model. Default to 32.')
+    parser.add_argument('--accuracy-samples', type=int, default=32,
+                        help='Number of fixed samples on which the outputs are compared with fp32. '
+                             'Default to 32, 0 to skip.')
+    return parser
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Background prefetching of the input batches onto the device, so that the host-to-device copy and the data loading
+overlap with the training step instead of running synchronously at its beginning.
+
+A background thread iterates over the wrapped loader and stages up to `depth` batches ahead in a bounded queue. On
+CUDA, the batches are pinned and copied with non-blocking copies on a side stream, and the consumer stream waits on
+the copy of a batch only when it takes the batch. On CPU, the thread overlaps the loading with the step.
+
+The queue occupancy tells the bottleneck: a queue mostly empty when a batch is taken means the step waits for the
+loader, while a queue mostly full means the loader waits for the device.
+
+Examples:
+    >>> train_loader = Prefetcher(train_loader, Device('cuda'), depth=2)
+    >>> for inputs, labels in train_loader:
+    ...     ...
+    >>> train_loader.stats.summary()
+"""
+import threading
+import time
+from collections.abc import Mapping
+from queue import Empty, Full, Queue
+
+import torch
+
+_END = object()
+
+
+class _Error(object):
+    """An exception raised by the loader, re-raised in the consumer."""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def map_tensors(fn, obj):
+    """Apply `fn` to all tensors in a (nested) mapping / list / tuple, keeping the container types."""
+    if isinstance(obj, torch.Tensor):
+        return fn(obj)
+    if isinstance(obj, Mapping):
+        return type(obj)({k: map_tensors(fn, v) for k, v in obj.items()})
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(map_tensors(fn, v) for v in obj)
+    return obj
+
+
+def _pin(tensor: torch.Tensor):
+    if tensor.device.type != 'cpu' or tensor.is_pinned():
+        return tensor
+    return tensor.pin_memory()
+
+
+class PrefetchStats(object):
+    """Counters of a prefetcher, mergeable across the workers and processes.
+
+    Args:
+        depth (int): Max number of staged batches.
+    """
+
+    def __init__(self, depth: int):
+        self.depth = depth
+        self.num_batches = 0
+        self.occupancy_sum = 0
+        self.num_empty = 0
+        self.num_full = 0
+        self.consumer_wait_time = 0.
+        self.producer_wait_time = 0.
+
+    def merge(self, other: 'PrefetchStats'):
+        self.depth = max(self.depth, other.depth)
+        self.num_batches += other.num_batches
+        self.occupancy_sum += other.occupancy_sum
+        self.num_empty += other.num_empty
+        self.num_full += other.num_full
+        self.consumer_wait_time += other.consumer_wait_time
+        self.producer_wait_time += other.producer_wait_time
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, d):
+        stats = cls(d['depth'])
+        vars(stats).update(d)
+        return stats
+
+    def summary(self):
+        """Mean queue occupancy when a batch is taken, the fractions of the batches taken from an empty queue
+        (the step waits for the loader) and put into a full queue (the loader waits for the step), and the
+        total wait times in seconds."""
+        num_batches = max(self.num_batches, 1)
+        return {
+            'prefetch_depth': self.depth, 'num_batches': self.num_batches,
+            'mean_occupancy': self.occupancy_sum / num_batches,
+            'mean_occupancy_ratio': self.occupancy_sum / num_batches / self.depth,
+            'empty_fraction': self.num_empty / num_batches, 'full_fraction': self.num_full / num_batches,
+            'consumer_wait_time': self.consumer_wait_time, 'producer_wait_time': self.producer_wait_time,
+            'bottleneck': 'loader' if self.num_empty > self.num_full else 'device',
+        }
+
+
+class Prefetcher(object):
+    """Iterate over a loader with the next `depth` batches staged on the device by a background thread.
+
+    Args:
+        loader (Iterable): The wrapped loader, e.g. a `torch.utils.data.DataLoader`.
+        device (utils.device.Device): The device the batches are copied to.
+        depth (int): Max number of staged batches. Default to 2.
+    """
+
+    def __init__(self, loader, device, depth: int = 2):
+        if depth < 1:
+            raise ValueError(f'depth={depth} should be at least 1')
+        self.loader = loader
+        self.device = device
+        self.depth = depth
+        self.stats = PrefetchStats(depth)
+        self._queue = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _put(self, item):
+        """Put an item into the queue, giving up once the consumer has stopped. Return False in that case."""
+        if self._queue.full():
+            self.stats.num_full += 1
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                self.stats.producer_wait_time += time.perf_counter() - start
+                return True
+            except Full:
+                continue
+        return False
+
+    def _produce(self):
+        stream = self.device.new_stream()
+        try:
+            with self.device.stream(stream):
+                for batch in self.loader:
+                    event = None
+                    if self.device.is_cuda:
+                        batch = map_tensors(
+                            lambda t: _pin(t).to(self.device.torch_device, non_blocking=True), batch,
+                        )
+                        event = torch.cuda.Event()
+                        event.record(stream)
+                    if not self._put((batch, event)):
+                        return
+        except BaseException as e:
+            self._put(_Error(e))
+            return
+        self._put(_END)
+
+    def _consume(self, item):
+        batch, event = item
+        if event is None:
+            return batch
+        stream = torch.cuda.current_stream()
+        stream.wait_event(event)
+
+        # the batch is allocated on the side stream but used on the consumer stream
+        def record_stream(tensor):
+            if tensor.is_cuda:
+                tensor.record_stream(stream)
+            return tensor
+
+        return map_tensors(record_stream, batch)
+
+    def close(self):
+        """Stop the background thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __iter__(self):
+        self.close()
+        self._stop.clear()
+        self._queue = Queue(maxsize=self.depth)
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+        try:
+            while True:
+                occupancy = self._queue.qsize()
+                start = time.perf_counter()
+                while True:
+                    try:
+                        item = self._queue.get(timeout=0.1)
+                        break
+                    except Empty:
+                        if not self._thread.is_alive() and self._queue.empty():
+                            return
+                if item is _END:
+                    return
+                if isinstance(item, _Error):
+                    raise item.error
+                self.stats.num_batches += 1
+                self.stats.occupancy_sum += occupancy
+                self.stats.num_empty += occupancy == 0
+                self.stats.consumer_wait_time += time.perf_counter() - start
+                yield self._consume(item)
+        finally:
+            self.close()
+
+
+def add_prefetch_arguments(parser):
+    """Register the prefetch related arguments on an `argparse.ArgumentParser`."""
+    parser.add_argument('--prefetch', type=int, default=0,
+                        help='Number of batches staged on the device ahead of the step by a background thread. '
+                             'Default to 0, loading and copying the batch at the beginning of the step.')
+    return parser
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Align the per-request (or per-step) timeline of a benchmark with its GPU metric samples on a common time grid.
+
+The time is cut into windows of `--timeline-window` seconds, aligned on multiples of the window so that the
+timelines of the workers and the processes add up window by window. The requests / steps are aggregated into their
+window as they complete: their number, their number of samples and a coarse histogram of their latencies, so that
+the memory grows with the duration of the run, not with its number of requests / steps. For each window of the
+measurement, the first and the last ones clipped to it, the aggregates give the throughput and the latency
+percentiles, and the GPU metric samples taken in it give the mean graphics engine activity (gract), utilization,
+framebuffer used (fbusd) and power. A window without any metric sample takes the metric interpolated at its center,
+as the metrics are sampled more sparsely than the requests.
+
+Across the windows, the latency p99 and the throughput are correlated with each metric, and the windows of a p99
+spike, above `--spike-factor` times the median p99, are compared with the others. This tells, e.g., whether a p99
+spike lines up with a dip of the SM activity or with a power cap.
+
+Examples:
+    >>> timeline = Timeline(window=1.)
+    >>> timeline.record(time.time(), latency, num_samples=batch_size)
+    >>> summarize_timeline(timeline, metrics['time'], metrics, start_time, finish_time)
+"""
+import math
+import threading
+
+import numpy as np
+
+from utils.histogram import LatencyHistogram
+
+# name in the result -> DCGM field
+TIMELINE_METRICS = {
+    'gract': 'DCGM_FI_PROF_GR_ENGINE_ACTIVE',
+    'gpu_util': 'DCGM_FI_DEV_GPU_UTIL',
+    'fbusd': 'DCGM_FI_DEV_FB_USED',
+    'power': 'DCGM_FI_DEV_POWER_USAGE',
+}
+CORRELATED_NAMES = ('latency_p99', 'throughput')
+# a relative error of the window latency percentiles below 1 / (2 * 32), about 1.6%
+WINDOW_SUB_BUCKETS = 32
+
+
+class Timeline(object):
+    """Per-window aggregates of the completed requests / steps, thread-safe and mergeable across the workers and
+    processes: the number of requests / steps, their number of samples, and a histogram of the latencies of the timed
+    ones. The latency of a request / step not timed is None.
+
+    Args:
+        window (float): Width of the windows in seconds. 0 records nothing. Default to 1.
+        keep_events (bool): Also keep every raw (completion time, latency, number of samples) event, e.g. for
+            dumping into the result file. Default to False.
+    """
+
+    def __init__(self, window: float = 1., keep_events: bool = False):
+        self.window = window
+        self.keep_events = keep_events
+        self._lock = threading.Lock()
+        # window index -> [number of requests / steps, number of samples, LatencyHistogram]
+        self._windows = dict()
+        self.events = list()
+
+    def __len__(self):
+        with self._lock:
+            return sum(stats[0] for stats in self._windows.values())
+
+    def _window_stats(self, index):
+        stats = self._windows.get(index)
+        if stats is None:
+            stats = self._windows[index] = [0, 0, LatencyHistogram(sub_buckets=WINDOW_SUB_BUCKETS)]
+        return stats
+
+    def record(self, completion_time: float, latency, num_samples=1):
+        if not self.window:
+            return
+        with self._lock:
+            stats = self._window_stats(math.floor(completion_time / self.window))
+            stats[0] += 1
+            stats[1] += num_samples
+            if latency is not None:
+                stats[2].record(latency)
+            if self.keep_events:
+                self.events.append((completion_time, latency, num_samples))
+
+    def merge(self, other: 'Timeline'):
+        if other.window != self.window:
+            raise ValueError(f'Cannot merge timelines with different windows: {self.window} vs {other.window}')
+        with other._lock:
+            windows = [(index, stats[0], stats[1], stats[2].snapshot()) for index, stats in other._windows.items()]
+            events = list(other.events)
+        with self._lock:
+            for index, num_completed, num_samples, hist in windows:
+                stats = self._window_stats(index)
+                stats[0] += num_completed
+                stats[1] += num_samples
+                stats[2].merge(hist)
+            if self.keep_events:
+                self.events.extend(events)
+        return self
+
+    def windows(self, first: int, last: int):
+        """(number of requests / steps, number of samples, latency histogram) of the windows `first` to `last`
+        (excluded), in the window index `math.floor(time / window)`."""
+        with self._lock:
+            return [
+                (stats[0], stats[1], stats[2].snapshot()) if stats is not None
+                else (0, 0, LatencyHistogram(sub_buckets=WINDOW_SUB_BUCKETS))
+                for stats in (self._windows.get(index) for index in range(first, last))
+            ]
+
+    def events_to_dict(self):
+        """The raw events kept by `keep_events`, in lists of their completion times, latencies and numbers of
+        samples."""
+        with self._lock:
+            events = sorted(self.events, key=lambda event: event[0])
+        return {
+            'times': [event[0] for event in events], 'latencies': [event[1] for event in events],
+            'num_samples': [event[2] for event in events],
+        }
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'window': self.window, 'keep_events': self.keep_events,
+                'windows': [
+                    [index, stats[0], stats[1], stats[2].to_dict()] for index, stats in sorted(self._windows.items())
+                ],
+                'events': [list(event) for event in self.events],
+            }
+
+    @classmethod
+    def from_dict(cls, d):
+        timeline = cls(window=d['window'], keep_events=d['keep_events'])
+        for index, num_completed, num_samples, hist_dict in d['windows']:
+            timeline._windows[index] = [num_completed, num_samples, LatencyHistogram.from_dict(hist_dict)]
+        timeline.events = [tuple(event) for event in d['events']]
+        return timeline
+
+
+def _to_list(array):
+    return [None if math.isnan(v) else v for v in np.asarray(array, dtype=float).tolist()]
+
+
+def _rank(x):
+    """Ranks of the values, the ties sharing their average rank."""
+    ranks = np.empty(len(x))
+    ranks[np.argsort(x, kind='stable')] = np.arange(len(x))
+    _, inverse, counts = np.unique(x, return_inverse=True, return_counts=True)
+    return (np.bincount(inverse, weights=ranks) / counts)[inverse]
+
+
+def _correlation(x, y):
+    if len(x) < 3 or np.std(x) == 0 or np.std(y) == 0:
+        return None, None
+    return float(np.corrcoef(x, y)[0, 1]), float(np.corrcoef(_rank(x), _rank(y))[0, 1])
+
+
+def bucket_timeline(timeline: Timeline, metric_times, metrics, start_time, end_time):
+    """Aggregate the timeline and the GPU metrics per window of the timeline over [start_time, end_time]. The first
+    and the last windows are clipped to it.
+
+    Returns:
+        dict: {name: values per window} of the window start relative to `start_time`, the number of completed
+            requests / steps, the throughput in samples per second, the latency mean, p50 and p99, and the mean of
+            each GPU metric of `TIMELINE_METRICS` sampled.
+    """
+    window = timeline.window
+    first = math.floor(start_time / window)
+    last = max(math.ceil(end_time / window), first + 1)
+    num_windows = last - first
+    edges = window * np.arange(first, last + 1)
+    lows, highs = np.maximum(edges[:-1], start_time), np.minimum(edges[1:], end_time)
+    widths = highs - lows
+
+    aggregates = timeline.windows(first, last)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        throughput = np.asarray([num_samples for _, num_samples, _ in aggregates], dtype=float) / widths
+    windows = {
+        'window_start': (lows - start_time).tolist(),
+        'num_completed': [num_completed for num_completed, _, _ in aggregates],
+        'throughput': throughput,
+    }
+    latency_stats = np.full((num_windows, 3), np.nan)
+    for i, (_, _, hist) in enumerate(aggregates):
+        if hist.count:
+            latency_stats[i] = hist.mean, hist.percentile(50), hist.percentile(99)
+    windows.update({
+        'latency_mean': latency_stats[:, 0], 'latency_p50': latency_stats[:, 1], 'latency_p99': latency_stats[:, 2],
+    })
+
+    metric_times = np.asarray(metric_times, dtype=float)
+    centers = (lows + highs) / 2
+    for name, field in TIMELINE_METRICS.items():
+        if metrics.get(field) is None:
+            continue
+        values = np.asarray([np.nan if v is None else v for v in metrics[field]], dtype=float)
+        valid = ~np.isnan(values)
+        sample_times, values = metric_times[valid], values[valid]
+        if not len(values):
+            continue
+        in_window = (sample_times >= start_time) & (sample_times <= end_time)
+        # a sample at the end of the last window belongs to it
+        sample_index = np.minimum(np.floor(sample_times / window).astype(int) - first, num_windows - 1)
+        counts = np.bincount(sample_index[in_window], minlength=num_windows)
+        sums = np.bincount(sample_index[in_window], weights=values[in_window], minlength=num_windows)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+        empty = counts == 0
+        means[empty] = np.interp(centers[empty], sample_times, values)
+        windows[name] = means
+    return windows
+
+
+def correlate(windows):
+    """Pearson and Spearman correlations of the latency p99 and the throughput with each GPU metric, across the
+    windows with completed requests / steps."""
+    correlations = dict()
+    completed = np.asarray(windows['num_completed']) > 0
+    for x_name in CORRELATED_NAMES:
+        for y_name in TIMELINE_METRICS:
+            if y_name not in windows:
+                continue
+            x, y = np.asarray(windows[x_name], dtype=float), np.asarray(windows[y_name], dtype=float)
+            valid = completed & ~np.isnan(x) & ~np.isnan(y)
+            pearson, spearman = _correlation(x[valid], y[valid])
+            correlations[f'{x_name}_vs_{y_name}'] = {
+                'pearson': pearson, 'spearman': spearman, 'num_windows': int(valid.sum()),
+            }
+    return correlations
+
+
+def spike_summary(windows, spike_factor=2.):
+    """The windows whose latency p99 exceeds `spike_factor` times the median p99, and the mean of each GPU metric in
+    those windows against the other windows."""
+    p99 = np.asarray(windows['latency_p99'], dtype=float)
+    if np.all(np.isnan(p99)):
+        return None
+    threshold = spike_factor * float(np.nanmedian(p99))
+    with np.errstate(invalid='ignore'):
+        spikes = p99 > threshold
+    others = ~spikes & ~np.isnan(p99)
+    summary = {
+        'threshold': threshold, 'num_spike_windows': int(spikes.sum()),
+        'spike_window_starts': np.asarray(windows['window_start'])[spikes].tolist(),
+    }
+    for name in TIMELINE_METRICS:
+        if name not in windows:
+            continue
+        values = np.asarray(windows[name], dtype=float)
+        summary[name] = {
+            'spike_mean': float(np.nanmean(values[spikes])) if spikes.any() else None,
+            'other_mean': float(np.nanmean(values[others])) if others.any() else None,
+        }
+    return summary
+
+
+def summarize_timeline(timeline: Timeline, metric_times, metrics, start_time, end_time, spike_factor=2.):
+    """The per-window aggregates, with the correlation and the p99 spike summaries, of a benchmark."""
+    windows = bucket_timeline(timeline, metric_times, metrics, start_time, end_time)
+    return {
+        'window': timeline.window, 'num_windows': len(windows['window_start']),
+        'correlations': correlate(windows), 'spikes': spike_summary(windows, spike_factor=spike_factor),
+        'windows': {
+            name: values if isinstance(values, list) else _to_list(values) for name, values in windows.items()
+        },
+    }
+
+
+def add_timeline_arguments(parser):
+    """Register the timeline related arguments on an `argparse.ArgumentParser`."""
+    parser.add_argument('--timeline-window', type=float, default=1.,
+                        help='Width in seconds of the windows the requests / steps and the GPU metrics are '
+                             'aggregated in. 0 to disable. Default to 1.')
+    parser.add_argument('--spike-factor', type=float, default=2.,
+                        help='A window whose latency p99 exceeds this factor times the median p99 is a spike. '
+                             'Default to 2.')
+    return parser
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Pre-tokenized NLP training data, batched by length.
+
+The texts of a split are tokenized once, truncated to `max_seq_len` without padding, and saved as memory-mapped
+arrays under a directory keyed by the dataset, split, tokenizer and `max_seq_len`:
+    root/<dataset>_<split>_<tokenizer>_len<max_seq_len>/
+        tokens.npy   int32 [total number of tokens], the token IDs of all the texts concatenated
+        offsets.npy  int64 [num_samples + 1], the start of each text in `tokens.npy`
+        labels.npy   int64 [num_samples]
+        meta.json
+
+`LengthGroupedBatchSampler` sorts the samples by length within chunks of `bucket_size` batches, so a batch is
+padded only to its own longest sample, while the order of the batches stays random.
+
+Examples:
+    python -m utils.token_cache build -m bert-base-cased --max-seq-len 128
+    python -m utils.token_cache bench -m bert-base-cased --max-seq-len 128 -b 32
+"""
+import argparse
+import json
+import math
+import re
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from utils.data_hub import DEFAULT_DATASET_ROOT, split_among_replicas
+
+DEFAULT_TOKEN_CACHE_ROOT = DEFAULT_DATASET_ROOT / 'token_cache'
+AMAZON_REVIEW_SPLITS = {'train': 'train', 'val': 'test'}
+
+
+def cache_dir(root, dataset_name, split, tokenizer, max_seq_len):
+    """Directory of the cache keyed by the dataset, split, tokenizer and `max_seq_len`."""
+    tokenizer_name = re.sub(r'[^\w.-]', '-', f'{tokenizer.name_or_path}-v{len(tokenizer)}')
+    return Path(root) / f'{dataset_name}_{split}_{tokenizer_name}_len{max_seq_len}'
+
+
+def build_token_cache(path, tokenizer, texts, labels, max_seq_len, chunk_size=10000):
+    """Tokenize the texts in chunks and write the token cache into `path`."""
+    path = Path(path)
+    path.mkdir(exist_ok=True, parents=True)
+    tokens, lengths = list(), list()
+    for start in range(0, len(texts), chunk_size):
+        chunk = list(texts[start:start + chunk_size])
+        input_ids = tokenizer(chunk, truncation=True, max_length=max_seq_len)['input_ids']
+        tokens.extend(np.asarray(ids, dtype=np.int32) for ids in input_ids)
+        lengths.extend(len(ids) for ids in input_ids)
+        print(f'{min(start + chunk_size, len(texts))}/{len(texts)} texts tokenized')
+    np.save(path / 'tokens.npy', np.concatenate(tokens) if tokens else np.zeros(0, dtype=np.int32))
+    np.save(path / 'offsets.npy', np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64))
+    np.save(path / 'labels.npy', np.asarray(labels, dtype=np.int64))
+    meta = {
+        'tokenizer': tokenizer.name_or_path, 'vocab_size': len(tokenizer), 'max_seq_len': max_seq_len,
+        'pad_token_id': tokenizer.pad_token_id or 0, 'num_samples': len(texts), 'num_tokens': int(sum(lengths)),
+    }
+    # written last, marking the cache as complete
+    with open(path / 'meta.json', 'w') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+class LengthGroupedBatchSampler(object):
+    """Random batches of samples with similar lengths.
+
+    Args:
+        lengths (np.ndarray): Length of each sample.
+        batch_size (int): Batch size.
+        shuffle (bool): Shuffle the samples and the batches at each epoch. Default to True.
+        bucket_size (int): Number of batches whose samples are sorted by length together. Default to 100, and 0
+            for random batches without grouping.
+        seed (int): Random seed. Default to 0.
+        num_replicas (int): Number of data parallel ranks, each iterating over its own share of the batches.
+            Default to 1.
+        rank (int): Data parallel rank of this sampler. Default to 0.
+    """
+
+    def __init__(self, lengths, batch_size, shuffle=True, bucket_size=100, seed=0, num_replicas=1, rank=0):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_size = bucket_size
+        # the same seed on all the ranks, which build the same batches and take their own share
+        self.rng = np.random.default_rng(seed)
+        self.num_replicas = num_replicas
+        self.rank = rank
+
+    def __len__(self):
+        return math.ceil(math.ceil(len(self.lengths) / self.batch_size) / self.num_replicas)
+
+    def __iter__(self):
+        return iter(split_among_replicas(self.batches(), self.num_replicas, self.rank))
+
+    def batches(self):
+        """The batches of sample indices of an epoch, for all the ranks."""
+        order = self.rng.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+        if self.bucket_size <= 0:
+            return [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        chunk = self.batch_size * self.bucket_size
+        batches = list()
+        for start in range(0, len(order), chunk):
+            bucket = order[start:start + chunk]
+            # stable sort, keeping the random order among the samples of the same length
+            bucket = bucket[np.argsort(-self.lengths[bucket], kind='stable')]
+            batches.extend(bucket[i:i + self.batch_size] for i in range(0, len(bucket), self.batch_size))
+        if self.shuffle:
+            self.rng.shuffle(batches)
+        return batches
+
+
+class TokenCacheLoader(object):
+    """Iterate over dynamically padded batches of a token cache, in the format of the tokenizer output.
+
+    Args:
+        path (str): Directory of the token cache.
+        batch_size (int): Batch size.
+        shuffle (bool): Shuffle the batches at each epoch. Default to True.
+        group_by_length (bool): Batch samples of similar lengths together. Default to True.
+        bucket_size (int): See `LengthGroupedBatchSampler`. Default to 100.
+        seed (int): Random seed. Default to 0.
+        num_replicas (int): See `LengthGroupedBatchSampler`. Default to 1.
+        rank (int): See `LengthGroupedBatchSampler`. Default to 0.
+    """
+
+    def __init__(self, path, batch_size, shuffle=True, group_by_length=True, bucket_size=100, seed=0,
+                 num_replicas=1, rank=0):
+        path = Path(path)
+        with open(path / 'meta.json') as f:
+            self.meta = json.load(f)
+        self.tokens = np.load(path / 'tokens.npy', mmap_mode='r')
+        self.offsets = np.load(path / 'offsets.npy')
+        self.labels = np.load(path / 'labels.npy')
+        self.lengths = np.diff(self.offsets)
+        self.batch_size = batch_size
+        self.sampler = LengthGroupedBatchSampler(
+            self.lengths, batch_size, shuffle=shuffle, bucket_size=bucket_size if group_by_length else 0, seed=seed,
+            num_replicas=num_replicas, rank=rank,
+        )
+
+    def __len__(self):
+        return len(self.sampler)
+
+    def collate(self, indices):
+        lengths = self.lengths[indices]
+        input_ids = np.full((len(indices), lengths.max()), self.meta['pad_token_id'], dtype=np.int64)
+        attention_mask = np.zeros_like(input_ids)
+        for row, (i, length) in enumerate(zip(indices, lengths)):
+            input_ids[row, :length] = self.tokens[self.offsets[i]:self.offsets[i + 1]]
+            attention_mask[row, :length] = 1
+        return {
+            'input_ids': torch.from_numpy(input_ids), 'attention_mask': torch.from_numpy(attention_mask),
+            'labels': torch.from_numpy(self.labels[indices]),
+        }
+
+    def __iter__(self):
+        for indices in self.sampler:
+            yield self.collate(indices)
+
+
+def load_cached_amazon_review_data(tokenizer, batch_size, max_seq_len, cache_root=DEFAULT_TOKEN_CACHE_ROOT,
+                                   num_replicas=1, rank=0):
+    """Train and validation loaders of the pre-tokenized Amazon reviews, in place of `load_amazon_review_data`.
+    The cache is built on the first use. The train data is split among the `num_replicas` data parallel ranks."""
+    loaders = list()
+    for split, dataset_split in AMAZON_REVIEW_SPLITS.items():
+        path = cache_dir(cache_root, 'amazon_reviews_multi', split, tokenizer, max_seq_len)
+        if not (path / 'meta.json').exists():
+            from datasets import load_dataset
+
+            print(f'Build the token cache at {path}...')
+            dataset = load_dataset('amazon_reviews_multi', 'all_languages', split=dataset_split)
+            build_token_cache(
+                path, tokenizer, dataset['review_body'], np.asarray(dataset['stars']) - 1, max_seq_len,
+            )
+        train = split == 'train'
+        loaders.append(TokenCacheLoader(
+            path, batch_size, shuffle=train, group_by_length=train,
+            num_replicas=num_replicas if train else 1, rank=rank if train else 0,
+        ))
+    return tuple(loaders)
+
+
+def bench_loaders(tokenizer, batch_size, max_seq_len, cache_root=DEFAULT_TOKEN_CACHE_ROOT, num_batches=100):
+    """Tokens/s and padding ratio of the original loader, and of the token cache with and without grouping."""
+    from utils.data_hub import load_amazon_review_data
+
+    train_loader = load_cached_amazon_review_data(tokenizer, batch_size, max_seq_len, cache_root=cache_root)[0]
+    path = cache_dir(cache_root, 'amazon_reviews_multi', 'train', tokenizer, max_seq_len)
+    loaders = {
+        'tokenize_in_collate': load_amazon_review_data(tokenizer, batch_size, max_seq_len, num_workers=0)[0],
+        'token_cache': TokenCacheLoader(path, batch_size, group_by_length=False),
+        'token_cache_grouped': train_loader,
+    }
+    result = dict()
+    for name, loader in loaders.items():
+        num_tokens, num_padded_tokens, count = 0, 0, 0
+        start = time.perf_counter()
+        for _, batch in zip(range(num_batches), loader):
+            num_tokens += batch['attention_mask'].sum().item()
+            num_padded_tokens += batch['attention_mask'].numel()
+            count += 1
+        duration = time.perf_counter() - start
+        result[name] = {
+            'tokens_per_second': num_tokens / duration, 'padding_ratio': 1 - num_tokens / num_padded_tokens,
+            'batches_per_second': count / duration,
+        }
+        print(f'{name}: {result[name]["tokens_per_second"]:.0f} tokens/s, '
+              f'padding ratio {result[name]["padding_ratio"]:.3f}')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-tokenized NLP training data cache')
+    parser.add_argument('command', type=str, choices=['build', 'bench'],
+                        help='`build` the cache of the Amazon reviews, or `bench` the loaders.')
+    parser.add_argument('-m', '--model', type=str, required=True, help='Name of the model (tokenizer).')
+    parser.add_argument('--max-seq-len', type=int, default=64, help='Max sequence length. Default to 64.')
+    parser.add_argument('--root', type=str, default=str(DEFAULT_TOKEN_CACHE_ROOT),
+                        help=f'Root of the token caches. Default to {DEFAULT_TOKEN_CACHE_ROOT}')
+    parser.add_argument('-b', '--bs', type=int, default=32, help='Batch size of `bench`. Default to 32.')
+    parser.add_argument('-n', '--num-batches', type=int, default=100,
+                        help='Number of batches of `bench`. Default to 100.')
+    args = parser.parse_args()
+
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    if args.command == 'build':
+        load_cached_amazon_review_data(tokenizer, args.bs, args.max_seq_len, cache_root=args.root)
+    else:
+        bench_loaders(tokenizer, args.bs, args.max_seq_len, cache_root=args.root, num_batches=args.num_batches)
+
+
+if __name__ == '__main__':
+    main()
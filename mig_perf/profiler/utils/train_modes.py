@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Training step optimizations, switched on one by one so that their effect on the step time and memory can be measured.
+
+- `--amp fp16` runs the forward under `torch.autocast` in float16 and scales the loss with a `GradScaler`, and
+  `--amp bf16` autocasts to bfloat16, which needs no loss scaling.
+- `--channels-last` converts a CNN and its input images to the channels last (NHWC) memory format.
+- `--set-to-none` releases the gradients in `zero_grad` instead of filling them with zeros.
+- `--optimizer-impl foreach` updates all the parameters by multi-tensor kernels, and `fused` by a single fused kernel.
+  An implementation the optimizer of the workload does not accept in the installed PyTorch, e.g. `fused` SGD before
+  PyTorch 2.0, is rejected when parsing the arguments.
+- `--grad-accum-steps k` accumulates the gradients of k micro-batches of `--bs` before an optimizer step, so that
+  the effective batch size is k times `--bs`.
+- `--activation-checkpointing` recomputes the activations of each block in the backward instead of keeping them,
+  trading the compute for the memory. The running statistics of the batch normalization layers are restored after
+  the recomputation, so that they are updated once per step as without checkpointing.
+"""
+import argparse
+import contextlib
+import inspect
+import itertools
+
+import torch
+from torch import nn
+from torch.utils.checkpoint import checkpoint
+
+AMP_MODES = ('off', 'fp16', 'bf16')
+AMP_DTYPES = {'fp16': torch.float16, 'bf16': torch.bfloat16}
+OPTIMIZER_IMPLS = ('default', 'foreach', 'fused')
+
+
+def autocast(amp: str, device):
+    """The autocast context of the forward and the loss, a null context if AMP is off."""
+    if amp not in AMP_DTYPES:
+        return contextlib.nullcontext()
+    return torch.autocast(device.type, dtype=AMP_DTYPES[amp])
+
+
+def build_grad_scaler(amp: str, device):
+    """The loss scaler of fp16 AMP, None for the other modes."""
+    if amp != 'fp16':
+        return None
+    if hasattr(torch, 'amp') and hasattr(torch.amp, 'GradScaler'):
+        return torch.amp.GradScaler(device.type)
+    if not device.is_cuda:
+        raise ValueError('amp=fp16 on CPU requires a PyTorch version with `torch.amp.GradScaler`')
+    return torch.cuda.amp.GradScaler()
+
+
+def optimizer_kwargs(optimizer_impl: str):
+    """Keyword arguments of a `torch.optim` optimizer selecting its implementation."""
+    if optimizer_impl not in OPTIMIZER_IMPLS:
+        raise ValueError(f'optimizer_impl={optimizer_impl} not supported, should be one of {OPTIMIZER_IMPLS}')
+    if optimizer_impl == 'default':
+        return dict()
+    return {optimizer_impl: True}
+
+
+def supported_optimizer_impls(optimizer_cls):
+    """The `OPTIMIZER_IMPLS` accepted by the keyword arguments of `optimizer_cls` in the installed PyTorch."""
+    parameters = inspect.signature(optimizer_cls).parameters
+    return tuple(impl for impl in OPTIMIZER_IMPLS if impl == 'default' or impl in parameters)
+
+
+def optimizer_impl_type(optimizer_cls):
+    """The `type` of the `--optimizer-impl` argument, rejecting the implementations `optimizer_cls` lacks."""
+    supported = supported_optimizer_impls(optimizer_cls)
+
+    def parse(value):
+        if value in OPTIMIZER_IMPLS and value not in supported:
+            raise argparse.ArgumentTypeError(
+                f'{value} is not supported by {optimizer_cls.__module__}.{optimizer_cls.__name__} in PyTorch '
+                f'{torch.__version__}, should be one of {supported}'
+            )
+        return value
+
+    return parse
+
+
+def group_micro_batches(batches, grad_accum_steps: int):
+    """Group the batches into lists of `grad_accum_steps` micro-batches, the inputs of an optimizer step."""
+    batches = iter(batches)
+    return iter(lambda: list(itertools.islice(batches, grad_accum_steps)), [])
+
+
+class CheckpointedBlock(nn.Module):
+    """Run a block with `torch.utils.checkpoint`, keeping only its inputs for the backward.
+
+    The recomputation of the block in the backward would update the running statistics of its batch normalization
+    layers a second time in train mode. They are saved before the recomputation and restored after it, which does
+    not change the recomputed outputs, as a batch normalization layer in train mode normalizes by the batch
+    statistics.
+
+    Args:
+        block (nn.Module): The checkpointed block.
+    """
+
+    def __init__(self, block: nn.Module):
+        super().__init__()
+        self.block = block
+        self.norm_layers = [
+            module for module in block.modules()
+            if isinstance(module, nn.modules.batchnorm._BatchNorm) and module.track_running_stats
+        ]
+
+    @contextlib.contextmanager
+    def preserve_running_stats(self):
+        buffers = [
+            buffer for module in self.norm_layers
+            for buffer in (module.running_mean, module.running_var, module.num_batches_tracked) if buffer is not None
+        ]
+        saved = [buffer.clone() for buffer in buffers]
+        try:
+            yield
+        finally:
+            with torch.no_grad():
+                for buffer, value in zip(buffers, saved):
+                    buffer.copy_(value)
+
+    def forward(self, *args):
+        if not torch.is_grad_enabled():
+            return self.block(*args)
+        if not (self.training and self.norm_layers):
+            return checkpoint(self.block, *args, use_reentrant=False)
+        calls = itertools.count()
+
+        def run(*inputs):
+            if next(calls) == 0:
+                return self.block(*inputs)
+            # recomputation in the backward
+            with self.preserve_running_stats():
+                return self.block(*inputs)
+
+        return checkpoint(run, *args, use_reentrant=False)
+
+
+def apply_activation_checkpointing(model: nn.Module):
+    """Checkpoint each residual block of a torchvision ResNet, or each encoder layer of a Hugging Face model.
+    Return the model."""
+    if getattr(model, 'supports_gradient_checkpointing', False):
+        try:
+            model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={'use_reentrant': False})
+        except TypeError:
+            # transformers before 4.35
+            model.gradient_checkpointing_enable()
+        return model
+    layers = [getattr(model, f'layer{i}', None) for i in range(1, 5)]
+    if all(isinstance(layer, nn.Sequential) for layer in layers):
+        for layer in layers:
+            for i, block in enumerate(layer):
+                layer[i] = CheckpointedBlock(block)
+        return model
+    raise ValueError(f'Activation checkpointing of {type(model).__name__} is not supported')
+
+
+def get_train_modes(args):
+    """The training optimizations of the parsed arguments, recorded in the result."""
+    return {
+        'amp': args.amp, 'channels_last': getattr(args, 'channels_last', False), 'set_to_none': args.set_to_none,
+        'optimizer_impl': args.optimizer_impl, 'grad_accum_steps': args.grad_accum_steps,
+        'activation_checkpointing': args.activation_checkpointing,
+    }
+
+
+def train_mode_name_parts(modes):
+    """File name parts of the training optimizations other than the defaults."""
+    parts = list()
+    if modes['amp'] != 'off':
+        parts.append(f'amp-{modes["amp"]}')
+    if modes['channels_last']:
+        parts.append('cl')
+    if modes['set_to_none']:
+        parts.append('stn')
+    if modes['optimizer_impl'] != 'default':
+        parts.append(modes['optimizer_impl'])
+    if modes.get('grad_accum_steps', 1) > 1:
+        parts.append(f'ga{modes["grad_accum_steps"]}')
+    if modes.get('activation_checkpointing'):
+        parts.append('ckpt')
+    return parts
+
+
+def add_train_mode_arguments(parser, optimizer_cls, channels_last=False):
+    """Register the training optimization arguments on an `argparse.ArgumentParser`, for a workload trained by
+    `optimizer_cls`. `--channels-last` is only registered for the CNN workloads."""
+    parser.add_argument('--amp', type=str, default='off', choices=AMP_MODES,
+                        help='Automatic mixed precision. fp16 scales the loss with a GradScaler. Default to off.')
+    if channels_last:
+        parser.add_argument('--channels-last', action='store_true',
+                            help='Convert the model and the input images to the channels last memory format.')
+    parser.add_argument('--set-to-none', action='store_true',
+                        help='Set the gradients to None in `zero_grad` instead of zeroing them.')
+    parser.add_argument('--optimizer-impl', type=optimizer_impl_type(optimizer_cls), default='default',
+                        choices=OPTIMIZER_IMPLS,
+                        help='Implementation of the optimizer step: the PyTorch default, the multi-tensor '
+                             '`foreach` or the `fused` kernels. Default to default.')
+    parser.add_argument('--grad-accum-steps', type=int, default=1,
+                        help='Number of micro-batches of --bs accumulated per optimizer step. Default to 1.')
+    parser.add_argument('--activation-checkpointing', action='store_true',
+                        help='Recompute the activations of each ResNet block / Transformer layer in the backward.')
+    return parser